@@ -0,0 +1,90 @@
+import time
+
+from crewai import LLM
+from litellm.integrations.custom_logger import CustomLogger
+
+from agents.llm_cache import LLM_CACHE_ENABLED, llm_cache
+from metrics import LLM_CALLS, LLM_REQUEST_SECONDS, LLM_TOKENS
+from ratelimit import gemini_limiter
+from replay import LLM_BACKEND, llm_recordings
+
+
+class TokenUsageCallback(CustomLogger):
+    """Counts the tokens of the model responses of one agent"""
+
+    def __init__(self, agent_role: str):
+        super().__init__()
+        self.agent_role = agent_role
+
+    def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        ### crewai passes {"usage": ...} per response, litellm itself passes the whole response which is skipped
+        usage = response_obj.get("usage") if isinstance(response_obj, dict) else None
+        for kind in ("prompt", "completion"):
+            tokens = getattr(usage, f"{kind}_tokens", None)
+            if tokens:
+                LLM_TOKENS.labels(self.agent_role, kind).inc(tokens)
+
+
+class CachedLLM(LLM):
+    """LLM which looks up the persistent cache before calling the model.
+
+    Each agent gets its own instance so that the agent role is part of the key.
+    """
+
+    def __init__(self, *args, agent_role: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agent_role = agent_role
+
+    def llm_cache_key(self, messages) -> str:
+        return llm_cache.make_key(self.model, self.agent_role, messages)
+
+    def _observe(self, source: str, start: float):
+        LLM_CALLS.labels(self.agent_role, source).inc()
+        LLM_REQUEST_SECONDS.labels(self.agent_role, source).observe(time.perf_counter() - start)
+
+    def _model_call(self, messages, tools, callbacks, available_functions, **kwargs):
+        """Real model call within the shared rate limit, with its latency and token usage in the metrics"""
+        start = time.perf_counter()
+        callbacks = list(callbacks or []) + [TokenUsageCallback(self.agent_role)]
+        try:
+            ### the Gemini budget is shared by every process, see ratelimit.py
+            return gemini_limiter.call(lambda: LLM.call(self, messages, tools, callbacks, available_functions, **kwargs))
+        finally:
+            self._observe("model", start)
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        if LLM_BACKEND != "live":
+            ### recording has to see every model call and replay sets its own latency, so no cache there
+            start = time.perf_counter()
+            response = llm_recordings.call(
+                self.llm_cache_key(messages),
+                {"model": self.model, "agent_role": self.agent_role, "messages": messages},
+                lambda: self._model_call(messages, tools, callbacks, available_functions, **kwargs),
+                lambda: f"Thought: replayed without a recording\nFinal Answer: Stub answer of the {self.agent_role}.",
+            )
+            if LLM_BACKEND == "replay":
+                self._observe("replay", start)
+            return response
+
+        ### function calls have side effects, they are never served from the cache
+        if not LLM_CACHE_ENABLED or available_functions:
+            return self._model_call(messages, tools, callbacks, available_functions, **kwargs)
+
+        start = time.perf_counter()
+        key = self.llm_cache_key(messages)
+        try:
+            cached = llm_cache.get(key)
+        except Exception as e:
+            print(f"Warning: Could not read LLM cache: {str(e)}")
+            cached = None
+        if cached is not None:
+            self._observe("cache", start)
+            return cached
+
+        response = self._model_call(messages, tools, callbacks, available_functions, **kwargs)
+        if isinstance(response, str) and response:
+            try:
+                llm_cache.put(key, self.model, self.agent_role, response)
+            except Exception as e:
+                print(f"Warning: Could not write LLM cache: {str(e)}")
+        return response
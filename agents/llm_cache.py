@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
+
+from database.models import SessionLocal, utcnow
+from database.operations import get_llm_cache_entry, save_llm_cache_entry, evict_llm_cache_entries
+
+### Cache configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+### eviction is done after this many new entries instead of on every write
+LLM_CACHE_EVICT_EVERY = 100
+
+_NUMBER = re.compile(r"\d+\.\d+")
+_SPACES = re.compile(r"[ \t]+")
+
+
+def _canonical_number(match: re.Match) -> str:
+    ### 15.00, 15.0 and 15 are the same analyte value
+    return format(float(match.group()), ".10g")
+
+
+def normalize_prompt(messages: Union[str, List[Dict[str, str]]]) -> str:
+    """Normalize the prompt so that identical reports give identical keys"""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+
+    normalized = []
+    for message in messages:
+        content = str(message.get("content", ""))
+        content = _NUMBER.sub(_canonical_number, content)
+        content = "\n".join(_SPACES.sub(" ", line).strip() for line in content.splitlines())
+        normalized.append({"role": message.get("role"), "content": content.strip()})
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+
+class LLMCache:
+    """Persistent cache of LLM completions stored in the SQLite database, used by agents/cached_llm.py"""
+
+    def __init__(self, ttl_seconds: int = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, agent_role: str, messages: Union[str, List[Dict[str, str]]]) -> str:
+        raw = json.dumps([model, agent_role, normalize_prompt(messages)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _min_created_at(self) -> datetime:
+        return utcnow() - timedelta(seconds=self.ttl_seconds)
+
+    def get(self, key: str) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            entry = get_llm_cache_entry(db, key, self._min_created_at())
+            response = entry.response if entry else None
+        finally:
+            db.close()
+
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key: str, model: str, agent_role: str, response: str):
+        db = SessionLocal()
+        try:
+            save_llm_cache_entry(db, key, model, agent_role, response)
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % LLM_CACHE_EVICT_EVERY == 0
+            if evict:
+                evict_llm_cache_entries(db, self._min_created_at(), self.max_entries)
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": LLM_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+
+llm_cache = LLMCache()
@@ -1,104 +1,117 @@
 import os
+from typing import Dict
 from dotenv import load_dotenv
 load_dotenv()
 
 api_key = os.getenv("GEMINI_API_KEY")
 
-from crewai import LLM
 from crewai import Agent
 
 from tools.medical_tools import blood_test_tool, nutrition_tool, exercise_tool, search_tool
+from agents.cached_llm import CachedLLM
 
 
-llm = LLM(
-    model="gemini/gemini-2.0-flash",
-    temperature=0.7,
-    api_key= api_key
-)
+def create_llm(agent_role: str) -> CachedLLM:
+    """Gemini LLM behind the persistent response cache, one per agent role"""
+    return CachedLLM(
+        model="gemini/gemini-2.0-flash",
+        temperature=0.7,
+        api_key= api_key,
+        agent_role=agent_role
+    )
 
-# creating a doctor agent
-doctor = Agent(
-    role="Senior Medical Doctor and Blood Test Analyst",
-    goal="Provide accurate and professional medical analysis of blood test reports based on the user query: {query}",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You are an experienced medical doctor with 15+ years of experience in laboratory medicine "
-        "and blood test interpretation. You have specialized training in clinical pathology and "
-        "are known for your thorough, evidence-based approach to medical analysis. "
-        "You always provide accurate interpretations based on established medical references "
-        "and guidelines. You emphasize the importance of consulting with healthcare providers "
-        "for proper medical advice and never provide definitive diagnoses without proper "
-        "clinical correlation."
-    ),
-    tools=[blood_test_tool, search_tool],
-    llm=llm,
-    max_iter=3,
-    max_rpm=10,
-    allow_delegation=True
-)
 
-#creating a blood report verifier report agent
-verifier = Agent(
-    role="Medical Document Verifier",
-    goal="Verify and validate that uploaded documents are legitimate blood test reports and extract key information accurately",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You are a medical records specialist with expertise in laboratory report formats "
-        "and medical documentation. You have extensive experience in identifying authentic "
-        "medical documents and extracting relevant clinical information. You are meticulous "
-        "in your verification process and ensure that only valid blood test reports are "
-        "processed for medical analysis. You can identify various laboratory report formats "
-        "and understand medical terminology and reference ranges."
-    ),
-    tools=[blood_test_tool],
-    llm=llm,
-    max_iter=2,
-    max_rpm=10,
-    allow_delegation=False
-)
+def create_agents() -> Dict[str, Agent]:
+    """The four agents of the medical crew, a new set on every call.
 
-# creating a clinical nutritionist agent
-nutritionist = Agent(
-    role="Licensed Clinical Nutritionist",
-    goal="Provide evidence-based nutritional recommendations based on blood test results and established nutritional science",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You are a licensed clinical nutritionist with a Master's degree in Nutrition Science "
-        "and 10+ years of experience in medical nutrition therapy. You specialize in interpreting "
-        "laboratory values and their relationship to nutritional status. Your recommendations "
-        "are always based on peer-reviewed research and established clinical guidelines. "
-        "You work closely with physicians and other healthcare providers to develop "
-        "comprehensive nutrition care plans. You emphasize the importance of individualized "
-        "nutrition therapy and the need for professional supervision in implementing dietary changes."
-    ),
-    tools=[nutrition_tool, search_tool],
-    llm=llm,
-    max_iter=2,
-    max_rpm=10,
-    allow_delegation=False
-)
+    Agents keep per run state (tool results, token counts), so every pooled crew gets its own set.
+    """
+    # creating a doctor agent
+    doctor = Agent(
+        role="Senior Medical Doctor and Blood Test Analyst",
+        goal="Provide accurate and professional medical analysis of blood test reports based on the user query: {query}",
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You are an experienced medical doctor with 15+ years of experience in laboratory medicine "
+            "and blood test interpretation. You have specialized training in clinical pathology and "
+            "are known for your thorough, evidence-based approach to medical analysis. "
+            "You always provide accurate interpretations based on established medical references "
+            "and guidelines. You emphasize the importance of consulting with healthcare providers "
+            "for proper medical advice and never provide definitive diagnoses without proper "
+            "clinical correlation."
+        ),
+        tools=[blood_test_tool, search_tool],
+        llm=create_llm("Senior Medical Doctor and Blood Test Analyst"),
+        max_iter=3,
+        allow_delegation=True
+    )
 
-# Ccreatign a exercise physiologist agent
-exercise_specialist = Agent(
-    role="Certified Exercise Physiologist",
-    goal="Develop safe and effective exercise recommendations based on blood test results and individual health status",
-    verbose=True,
-    memory=True,
-    backstory=(
-        "You are a certified exercise physiologist with advanced degrees in Exercise Science "
-        "and Clinical Exercise Physiology. You have 12+ years of experience working with "
-        "individuals with various health conditions and understand how laboratory values "
-        "relate to exercise capacity and safety. You always prioritize safety and work "
-        "within the scope of practice, recommending medical clearance when appropriate. "
-        "Your exercise prescriptions are evidence-based and tailored to individual health "
-        "status, fitness level, and medical conditions."
-    ),
-    tools=[exercise_tool, search_tool],
-    llm=llm,
-    max_iter=2,
-    max_rpm=10,
-    allow_delegation=False
-)
\ No newline at end of file
+    #creating a blood report verifier report agent
+    verifier = Agent(
+        role="Medical Document Verifier",
+        goal="Verify and validate that uploaded documents are legitimate blood test reports and extract key information accurately",
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You are a medical records specialist with expertise in laboratory report formats "
+            "and medical documentation. You have extensive experience in identifying authentic "
+            "medical documents and extracting relevant clinical information. You are meticulous "
+            "in your verification process and ensure that only valid blood test reports are "
+            "processed for medical analysis. You can identify various laboratory report formats "
+            "and understand medical terminology and reference ranges."
+        ),
+        tools=[blood_test_tool],
+        llm=create_llm("Medical Document Verifier"),
+        max_iter=2,
+        allow_delegation=False
+    )
+
+    # creating a clinical nutritionist agent
+    nutritionist = Agent(
+        role="Licensed Clinical Nutritionist",
+        goal="Provide evidence-based nutritional recommendations based on blood test results and established nutritional science",
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You are a licensed clinical nutritionist with a Master's degree in Nutrition Science "
+            "and 10+ years of experience in medical nutrition therapy. You specialize in interpreting "
+            "laboratory values and their relationship to nutritional status. Your recommendations "
+            "are always based on peer-reviewed research and established clinical guidelines. "
+            "You work closely with physicians and other healthcare providers to develop "
+            "comprehensive nutrition care plans. You emphasize the importance of individualized "
+            "nutrition therapy and the need for professional supervision in implementing dietary changes."
+        ),
+        tools=[nutrition_tool, search_tool],
+        llm=create_llm("Licensed Clinical Nutritionist"),
+        max_iter=2,
+        allow_delegation=False
+    )
+
+    # Ccreatign a exercise physiologist agent
+    exercise_specialist = Agent(
+        role="Certified Exercise Physiologist",
+        goal="Develop safe and effective exercise recommendations based on blood test results and individual health status",
+        verbose=True,
+        memory=True,
+        backstory=(
+            "You are a certified exercise physiologist with advanced degrees in Exercise Science "
+            "and Clinical Exercise Physiology. You have 12+ years of experience working with "
+            "individuals with various health conditions and understand how laboratory values "
+            "relate to exercise capacity and safety. You always prioritize safety and work "
+            "within the scope of practice, recommending medical clearance when appropriate. "
+            "Your exercise prescriptions are evidence-based and tailored to individual health "
+            "status, fitness level, and medical conditions."
+        ),
+        tools=[exercise_tool, search_tool],
+        llm=create_llm("Certified Exercise Physiologist"),
+        max_iter=2,
+        allow_delegation=False
+    )
+
+    return {
+        "verifier": verifier,
+        "doctor": doctor,
+        "nutritionist": nutritionist,
+        "exercise_specialist": exercise_specialist,
+    }
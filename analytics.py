@@ -0,0 +1,233 @@
+"""Population statistics over the stored blood values.
+
+The analyte columns are read with one raw query straight into a float matrix (no ORM objects),
+then every statistic is computed with NumPy on whole columns. The matrix is kept in memory and
+the next call only reads the new reports and the ones an update or a delete touched since.
+"""
+import json
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from extractor import ANALYTES
+
+ANALYTE_NAMES = [analyte.name for analyte in ANALYTES]
+PERCENTILES = (5, 25, 50, 75, 95)
+
+### cohorts, age buckets by their lower bound and the gender codes of the query below
+AGE_BUCKETS = [(0, "<18"), (18, "18-29"), (30, "30-39"), (40, "40-49"), (50, "50-59"), (60, "60-69"), (70, "70+")]
+GENDERS = ["unknown", "male", "female"]
+
+_COHORT_SQL = """
+    SELECT r.id, u.age,
+           CASE lower(u.gender) WHEN 'male' THEN 1 WHEN 'm' THEN 1 WHEN 'female' THEN 2 WHEN 'f' THEN 2 ELSE 0 END,
+           {columns}
+    FROM blood_test_reports r LEFT JOIN users u ON u.id = r.user_id
+    WHERE {where}
+    ORDER BY r.id
+"""
+
+### inserts only append rows to the matrix, the triggers log the reports every other change touches so the
+### cache reloads just those rows; the log keeps the last ANALYTICS_CHANGES_KEPT changes, a cache older than
+### that reloads everything
+ANALYTICS_CHANGES_KEPT = 10000
+ANALYTICS_CHANGES_DDL = [
+    "CREATE TABLE analytics_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, report_id INTEGER, user_id INTEGER)",
+    """CREATE TRIGGER analytics_changes_report_update AFTER UPDATE ON blood_test_reports BEGIN
+        INSERT INTO analytics_changes (report_id) VALUES (OLD.id);
+        INSERT INTO analytics_changes (report_id) SELECT NEW.id WHERE NEW.id != OLD.id;
+    END""",
+    """CREATE TRIGGER analytics_changes_report_delete AFTER DELETE ON blood_test_reports BEGIN
+        INSERT INTO analytics_changes (report_id) VALUES (OLD.id);
+    END""",
+    """CREATE TRIGGER analytics_changes_user_insert AFTER INSERT ON users BEGIN
+        INSERT INTO analytics_changes (user_id) VALUES (NEW.id);
+    END""",
+    """CREATE TRIGGER analytics_changes_user_update AFTER UPDATE OF age, gender ON users BEGIN
+        INSERT INTO analytics_changes (user_id) VALUES (NEW.id);
+    END""",
+    f"""CREATE TRIGGER analytics_changes_prune AFTER INSERT ON analytics_changes BEGIN
+        DELETE FROM analytics_changes WHERE seq <= NEW.seq - {ANALYTICS_CHANGES_KEPT};
+    END""",
+]
+### the change counter of the first version, replaced by the change log
+_OLD_VERSION_DDL = [
+    "DROP TRIGGER IF EXISTS analytics_version_report_update",
+    "DROP TRIGGER IF EXISTS analytics_version_report_delete",
+    "DROP TRIGGER IF EXISTS analytics_version_user_update",
+    "DROP TABLE IF EXISTS analytics_version",
+]
+
+
+def create_analytics_changes(connection):
+    """Create the change log and its triggers if they do not exist yet"""
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'analytics_changes'"
+    ).first()
+    if exists:
+        return
+    for statement in _OLD_VERSION_DDL + ANALYTICS_CHANGES_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def _load(connection, where: str, parameters) -> np.ndarray:
+    columns = ", ".join(f"r.{name}" for name in ANALYTE_NAMES)
+    ### plain DBAPI cursor, NumPy converts its tuples much faster than SQLAlchemy rows
+    cursor = connection.connection.cursor()
+    try:
+        rows = cursor.execute(_COHORT_SQL.format(columns=columns, where=where), parameters).fetchall()
+    finally:
+        cursor.close()
+    if not rows:
+        return np.empty((0, len(ANALYTE_NAMES) + 3))
+    return np.array(rows, dtype=np.float64)
+
+
+def load_cohort_matrix(connection, after_id: int = 0) -> np.ndarray:
+    """Id, age, gender code and the analyte values of the reports after after_id, as a float matrix (NULL is NaN)"""
+    return _load(connection, "r.id > ?", (after_id,))
+
+
+def load_changed_rows(connection, report_ids: Sequence[int], user_ids: Sequence[int]) -> np.ndarray:
+    """Rows of load_cohort_matrix of the given reports and of every report of the given users"""
+    return _load(
+        connection,
+        "r.id IN (SELECT value FROM json_each(?)) OR r.user_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(report_ids)), json.dumps(list(user_ids))),
+    )
+
+
+class CohortMatrixCache:
+    """In memory cohort matrix of one database, refreshed incrementally"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matrix = np.empty((0, len(ANALYTE_NAMES) + 3))
+        self._seq = None
+
+    def _apply(self, connection, changes) -> np.ndarray:
+        """Replace the rows of the changed reports and users by their current values, deleted reports are dropped"""
+        report_ids = {report_id for report_id, _ in changes if report_id is not None}
+        user_ids = {user_id for _, user_id in changes if user_id is not None}
+        rows = load_changed_rows(connection, report_ids, user_ids)
+        stale = np.isin(self._matrix[:, 0], np.concatenate([np.fromiter(report_ids, np.float64, len(report_ids)), rows[:, 0]]))
+        matrix = np.concatenate([self._matrix[~stale], rows])
+        return matrix[np.argsort(matrix[:, 0], kind="stable")] if len(rows) else matrix
+
+    def get(self, connection) -> np.ndarray:
+        with self._lock:
+            ### read before the rows, a change made while they load is applied again on the next call
+            seq, oldest = connection.exec_driver_sql("SELECT COALESCE(MAX(seq), 0), MIN(seq) FROM analytics_changes").first()
+            if self._seq is None or (oldest is not None and oldest > self._seq + 1):
+                self._matrix = load_cohort_matrix(connection)
+                self._seq = seq
+                return self._matrix
+            last_id = int(self._matrix[-1, 0]) if len(self._matrix) else 0
+            new_rows = load_cohort_matrix(connection, last_id)
+            if len(new_rows):
+                self._matrix = np.concatenate([self._matrix, new_rows])
+            if seq > self._seq:
+                changes = connection.exec_driver_sql(
+                    "SELECT report_id, user_id FROM analytics_changes WHERE seq > ? AND seq <= ?", (self._seq, seq)
+                ).fetchall()
+                self._matrix = self._apply(connection, changes)
+                self._seq = seq
+            return self._matrix
+
+
+_matrix_caches: Dict[str, CohortMatrixCache] = {}
+
+
+def abnormal_mask(values: np.ndarray, analytes: Sequence[str], age: np.ndarray, gender: np.ndarray) -> np.ndarray:
+    """True where a value is outside the reference range of its row's age and gender, False for normal and missing values.
+
+    The ranges are the nutrition rules (rules.py) which flag a value, so the cohorts use the gender and
+    age specific thresholds of the recommendations and the screening.
+    """
+    ### rules imports this module for the cohort matrix
+    from rules import ENGINES
+    engine = ENGINES["nutrition"]
+    columns = [ANALYTE_NAMES.index(name) for name in analytes]
+    full = np.full((values.shape[0], len(ANALYTE_NAMES)), np.nan)
+    full[:, columns] = values
+    ### missing values fire no rule, so they are never abnormal
+    findings = engine.evaluate(full, age, gender) & ~engine.normal
+    abnormal = np.zeros(values.shape, dtype=bool)
+    for i, column in enumerate(columns):
+        abnormal[:, i] = findings[:, engine.columns == column].any(axis=1)
+    return abnormal
+
+
+def cohort_codes(age: np.ndarray, gender: np.ndarray) -> np.ndarray:
+    """Cohort index of each row: age bucket (last one is unknown age) times the number of genders plus gender"""
+    bounds = np.array([lower for lower, _ in AGE_BUCKETS[1:]], dtype=np.float64)
+    bucket = np.searchsorted(bounds, age, side="right")
+    bucket[np.isnan(age)] = len(AGE_BUCKETS)
+    return bucket * len(GENDERS) + gender.astype(np.int64)
+
+
+def _rate(numerator, denominator):
+    return None if not denominator else round(float(numerator) / float(denominator), 4)
+
+
+def cohort_statistics(matrix: np.ndarray, analytes: Sequence[str] = ANALYTE_NAMES, bins: int = 20) -> Dict:
+    """Per analyte percentiles, abnormal rate and histogram, and abnormal rates per age and gender cohort.
+
+    matrix has the columns of load_cohort_matrix, analytes selects the ones to compute.
+    """
+    age, gender = matrix[:, 1], matrix[:, 2]
+    values = matrix[:, [3 + ANALYTE_NAMES.index(name) for name in analytes]]
+    present = ~np.isnan(values)
+    abnormal = abnormal_mask(values, analytes, age, gender)
+
+    summary = {}
+    for i, name in enumerate(analytes):
+        column = values[present[:, i], i]
+        if column.size == 0:
+            summary[name] = {"count": 0}
+            continue
+        counts, edges = np.histogram(column, bins=bins)
+        summary[name] = {
+            "count": int(column.size),
+            "mean": round(float(column.mean()), 4),
+            "std": round(float(column.std()), 4),
+            "percentiles": {f"p{p}": round(float(v), 4) for p, v in zip(PERCENTILES, np.percentile(column, PERCENTILES))},
+            "abnormal_rate": _rate(abnormal[:, i].sum(), column.size),
+            "histogram": {"edges": np.round(edges, 4).tolist(), "counts": counts.tolist()},
+        }
+
+    ### one bincount per analyte gives the counts of every cohort at once
+    codes = cohort_codes(age, gender)
+    size = (len(AGE_BUCKETS) + 1) * len(GENDERS)
+    reports = np.bincount(codes, minlength=size)
+    measured = np.stack([np.bincount(codes, weights=present[:, i], minlength=size) for i in range(len(analytes))], axis=1)
+    flagged = np.stack([np.bincount(codes, weights=abnormal[:, i], minlength=size) for i in range(len(analytes))], axis=1)
+
+    age_labels = [label for _, label in AGE_BUCKETS] + ["unknown"]
+    cohorts: List[Dict] = []
+    for code in np.flatnonzero(reports):
+        cohorts.append({
+            "age_bucket": age_labels[code // len(GENDERS)],
+            "gender": GENDERS[code % len(GENDERS)],
+            "reports": int(reports[code]),
+            "abnormal_rate": {name: _rate(flagged[code, i], measured[code, i]) for i, name in enumerate(analytes)},
+        })
+
+    return {"reports": int(matrix.shape[0]), "analytes": summary, "cohorts": cohorts}
+
+
+def cohort_matrix(engine) -> np.ndarray:
+    """Cohort matrix of every report of the database, from its in memory cache"""
+    cache = _matrix_caches.setdefault(str(engine.url), CohortMatrixCache())
+    with engine.connect() as connection:
+        return cache.get(connection)
+
+
+def population_analytics(engine, analytes: Optional[Sequence[str]] = None, bins: int = 20) -> Dict:
+    """Load the blood values of every report and compute the cohort statistics"""
+    analytes = list(analytes or ANALYTE_NAMES)
+    unknown = [name for name in analytes if name not in ANALYTE_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown analytes: {', '.join(unknown)}")
+    return cohort_statistics(cohort_matrix(engine), analytes, bins)
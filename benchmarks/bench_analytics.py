@@ -0,0 +1,128 @@
+"""Time the vectorized cohort analytics against loading ORM objects and looping in Python.
+
+Run with: python -m benchmarks.bench_analytics [reports]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from analytics import ANALYTE_NAMES, create_analytics_changes, population_analytics
+from database.models import Base, BloodTestReport, User
+from report_context import reference_rules
+from rules import COMPARATORS
+
+### mean and standard deviation of the synthetic values
+DISTRIBUTIONS = {
+    "hemoglobin": (14.5, 1.6), "total_cholesterol": (190, 35), "hdl_cholesterol": (50, 12),
+    "ldl_cholesterol": (110, 30), "triglycerides": (140, 60), "fasting_glucose": (95, 15),
+    "hba1c": (5.5, 0.6), "vitamin_b12": (420, 150), "vitamin_d": (70, 25), "tsh": (2.2, 1.2),
+}
+
+
+def populate(engine, reports: int, users: int, seed: int = 42):
+    """Insert synthetic users and reports with about 10% of missing values"""
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO users (id, name, email, age, gender) VALUES (?, ?, ?, ?, ?)",
+            [(i, f"user {i}", f"user{i}@example.com", rng.choice([None] + list(range(16, 90))),
+              rng.choice(["male", "female", "Male", None])) for i in range(1, users + 1)],
+        )
+        columns = ", ".join(ANALYTE_NAMES)
+        placeholders = ", ".join("?" for _ in range(len(ANALYTE_NAMES) + 2))
+        rows = []
+        for i in range(reports):
+            values = [None if rng.random() < 0.1 else round(rng.gauss(*DISTRIBUTIONS[name]), 2) for name in ANALYTE_NAMES]
+            rows.append((rng.randint(1, users), f"report_{i}.pdf", *values))
+        conn.exec_driver_sql(f"INSERT INTO blood_test_reports (user_id, file_name, {columns}) VALUES ({placeholders})", rows)
+
+
+def populate_more(engine, after: int):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO blood_test_reports (user_id, file_name, hemoglobin) VALUES (1, ?, 14.0)", (f"report_{after}.pdf",)
+        )
+
+
+def change_some(engine):
+    """What a crew run does to the reports (update_blood_values) and a deleted report"""
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE blood_test_reports SET hemoglobin = 9.5 WHERE id = 10")
+        conn.exec_driver_sql("DELETE FROM blood_test_reports WHERE id = 20")
+
+
+def orm_analytics(session):
+    """Baseline: ORM objects and Python loops, only the per analyte percentiles and abnormal rates"""
+    users = {user.id: user for user in session.query(User).all()}
+    values = defaultdict(list)
+    abnormal = defaultdict(int)
+    cohorts = defaultdict(int)
+    bounds = {}
+    for report in session.query(BloodTestReport).all():
+        user = users.get(report.user_id)
+        age, gender = (user.age, user.gender) if user else (None, None)
+        cohorts[(age // 10 if age else None, gender)] += 1
+        if (age, gender) not in bounds:
+            bounds[(age, gender)] = reference_rules(age, gender)
+        for name in ANALYTE_NAMES:
+            value = getattr(report, name)
+            if value is None:
+                continue
+            values[name].append(value)
+            if any(COMPARATORS[rule.comparator](value, rule.threshold) for rule in bounds[(age, gender)].get(name, [])):
+                abnormal[name] += 1
+    return {name: (sorted(column)[len(column) // 2], abnormal[name] / len(column)) for name, column in values.items()}
+
+
+def main(reports: int = 300_000):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            create_analytics_changes(conn)
+        populate(engine, reports, users=max(1, reports // 20))
+
+        start = time.perf_counter()
+        result = population_analytics(engine)
+        cold = time.perf_counter() - start
+
+        ### a new report since the last call, only that row is read
+        populate_more(engine, reports)
+        start = time.perf_counter()
+        result = population_analytics(engine)
+        vectorized = time.perf_counter() - start
+
+        ### an update and a delete, only those rows are read again
+        change_some(engine)
+        start = time.perf_counter()
+        result = population_analytics(engine)
+        changed = time.perf_counter() - start
+
+        session = sessionmaker(bind=engine)()
+        start = time.perf_counter()
+        baseline = orm_analytics(session)
+        orm = time.perf_counter() - start
+        session.close()
+        engine.dispose()
+
+    for name in ANALYTE_NAMES:
+        median, rate = baseline[name]
+        assert np.isclose(result["analytes"][name]["percentiles"]["p50"], median, atol=0.01), name
+        assert np.isclose(result["analytes"][name]["abnormal_rate"], rate, atol=1e-4), name
+
+    print(f"{reports} reports, {len(result['cohorts'])} cohorts")
+    print(f"vectorized, cold:   {cold * 1000:.0f} ms")
+    print(f"vectorized, cached: {vectorized * 1000:.0f} ms")
+    print(f"after an update and a delete: {changed * 1000:.0f} ms")
+    print(f"orm loop:           {orm * 1000:.0f} ms ({orm / vectorized:.1f}x slower than cached)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300_000)
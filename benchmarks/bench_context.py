@@ -0,0 +1,54 @@
+"""Compare the size of the report context given to the agents: full pdf text against the compact summary.
+
+Tokens are estimated at 4 characters per token, the exact count depends on the model tokenizer. The kept
+column is the share of the distinct numbers of the pdf text which the compact context still carries (it only
+drops the page numbers and repeated headers), and extracted the analytes of the table read into its rows.
+Run with: python -m benchmarks.bench_context [pdf ...]
+"""
+import glob
+import os
+import re
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import write_report_pdf
+from extractor import ANALYTES
+from report_context import estimate_tokens, format_summary, report_lines, split_pages, summary_rows
+from tools.report_cache import parse_report
+
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def compare(path: str):
+    report = parse_report(path)
+    start = time.perf_counter()
+    summary = format_summary(report)
+    summary_ms = (time.perf_counter() - start) * 1000
+    full, compact = estimate_tokens(report["text"]), estimate_tokens(summary)
+    numbers = {float(number) for number in NUMBER.findall(report["text"])}
+    kept = len(numbers & {float(number) for number in NUMBER.findall(summary)}) / max(len(numbers), 1)
+    _, pages, _ = split_pages(report_lines(report["text"]))
+    rows, _ = summary_rows([line for page in pages for line in page])
+    print(f"{os.path.basename(path):28s} {report['pages']:5d} {full:12d} {compact:15d} {full / max(compact, 1):8.1f}x"
+          f" {kept:7.1%} {len(rows):10d} {summary_ms:10.3f}")
+
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob("data/*.pdf"))
+    print(f"{'report':28s} {'pages':>5s} {'full tokens':>12s} {'compact tokens':>15s} {'ratio':>9s} {'kept':>7s}"
+          f" {'extracted':>10s} {'summary ms':>10s}")
+    for path in paths:
+        compare(path)
+    if not sys.argv[1:]:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "synthetic_20_pages.pdf")
+            write_report_pdf(path, pages=20, seed=1)
+            compare(path)
+    print(f"\nextracted counts the {len(ANALYTES)} analytes of the table which the lab prints as 'label value unit range',"
+          " every other line of the report follows the table.")
+    print("Every tool call of blood_test_reader pays these tokens again, and every task when the table covers the report.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare the single pass extractor with the previous one regex per analyte version.
+
+Run with: python -m benchmarks.bench_extraction
+"""
+import re
+import timeit
+
+from extractor import extract_blood_values
+from benchmarks.synthetic import generate_report
+
+### previous implementation, one re.search over the whole report per analyte
+LEGACY_PATTERNS = [
+    ("hemoglobin", r'Hemoglobin.*?(\d+\.?\d*)\s*g/dL', re.IGNORECASE),
+    ("total_cholesterol", r'Cholesterol, Total.*?(\d+\.?\d*)\s*mg/dL', 0),
+    ("hdl_cholesterol", r'HDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', 0),
+    ("ldl_cholesterol", r'LDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', 0),
+    ("triglycerides", r'Triglycerides.*?(\d+\.?\d*)\s*mg/dL', 0),
+    ("fasting_glucose", r'Glucose Fasting.*?(\d+\.?\d*)\s*mg/dL', 0),
+    ("hba1c", r'HbA1c.*?(\d+\.?\d*)\s*%', 0),
+    ("vitamin_b12", r'VITAMIN B12.*?(\d+\.?\d*)\s*pg/mL', 0),
+    ("vitamin_d", r'VITAMIN D.*?(\d+\.?\d*)\s*nmol/L', 0),
+    ("tsh", r'TSH.*?(\d+\.?\d*)\s*μIU/mL', 0),
+]
+
+
+def legacy_extract_blood_values(report_content: str) -> dict:
+    values = {}
+    for name, pattern, flags in LEGACY_PATTERNS:
+        match = re.search(pattern, report_content, flags)
+        if match:
+            values[name] = float(match.group(1))
+    return values
+
+
+def bench(func, text: str, number: int) -> float:
+    """Best time per call in milliseconds"""
+    return min(timeit.repeat(lambda: func(text), number=number, repeat=5)) / number * 1000
+
+
+def main():
+    print(f"{'pages':>6} {'chars':>10} {'legacy ms':>10} {'single ms':>10} {'speedup':>8}")
+    for pages in (1, 10, 50, 200):
+        text, expected = generate_report(pages=pages)
+        assert extract_blood_values(text) == expected
+        assert legacy_extract_blood_values(text) == expected
+
+        number = max(1, 200 // pages)
+        legacy = bench(legacy_extract_blood_values, text, number)
+        single = bench(extract_blood_values, text, number)
+        print(f"{pages:>6} {len(text):>10} {legacy:>10.3f} {single:>10.3f} {legacy / single:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Time the startup of the API: importing main, and building the crew on top of it.
+
+Each measure runs in a new interpreter so nothing is already imported.
+Run with: python -m benchmarks.bench_import [runs]
+"""
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ("crewai", "crewai_tools", "litellm", "langchain", "langchain_community")
+
+### prints the time and the modules loaded, as json on the last line
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+result = {"import_main": imported, "modules": len(sys.modules),
+          "heavy": [name for name in %r if name in sys.modules]}
+if %r:
+    from crew.loader import load_crew
+    start = time.perf_counter()
+    load_crew()
+    result["load_crew"] = time.perf_counter() - start
+    result["modules_with_crew"] = len(sys.modules)
+print(json.dumps(result))
+"""
+
+
+def probe(with_crew: bool) -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE % (HEAVY_MODULES, with_crew)], capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "probe failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [probe(with_crew=False) for _ in range(runs)]
+    best = min(results, key=lambda r: r["import_main"])
+    print(f"import main        best {best['import_main']:.3f}s of {runs}, {best['modules']} modules")
+    print(f"heavy modules      {', '.join(best['heavy']) or 'none'}")
+
+    try:
+        crew = min((probe(with_crew=True) for _ in range(runs)), key=lambda r: r["load_crew"])
+    except RuntimeError as e:
+        print(f"load_crew          failed: {e}")
+        return
+    print(f"load_crew          best {crew['load_crew']:.3f}s of {runs}, {crew['modules_with_crew']} modules")
+    print(f"first analysis     pays {crew['load_crew']:.3f}s with CREW_WARMUP=lazy, nothing once the background warmup is done")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare the per-analysis write cost of one commit per row with the single transaction version.
+
+Run with: python -m benchmarks.bench_persistence
+
+Each commit in SQLite's default rollback journal mode syncs the journal and the database
+file to disk, so the number of commits is the number of fsync rounds of one analysis.
+"""
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base
+from database.operations import create_blood_test_report, save_analysis_result, save_report_with_analyses
+
+BLOOD_VALUES = {"hemoglobin": 14.2, "total_cholesterol": 190.0, "hdl_cholesterol": 52.0, "vitamin_d": 61.0}
+ANALYSES = {
+    "medical": "MEDICAL ANALYSIS ... NUTRITIONAL ANALYSIS ... EXERCISE PLAN ...",
+    "nutrition": "MEDICAL ANALYSIS ... NUTRITIONAL ANALYSIS ... EXERCISE PLAN ...",
+    "exercise": "MEDICAL ANALYSIS ... NUTRITIONAL ANALYSIS ... EXERCISE PLAN ...",
+}
+
+
+def legacy_store(db):
+    """Previous path, the report then each analysis with their own commit"""
+    report = create_blood_test_report(db, 1, "report.pdf", "uploads/report.pdf", "query", BLOOD_VALUES)
+    for analysis_type, text in ANALYSES.items():
+        save_analysis_result(db, report.id, analysis_type, text)
+
+
+def batched_store(db):
+    save_report_with_analyses(db, 1, "report.pdf", "uploads/report.pdf", "query", BLOOD_VALUES, ANALYSES)
+
+
+def bench(store, runs: int):
+    """Median and p95 latency in milliseconds and commits per analysis, on a fresh database file"""
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        commits = [0]
+        event.listen(engine, "commit", lambda conn: commits.__setitem__(0, commits[0] + 1))
+
+        db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        latencies = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            store(db)
+            latencies.append((time.perf_counter() - start) * 1000)
+        db.close()
+        engine.dispose()
+
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], commits[0] / runs
+
+
+def main(runs: int = 200):
+    print(f"{'version':>10} {'median ms':>10} {'p95 ms':>10} {'commits':>8}")
+    for name, store in (("legacy", legacy_store), ("batched", batched_store)):
+        median, p95, commits = bench(store, runs)
+        print(f"{name:>10} {median:>10.3f} {p95:>10.3f} {commits:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Time the batch rule screening against running the rules report by report.
+
+Run with: python -m benchmarks.bench_rules [reports]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from analytics import ANALYTE_NAMES, create_analytics_changes
+from benchmarks.bench_analytics import populate
+from database.models import Base, BloodTestReport, User
+from rules import ENGINES, PLANS, recommend, screen_population
+
+
+def report_by_report(session):
+    """Baseline: ORM objects and one rule evaluation per report and plan, counting the messages"""
+    users = {user.id: user for user in session.query(User).all()}
+    messages = 0
+    for report in session.query(BloodTestReport).all():
+        user = users.get(report.user_id)
+        values = {name: getattr(report, name) for name in ANALYTE_NAMES}
+        for plan in PLANS:
+            messages += len(recommend(plan, values, user.age if user else None, user.gender if user else None))
+    return messages
+
+
+def main(reports: int = 100_000):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            create_analytics_changes(conn)
+        populate(engine, reports, users=max(1, reports // 20))
+
+        start = time.perf_counter()
+        result = screen_population(engine)
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = screen_population(engine)
+        cached = time.perf_counter() - start
+
+        session = sessionmaker(bind=engine)()
+        start = time.perf_counter()
+        report_by_report(session)
+        loop = time.perf_counter() - start
+        session.close()
+        engine.dispose()
+
+    assert result["reports"] == reports
+    print(f"{reports} reports, {sum(len(engine.rules) for engine in ENGINES.values())} rules")
+    print(f"batch, cold:      {cold * 1000:.0f} ms")
+    print(f"batch, cached:    {cached * 1000:.0f} ms")
+    print(f"report by report: {loop * 1000:.0f} ms ({loop / cold:.1f}x slower than cold)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
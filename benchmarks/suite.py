@@ -0,0 +1,369 @@
+"""Micro benchmarks of the hot paths, checked against a JSON baseline.
+
+Run with: python -m benchmarks.suite [--save] [--tolerance 0.5] [--only extract,db.search]
+
+Covers the extractor on synthetic reports of growing size, the pdf reader tool on the sample
+pdfs and a large synthetic one (parsed again and cached), the nutrition and exercise rule tools,
+and every function of database/operations.py on a seeded database. The first run (or --save)
+writes the baseline, later runs exit with status 1 when a case is slower than baseline * (1 + tolerance).
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.synthetic import generate_blood_values, generate_report, write_report_pdf
+from database import operations
+from database.models import Base, BloodTestReport, engine_options, set_sqlite_pragmas, utcnow
+from extractor import extract_blood_values
+
+BASELINE_PATH = os.getenv("BENCH_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+### best of REPEAT rounds still moves by a few tens of percent between runs on a busy machine
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.5"))
+REPEAT = 7
+
+### seeded database
+SEED_USERS = 200
+SEED_REPORTS_PER_USER = 25
+SEED_LLM_ENTRIES = 500
+SEED_JOBS = 100
+
+PDF_FILES = {"blood_test_report": os.path.join("data", "blood_test_report.pdf"), "sample": os.path.join("data", "sample.pdf")}
+SYNTHETIC_PDF_PAGES = 20
+
+
+class Case(NamedTuple):
+    """setup returns the function to time, it is called number times per round"""
+    name: str
+    setup: Callable[[], Callable[[], object]]
+    number: int
+
+
+def measure(case: Case) -> float:
+    """Best time per call in milliseconds over REPEAT rounds"""
+    func = case.setup()
+    func()
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for _ in range(case.number):
+            func()
+        best = min(best, (time.perf_counter() - start) / case.number * 1000)
+    return best
+
+
+def extraction_cases() -> List[Case]:
+    cases = []
+    for pages in (1, 10, 50, 200):
+        def setup(pages=pages):
+            text, expected = generate_report(pages=pages)
+            assert extract_blood_values(text) == expected
+            return lambda: extract_blood_values(text)
+        cases.append(Case(f"extract.synthetic_{pages}_pages", setup, max(1, 200 // pages)))
+    return cases
+
+
+class Workspace:
+    """Temporary directory of the suite: report cache, synthetic pdfs and the seeded database"""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="bench_suite_")
+        self._engine = None
+        self._session_factory = None
+        self._db = None
+
+    def pdf(self, name: str, pages: int) -> str:
+        path = os.path.join(self.directory, f"{name}.pdf")
+        if not os.path.exists(path):
+            write_report_pdf(path, pages=pages)
+        return path
+
+    def db(self):
+        """New session for each case, like a request, so the identity map does not grow over the suite"""
+        if self._engine is None:
+            self._engine = seed_database(os.path.join(self.directory, "bench.db"))
+            self._session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self._engine)
+        if self._db is not None:
+            self._db.close()
+        self._db = self._session_factory()
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+        if self._engine is not None:
+            self._engine.dispose()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def pdf_cases(workspace: Workspace) -> List[Case]:
+    from tools.medical_tools import blood_test_tool
+    from tools.report_cache import report_cache
+
+    ### keep the cache files of the suite out of the project cache
+    report_cache.cache_dir = os.path.join(workspace.directory, "report_cache")
+    files = dict(PDF_FILES)
+    files[f"synthetic_{SYNTHETIC_PDF_PAGES}_pages"] = None
+
+    cases = []
+    for name, path in files.items():
+        def resolve(name=name, path=path):
+            return path or workspace.pdf(name, pages=SYNTHETIC_PDF_PAGES)
+
+        def parse(resolve=resolve):
+            path = resolve()
+            def run():
+                report_cache.clear()
+                shutil.rmtree(report_cache.cache_dir, ignore_errors=True)
+                return blood_test_tool._run(path)
+            return run
+
+        def cached(resolve=resolve):
+            path = resolve()
+            assert not blood_test_tool._run(path).startswith("Error")
+            return lambda: blood_test_tool._run(path)
+
+        cases.append(Case(f"pdf.parse.{name}", parse, 1 if path is None else 3))
+        cases.append(Case(f"pdf.cached.{name}", cached, 100))
+    return cases
+
+
+def rules_cases() -> List[Case]:
+    from rules import recommend
+    from tools.medical_tools import exercise_tool, nutrition_tool
+
+    text, values = generate_report(pages=10)
+    return [
+        Case("rules.nutrition_tool", lambda: (lambda: nutrition_tool._run(text)), 100),
+        Case("rules.exercise_tool", lambda: (lambda: exercise_tool._run(text)), 100),
+        Case("rules.recommend_female_70", lambda: (lambda: recommend("nutrition", values, 70, "female")), 1000),
+    ]
+
+
+def seed_database(path: str):
+    """Users with their reports, analyses, jobs and llm cache entries, with the triggers of create_tables"""
+    from analytics import create_analytics_changes
+    from database.search import create_search_index
+
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, **engine_options(url))
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        create_search_index(conn)
+        create_analytics_changes(conn)
+
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    rng = random.Random(0)
+    start = utcnow() - timedelta(days=SEED_REPORTS_PER_USER * 30)
+    for user_id in range(1, SEED_USERS + 1):
+        operations.create_user(db, f"user {user_id}", f"user{user_id}@example.com",
+                               rng.randint(18, 85), rng.choice(["male", "female"]))
+        operations.bulk_create_blood_test_reports(db, [
+            {"user_id": user_id, "file_name": f"report_{user_id}_{i}.pdf", "file_path": f"uploads/report_{user_id}_{i}.pdf",
+             "query": rng.choice(["vitamin levels", "cholesterol check", "thyroid follow up", "general checkup"]),
+             "upload_date": start + timedelta(days=30 * i), **generate_blood_values(rng)}
+            for i in range(SEED_REPORTS_PER_USER)
+        ])
+    report_ids = [report_id for (report_id,) in db.query(BloodTestReport.id)]
+    operations.bulk_save_analysis_results(db, [
+        {"report_id": report_id, "analysis_type": analysis_type,
+         "analysis_result": f"{analysis_type.upper()} ANALYSIS vitamin d deficiency, cholesterol within range"}
+        for report_id in report_ids for analysis_type in ("nutrition", "exercise")
+    ])
+    for i in range(SEED_JOBS):
+        operations.create_analysis_job(db, f"job-{i}", rng.randint(1, SEED_USERS), "report.pdf", "uploads/report.pdf", "query", "bench")
+    for i in range(SEED_LLM_ENTRIES):
+        operations.save_llm_cache_entry(db, f"key-{i}", "model", "agent", "response " * 50)
+    db.close()
+    return engine
+
+
+def database_cases(workspace: Workspace) -> List[Case]:
+    """One case per function of database/operations.py"""
+    rng = random.Random(1)
+    counter = itertools.count()
+    values = generate_blood_values(rng, missing=0.0)
+    analyses = {"nutrition": "NUTRITIONAL ANALYSIS ...", "exercise": "EXERCISE PLAN ..."}
+
+    def user_id():
+        return rng.randint(1, SEED_USERS)
+
+    def report_id():
+        return rng.randint(1, SEED_USERS * SEED_REPORTS_PER_USER)
+
+    def with_db(make: Callable) -> Callable[[], Callable[[], object]]:
+        return lambda: make(workspace.db())
+
+    def pool(create: Callable, size: int) -> Callable[[], int]:
+        """Ids made before the timing, for the functions which can only run once per row"""
+        ids = [create() for _ in range(size)]
+        return iter(ids).__next__
+
+    def new_report(db):
+        return operations.create_blood_test_report(db, user_id(), "pool.pdf", "uploads/pool.pdf", "pool", values).id
+
+    def new_user(db):
+        user = operations.create_user(db, "pool", f"pool{next(counter)}@example.com", 40, "female")
+        operations.bulk_create_blood_test_reports(db, [{"user_id": user.id, "file_name": "pool.pdf", **values}] * 5)
+        return user.id
+
+    def delete_user(db):
+        ids = pool(lambda: new_user(db), 20 * (REPEAT + 1))
+        return lambda: operations.delete_user(db, ids())
+
+    def delete_report(db):
+        ids = pool(lambda: new_report(db), 20 * (REPEAT + 1))
+        return lambda: operations.delete_report(db, ids())
+
+    def update_job_status(db):
+        statuses = itertools.cycle(["running", "pending"])
+        return lambda: operations.update_job_status(db, f"job-{rng.randrange(SEED_JOBS)}", next(statuses))
+
+    def claim_analysis_job(db):
+        ids = pool(lambda: operations.create_analysis_job(
+            db, str(uuid.uuid4()), user_id(), "report.pdf", "uploads/report.pdf", "query", "bench").id, 50 * (REPEAT + 1))
+        return lambda: operations.claim_analysis_job(db, ids(), "bench")
+
+    def take_over_job(db):
+        ### every lease is expired before tomorrow, so each call moves a seeded job to the other worker
+        owners = itertools.cycle(["bench", "other"])
+        expired = utcnow() + timedelta(days=1)
+        return lambda: operations.take_over_job(db, f"job-{rng.randrange(SEED_JOBS)}", next(owners), expired)
+
+    old = utcnow() - timedelta(days=365)
+    return [
+        Case("db.biomarker_rows", lambda: (lambda: operations.biomarker_rows(1, values)), 1000),
+        Case("db.create_user", with_db(lambda db: lambda: operations.create_user(
+            db, "new", f"new{next(counter)}@example.com", 30, "male")), 50),
+        Case("db.get_user_by_email", with_db(lambda db: lambda: operations.get_user_by_email(
+            db, f"user{user_id()}@example.com")), 500),
+        Case("db.get_user_by_id", with_db(lambda db: lambda: operations.get_user_by_id(db, user_id())), 500),
+        Case("db.create_blood_test_report", with_db(lambda db: lambda: new_report(db)), 50),
+        Case("db.bulk_create_blood_test_reports", with_db(lambda db: lambda: operations.bulk_create_blood_test_reports(
+            db, [{"user_id": user_id(), "file_name": "bulk.pdf", **values} for _ in range(100)])), 5),
+        Case("db.backfill_biomarkers", with_db(lambda db: lambda: operations.backfill_biomarkers(db)), 500),
+        Case("db.get_report_file_paths", with_db(lambda db: lambda: operations.get_report_file_paths(db, user_id())), 500),
+        Case("db.update_blood_values", with_db(lambda db: lambda: operations.update_blood_values(
+            db, report_id(), {"vitamin_d": round(rng.uniform(20, 150), 2)})), 50),
+        Case("db.save_analysis_result", with_db(lambda db: lambda: operations.save_analysis_result(
+            db, report_id(), "medical", "MEDICAL ANALYSIS ...")), 50),
+        Case("db.bulk_save_analysis_results", with_db(lambda db: lambda: operations.bulk_save_analysis_results(
+            db, [{"report_id": report_id(), "analysis_type": "medical", "analysis_result": "..."} for _ in range(100)])), 5),
+        Case("db.save_report_with_analyses", with_db(lambda db: lambda: operations.save_report_with_analyses(
+            db, user_id(), "report.pdf", "uploads/report.pdf", "query", values, analyses)), 50),
+        Case("db.get_user_reports", with_db(lambda db: lambda: operations.get_user_reports(db, user_id())), 200),
+        Case("db.get_report_analyses", with_db(lambda db: lambda: operations.get_report_analyses(db, report_id())), 500),
+        Case("db.get_all_users", with_db(lambda db: lambda: operations.get_all_users(db)), 200),
+        Case("db.delete_user", with_db(delete_user), 20),
+        Case("db.delete_report", with_db(delete_report), 20),
+        Case("db.search_reports", with_db(lambda db: lambda: operations.search_reports(db, user_id(), "vitamin defic")), 200),
+        Case("db.create_analysis_job", with_db(lambda db: lambda: operations.create_analysis_job(
+            db, str(uuid.uuid4()), user_id(), "report.pdf", "uploads/report.pdf", "query", "bench")), 50),
+        Case("db.get_analysis_job", with_db(lambda db: lambda: operations.get_analysis_job(
+            db, f"job-{rng.randrange(SEED_JOBS)}")), 500),
+        Case("db.get_unfinished_jobs", with_db(lambda db: lambda: operations.get_unfinished_jobs(db, utcnow())), 200),
+        Case("db.update_job_status", with_db(update_job_status), 50),
+        Case("db.claim_analysis_job", with_db(claim_analysis_job), 50),
+        Case("db.take_over_job", with_db(take_over_job), 50),
+        Case("db.renew_job_leases", with_db(lambda db: lambda: operations.renew_job_leases(db, "bench")), 50),
+        Case("db.release_job_leases", with_db(lambda db: lambda: operations.release_job_leases(db, "bench")), 50),
+        Case("db.get_llm_cache_entry", with_db(lambda db: lambda: operations.get_llm_cache_entry(
+            db, f"key-{rng.randrange(SEED_LLM_ENTRIES)}", old)), 100),
+        Case("db.save_llm_cache_entry", with_db(lambda db: lambda: operations.save_llm_cache_entry(
+            db, f"key-{rng.randrange(SEED_LLM_ENTRIES)}", "model", "agent", "response " * 50)), 50),
+        Case("db.evict_llm_cache_entries", with_db(lambda db: lambda: operations.evict_llm_cache_entries(
+            db, old, SEED_LLM_ENTRIES)), 100),
+    ]
+
+
+def check_operations_covered(cases: List[Case]):
+    """Fail when a function of database/operations.py has no case"""
+    names = {case.name for case in cases}
+    missing = [
+        name for name, func in inspect.getmembers(operations, inspect.isfunction)
+        if func.__module__ == operations.__name__ and not name.startswith("_") and f"db.{name}" not in names
+    ]
+    if missing:
+        raise SystemExit(f"No benchmark for database.operations: {', '.join(missing)}")
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path: str, results: Dict[str, float], baseline: Optional[Dict]):
+    """Write the results, the cases which did not run keep their previous time"""
+    cases = dict((baseline or {}).get("cases", {}))
+    cases.update({name: round(ms, 4) for name, ms in results.items()})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "cases": dict(sorted(cases.items())),
+        }, f, indent=2)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.5 is 50%%")
+    parser.add_argument("--only", default="", help="comma separated prefixes of the cases to run")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    workspace = Workspace()
+    try:
+        cases = extraction_cases() + pdf_cases(workspace) + rules_cases() + database_cases(workspace)
+        check_operations_covered(cases)
+        prefixes = [prefix.strip() for prefix in args.only.split(",") if prefix.strip()]
+        if prefixes:
+            cases = [case for case in cases if any(case.name.startswith(prefix) for prefix in prefixes)]
+
+        baseline = load_baseline(args.baseline)
+        previous = (baseline or {}).get("cases", {})
+        results, regressions = {}, []
+        print(f"{'case':<42} {'baseline ms':>12} {'ms':>10} {'ratio':>7}")
+        for case in cases:
+            ms = results[case.name] = measure(case)
+            before = previous.get(case.name)
+            ratio = ms / before if before else None
+            slower = ratio is not None and ratio > 1 + args.tolerance
+            if slower:
+                regressions.append(case.name)
+            print(f"{case.name:<42} {before if before is not None else '-':>12} {ms:>10.4f} "
+                  f"{f'{ratio:.2f}' if ratio is not None else 'new':>7}{'  REGRESSION' if slower else ''}")
+    finally:
+        workspace.close()
+
+    if args.save or baseline is None:
+        save_baseline(args.baseline, results, baseline)
+        print(f"\nbaseline saved to {args.baseline}")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nno regression above {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Synthetic lab reports for the benchmarks, as text, pdf files or blood values."""
+import random
+from typing import Dict, Tuple
+
+### Lines which are not extracted, they make the synthetic reports look like the real lab pdfs
+FILLER_TESTS = [
+    ("Packed Cell Volume (PCV)", "%", 40.0, 50.0),
+    ("RBC Count", "mill/mm3", 4.5, 5.5),
+    ("MCV", "fL", 83.0, 101.0),
+    ("MCH", "pg", 27.0, 32.0),
+    ("MCHC", "g/dL", 31.5, 34.5),
+    ("Red Cell Distribution Width (RDW)", "%", 11.6, 14.0),
+    ("Total Leukocyte Count (TLC)", "thou/mm3", 4.0, 10.0),
+    ("Platelet Count", "thou/mm3", 150.0, 410.0),
+    ("Creatinine", "mg/dL", 0.7, 1.3),
+    ("Urea", "mg/dL", 13.0, 43.0),
+    ("Uric Acid", "mg/dL", 3.5, 7.2),
+    ("Calcium, Total", "mg/dL", 8.7, 10.4),
+    ("Sodium", "mEq/L", 136.0, 145.0),
+    ("Potassium", "mEq/L", 3.5, 5.1),
+    ("Bilirubin, Total", "mg/dL", 0.3, 1.2),
+    ("AST (SGOT)", "U/L", 0.0, 40.0),
+    ("ALT (SGPT)", "U/L", 0.0, 41.0),
+    ("Alkaline Phosphatase", "U/L", 40.0, 129.0),
+]
+
+### label, unit and a realistic value range for every extracted analyte
+ANALYTE_LINES = {
+    "hemoglobin": ("Hemoglobin", "g/dL", 10.0, 18.0),
+    "total_cholesterol": ("Cholesterol, Total", "mg/dL", 120.0, 280.0),
+    "hdl_cholesterol": ("HDL Cholesterol", "mg/dL", 25.0, 90.0),
+    "ldl_cholesterol": ("LDL Cholesterol", "mg/dL", 50.0, 200.0),
+    "triglycerides": ("Triglycerides", "mg/dL", 50.0, 400.0),
+    "fasting_glucose": ("Glucose Fasting", "mg/dL", 70.0, 180.0),
+    "hba1c": ("HbA1c", "%", 4.5, 9.0),
+    "vitamin_b12": ("VITAMIN B12", "pg/mL", 150.0, 900.0),
+    "vitamin_d": ("VITAMIN D", "nmol/L", 20.0, 150.0),
+    "tsh": ("TSH", "μIU/mL", 0.3, 8.0),
+}
+
+PAGE_HEADER = (
+    "Report Status Final\n"
+    "LPL-NATIONAL REFERENCE LAB\n"
+    "National Reference laboratory, Block E, Sector 18, Rohini, New Delhi -110085\n"
+    "Test Report\n"
+    "Test Name Results Units Bio. Ref. Interval\n"
+)
+
+PAGE_FOOTER = (
+    "Page {page} of {pages}\n"
+    "If Test results are alarming or unexpected, client is advised to contact the Customer Care immediately\n"
+    "for possible remedial action.\n"
+)
+
+
+def generate_report(pages: int = 10, lines_per_page: int = 40, seed: int = 0) -> Tuple[str, Dict[str, float]]:
+    """Generate a multi page report text, the analytes are printed on the last page.
+
+    Returns the text and the values which should be extracted from it.
+    """
+    rng = random.Random(seed)
+    expected = {
+        name: round(rng.uniform(low, high), 2)
+        for name, (_, _, low, high) in ANALYTE_LINES.items()
+    }
+
+    page_texts = []
+    for page in range(1, pages + 1):
+        lines = [PAGE_HEADER]
+        for _ in range(lines_per_page):
+            label, unit, low, high = rng.choice(FILLER_TESTS)
+            lines.append(f"{label} {rng.uniform(low, high):.2f} {unit} {low:.2f} - {high:.2f}\n")
+        if page == pages:
+            for name, (label, unit, low, high) in ANALYTE_LINES.items():
+                lines.append(f"{label} {expected[name]:.2f} {unit} {low:.2f} - {high:.2f}\n")
+        lines.append(PAGE_FOOTER.format(page=page, pages=pages))
+        page_texts.append("".join(lines))
+
+    return "\n\n".join(page_texts), expected
+
+
+def generate_blood_values(rng: random.Random, missing: float = 0.1) -> Dict[str, float]:
+    """Random values of the analytes, each one missing with the given probability"""
+    return {
+        name: round(rng.uniform(low, high), 2)
+        for name, (_, _, low, high) in ANALYTE_LINES.items()
+        if rng.random() >= missing
+    }
+
+
+def write_report_pdf(path: str, pages: int = 10, seed: int = 0) -> Dict[str, float]:
+    """Write a generate_report text as a pdf, one report page per pdf page. Returns the expected values"""
+    import fitz
+
+    text, expected = generate_report(pages=pages, seed=seed)
+    ### the base fonts have no μ (TSH unit), the builtin CJK font does
+    font = fitz.Font("cjk")
+    doc = fitz.open()
+    for page_text in text.split("\n\n"):
+        page = doc.new_page()
+        page.insert_font(fontname="F0", fontbuffer=font.buffer)
+        page.insert_text((36, 40), page_text, fontsize=8, fontname="F0")
+    doc.subset_fonts()
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return expected
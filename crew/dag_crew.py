@@ -0,0 +1,122 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Set, Union
+
+from crewai import Crew, Task
+from crewai.tools import BaseTool
+from pydantic import Field, PrivateAttr
+
+from metrics import AGENT_TASK_SECONDS
+
+
+class DAGCrew(Crew):
+    """Crew which runs its tasks as a dependency graph instead of one after the other.
+
+    The graph comes from the crewai `context` of each task: a task with an explicit
+    context list depends only on those tasks, a task without one depends on every
+    task before it, like in a sequential crew. A task starts as soon as all its
+    dependencies are done, so independent tasks run at the same time and the run
+    takes the time of the critical path. Task outputs are always returned in the
+    order of `tasks`, whatever order they finish in.
+    """
+
+    max_parallel_tasks: Optional[int] = Field(default=None, description="Maximum number of tasks running at the same time")
+    _concurrent_agents: Dict[int, Set[int]] = PrivateAttr(default_factory=dict)
+
+    def _dependencies(self, tasks: List[Task]) -> List[Set[int]]:
+        index = {id(task): i for i, task in enumerate(tasks)}
+        dependencies = []
+        for i, task in enumerate(tasks):
+            if isinstance(task.context, list):
+                dependencies.append({index[id(t)] for t in task.context if id(t) in index})
+            else:
+                dependencies.append(set(range(i)))
+        return dependencies
+
+    @staticmethod
+    def _ancestors(dependencies: List[Set[int]]) -> List[Set[int]]:
+        ancestors: List[Set[int]] = []
+        for deps in dependencies:
+            ### dependencies always point to earlier tasks, so one pass is enough
+            found = set(deps)
+            for dep in deps:
+                found |= ancestors[dep]
+            ancestors.append(found)
+        return ancestors
+
+    def _add_delegation_tools(self, task: Task, tools: Union[List[BaseTool], list]) -> List[BaseTool]:
+        """Only offer coworkers whose own tasks can not be running at the same time"""
+        concurrent = self._concurrent_agents.get(id(task), set())
+        agents_for_delegation = [
+            agent for agent in self.agents if agent != task.agent and id(agent) not in concurrent
+        ]
+        if agents_for_delegation and task.agent:
+            tools = self._inject_delegation_tools(tools or [], task.agent, agents_for_delegation)
+        return tools
+
+    @staticmethod
+    def _execute_task(task: Task, agent, context: str, tools: List[BaseTool]):
+        """Run one task, its duration is recorded per agent"""
+        with AGENT_TASK_SECONDS.labels(agent.role).time():
+            return task.execute_sync(agent=agent, context=context, tools=tools)
+
+    def _execute_tasks(self, tasks: List[Task], start_index: Optional[int] = 0, was_replayed: bool = False):
+        dependencies = self._dependencies(tasks)
+        ancestors = self._ancestors(dependencies)
+
+        ### agents of the tasks which are neither ancestors nor descendants of a task may run with it
+        self._concurrent_agents = {
+            id(task): {
+                id(other.agent) for j, other in enumerate(tasks)
+                if j != i and j not in ancestors[i] and i not in ancestors[j]
+            }
+            for i, task in enumerate(tasks)
+        }
+
+        outputs: Dict[int, object] = {}
+        for i, task in enumerate(tasks):
+            # replayed runs keep the outputs of the tasks before start_index
+            if start_index and i < start_index and task.output:
+                outputs[i] = task.output
+
+        pending = [i for i in range(len(tasks)) if i not in outputs]
+        running = {}
+        busy_agents: Set[int] = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_tasks or len(tasks) or 1) as pool:
+            while pending or running:
+                for i in list(pending):
+                    task = tasks[i]
+                    agent = self._get_agent_to_use(task)
+                    if agent is None:
+                        raise ValueError(
+                            f"No agent available for task: {task.description}. Ensure that either the task has an assigned agent or a manager agent is provided."
+                        )
+                    ### an agent runs one task at a time
+                    if not dependencies[i] <= outputs.keys() or id(agent) in busy_agents:
+                        continue
+
+                    tools = self._prepare_tools(agent, task, task.tools or agent.tools or [])
+                    self._log_task_start(task, agent.role)
+                    context = self._get_context(task, [outputs[j] for j in sorted(dependencies[i])])
+                    ### copy the context so callbacks see the context variables of the caller
+                    future = pool.submit(
+                        contextvars.copy_context().run, self._execute_task, task, agent, context, tools
+                    )
+                    running[future] = (i, id(agent))
+                    busy_agents.add(id(agent))
+                    pending.remove(i)
+
+                if not running:
+                    raise ValueError("Task dependencies can not be resolved")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, agent_id = running.pop(future)
+                    busy_agents.discard(agent_id)
+                    output = future.result()
+                    outputs[i] = output
+                    self._process_task_result(tasks[i], output)
+                    self._store_execution_log(tasks[i], output, i, was_replayed)
+
+        return self._create_crew_output([outputs[i] for i in range(len(tasks))])
@@ -0,0 +1,75 @@
+"""Deferred construction of the crew stack.
+
+Importing crew.medical_crew builds the Gemini LLMs, the search tool, the four agents, tasks and the crew,
+and pulls in crewai, litellm and langchain: seconds of startup and thousands of modules. The API only
+imports it for the first crew analysis, or warms it in a background thread once the server is up.
+
+CREW_WARMUP selects when the crew is built in the API process:
+- background (default) builds it and its whole crew pool in a thread after startup, requests do not wait for it
+- lazy builds it on the first crew analysis only, and the pooled crews as analyses need them
+"""
+import importlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import STAGE_SECONDS
+
+CREW_WARMUP_MODES = ("background", "lazy")
+CREW_WARMUP = os.getenv("CREW_WARMUP", "background").lower()
+
+if CREW_WARMUP not in CREW_WARMUP_MODES:
+    raise ValueError(f"CREW_WARMUP must be one of {', '.join(CREW_WARMUP_MODES)}, got {CREW_WARMUP}")
+
+_lock = threading.Lock()
+_crew_module = None
+_load_seconds: Optional[float] = None
+_load_error: Optional[str] = None
+
+
+def load_crew():
+    """crew.medical_crew, imported and built by the first caller, the others wait for it"""
+    global _crew_module, _load_seconds, _load_error
+    if _crew_module is not None:
+        return _crew_module
+    with _lock:
+        if _crew_module is None:
+            start = time.perf_counter()
+            try:
+                with STAGE_SECONDS.labels("crew_init").time():
+                    module = importlib.import_module("crew.medical_crew")
+            except Exception as e:
+                _load_error = str(e)
+                raise
+            _load_seconds = time.perf_counter() - start
+            _load_error = None
+            _crew_module = module
+    return _crew_module
+
+
+def _warm_up():
+    try:
+        load_crew().crew_pool.prebuild()
+    except Exception as e:
+        print(f"Warning: Could not build the crew in the background: {str(e)}")
+
+
+def warm_up_crew() -> Optional[threading.Thread]:
+    """Build the crew in a background thread with CREW_WARMUP=background"""
+    if CREW_WARMUP != "background" or _crew_module is not None:
+        return None
+    thread = threading.Thread(target=_warm_up, name="crew-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def crew_status() -> Dict:
+    """Whether the crew is built yet, how long it took and the crews of its pool"""
+    return {
+        "warmup": CREW_WARMUP,
+        "loaded": _crew_module is not None,
+        "load_seconds": round(_load_seconds, 3) if _load_seconds is not None else None,
+        "error": _load_error,
+        "pool": _crew_module.crew_pool.stats() if _crew_module is not None else None,
+    }
@@ -1,47 +1,123 @@
-from crewai import Crew, Process
-
-from agents.medical_agents import doctor, verifier, nutritionist, exercise_specialist
-from tasks.medical_tasks import (verification_task, medical_analysis_task, nutrition_analysis_task, exercise_planning_task)
-
-## creating medical analysis crew
-medical_crew = Crew(
-    agents=[verifier, doctor, nutritionist, exercise_specialist],
-    tasks=[verification_task, medical_analysis_task, nutrition_analysis_task, exercise_planning_task],
-    process=Process.sequential,
-    memory=True,
-    cache=True,
-    max_rpm=100,
-    share_crew=False,
-    verbose=True  
-)
-
-def run_medical_analysis(query: str, file_path: str = 'data/sample.pdf'):
+import os
+import shutil
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from crewai import Process
+from crewai.memory import EntityMemory, LongTermMemory, ShortTermMemory
+
+from crew.dag_crew import DAGCrew
+from crew.pool import CrewPool
+from replay import LLM_BACKEND
+from metrics import STAGE_SECONDS
+from report_context import patient_context, task_context
+from tools.report_cache import load_report
+from tools.medical_tools import run_demographics
+from agents.medical_agents import create_agents
+from tasks.medical_tasks import create_tasks
+
+### Crew pool configuration, one crew per concurrent analysis
+CREW_POOL_SIZE = int(os.getenv("CREW_POOL_SIZE", os.getenv("ANALYSIS_WORKERS", "2")))
+CREW_POOL_TIMEOUT = float(os.getenv("CREW_POOL_TIMEOUT", "600"))
+### every crew keeps its memories in its own directory, emptied when the crew is built and after each run
+CREW_MEMORY_DIR = os.getenv("CREW_MEMORY_DIR", os.path.join(".cache", "crew_memory"))
+
+### listener of the running analysis, a context variable so concurrent runs only get their own task outputs
+_task_listener: ContextVar[Optional[Callable]] = ContextVar("task_listener", default=None)
+
+def _dispatch_task_output(output):
+    """Crew task callback, forwards the task output to the listener of the current run"""
+    listener = _task_listener.get()
+    if listener is not None:
+        listener(output)
+
+def _remove_stale_memories():
+    """Memories left behind by processes which are gone"""
+    if not os.path.isdir(CREW_MEMORY_DIR):
+        return
+    for name in os.listdir(CREW_MEMORY_DIR):
+        pid = name.split("-")[0]
+        if not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(CREW_MEMORY_DIR, name), ignore_errors=True)
+        except PermissionError:
+            pass
+
+def crew_memories(slot: int):
+    """Short term, entity and long term memories of one pooled crew, stored apart from the other crews"""
+    _remove_stale_memories()
+    path = os.path.join(CREW_MEMORY_DIR, f"{os.getpid()}-{slot}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return {
+        "short_term_memory": ShortTermMemory(path=os.path.join(path, "short_term")),
+        "entity_memory": EntityMemory(path=os.path.join(path, "entities")),
+        "long_term_memory": LongTermMemory(path=os.path.join(path, "long_term_memory.db")),
+    }
+
+def create_crew(slot: int = 0) -> DAGCrew:
+    """Medical analysis crew with its own agents, tasks and memories.
+
+    medical, nutrition and exercise only depend on the verification (see the task context),
+    so they run at the same time once the report is verified
+    """
+    agents = create_agents()
+    ### memory calls the embedding api, so recorded and replayed runs go without it
+    memory = LLM_BACKEND == "live"
+    return DAGCrew(
+        agents=[agents["verifier"], agents["doctor"], agents["nutritionist"], agents["exercise_specialist"]],
+        tasks=create_tasks(agents),
+        process=Process.sequential,
+        memory=memory,
+        **(crew_memories(slot) if memory else {}),
+        cache=True,
+        share_crew=False,
+        task_callback=_dispatch_task_output,
+        verbose=True
+    )
+
+crew_pool = CrewPool(create_crew, CREW_POOL_SIZE, CREW_POOL_TIMEOUT)
+
+def run_medical_analysis(query: str, file_path: str = 'data/sample.pdf', task_callback: Optional[Callable] = None,
+                         age: Optional[int] = None, gender: Optional[str] = None):
     """
     Run the medical analysis crew with the given query and file path.
     
     Args:
         query (str): User query about their blood test
         file_path (str): Path to the blood test PDF file
+        task_callback (callable): Called with the output of each task as soon as it finishes
+        age (int): Age of the user, selects the reference ranges of the report summary and the tools
+        gender (str): Gender of the user, selects the reference ranges of the report summary and the tools
         
     Returns:
-        dict: Results from the crew execution
-    """
-    try:
-        # Update the file path in the tools dynamically
-        from tools.medical_tools import blood_test_tool, nutrition_tool, exercise_tool
-        
-        # Update the default path for the blood test tool
-        # Note: This is a workaround since the tool uses a default path
-        import os
-        if not os.path.exists(file_path):
-            return f"Error: File does not exist at {file_path}"
-        
-        result = medical_crew.kickoff(inputs={'query': query, 'file_path': file_path})
-        return result
-    except Exception as e:
-        return f"Error running medical analysis: {str(e)}"
+        CrewOutput: Results from the crew execution
 
+    Raises:
+        FileNotFoundError: the report does not exist
+        TimeoutError: no crew of the pool got free in time
+        Any error of the crew run, so the caller never stores a failed run as an analysis
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File does not exist at {file_path}")
     
+    ### the tasks get the compact summary of the report instead of reading the whole pdf text
+    report = task_context(load_report(file_path), age, gender)
+    
+    inputs = {'query': query, 'file_path': file_path, 'report': report, 'patient': patient_context(age, gender)}
+    token = _task_listener.set(task_callback)
+    ### tools called without a user id use the age and gender of this run's patient
+    demographics = run_demographics.set((age, gender))
+    try:
+        ### a crew of its own for this run, waits while CREW_POOL_SIZE analyses are running
+        with crew_pool.crew() as crew, STAGE_SECONDS.labels("crew").time():
+            return crew.kickoff(inputs=inputs)
+    finally:
+        run_demographics.reset(demographics)
+        _task_listener.reset(token)
 
 # if __name__ == "__main__":
 #     query = "Tell me detail about the report"
@@ -0,0 +1,136 @@
+"""Bounded pool of crews, each analysis runs on a crew of its own.
+
+A crew, its agents and tasks carry state of the run: interpolated task descriptions, task outputs, tool
+results, token counts, the tool cache and the memories. Sharing one crew mixes concurrent runs and keeps
+the data of a patient around for the next one. The pool hands every run a crew nobody else uses, resets
+it when the run returns it and caps the number of crews, so at most `size` analyses run at once.
+
+Crews are built on demand up to `size`, or all at once with prebuild(), then reused.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+from crewai.agents.agent_builder.utilities.base_token_process import TokenProcess
+
+from metrics import STAGE_SECONDS
+
+
+def _clear_rag_storage(storage):
+    """Empty the collection of a memory, the crewai reset removes the directory of every crew"""
+    app = getattr(storage, "app", None)
+    if app is None:
+        return
+    app.delete_collection(storage.type)
+    storage.collection = app.create_collection(name=storage.type, embedding_function=storage.embedder_config)
+
+
+def reset_crew(crew):
+    """Drop the state a run left in a crew, its next run starts like a new crew"""
+    for task in crew.tasks:
+        task.output = None
+    for agent in crew.agents:
+        agent.tools_results = []
+        agent._times_executed = 0
+        ### usage metrics of a run are the sum of the agent token counters
+        agent._token_process = TokenProcess()
+    if crew._cache_handler is not None:
+        crew._cache_handler._cache.clear()
+    if crew.memory:
+        for memory in (crew._short_term_memory, crew._entity_memory):
+            if memory is not None:
+                _clear_rag_storage(memory.storage)
+        if crew._long_term_memory is not None:
+            crew._long_term_memory.reset()
+
+
+class CrewPool:
+    """At most `size` crews built by factory(slot), each one lent to a single run at a time"""
+
+    def __init__(self, factory: Callable[[int], Any], size: int, timeout: float):
+        if size < 1:
+            raise ValueError(f"Crew pool size must be at least 1, got {size}")
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle: List[Tuple[int, Any]] = []
+        self._free_slots = list(range(size - 1, -1, -1))
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def _build(self, slot: int) -> Tuple[int, Any]:
+        try:
+            return slot, self.factory(slot)
+        except Exception:
+            with self._condition:
+                self._free_slots.append(slot)
+                self._condition.notify()
+            raise
+
+    def acquire(self) -> Tuple[int, Any]:
+        """Slot and crew for one run, waits up to `timeout` seconds while all the crews are busy"""
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and not self._free_slots:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No crew free after {self.timeout:g}s, {self.size} analyses are running")
+                self._condition.wait(remaining)
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
+            slot = self._free_slots.pop()
+        try:
+            return self._build(slot)
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+            raise
+
+    def release(self, slot: int, crew):
+        """Give a crew back, a crew which can not be reset is dropped and built again later"""
+        try:
+            reset_crew(crew)
+            entry = (slot, crew)
+        except Exception as e:
+            print(f"Warning: Could not reset crew {slot}, it will be built again: {str(e)}")
+            entry = None
+        with self._condition:
+            self._in_use -= 1
+            if entry is None:
+                self._free_slots.append(slot)
+            else:
+                self._idle.append(entry)
+            self._condition.notify()
+
+    @contextmanager
+    def crew(self):
+        """Crew of one run, given back when the block exits"""
+        with STAGE_SECONDS.labels("crew_wait").time():
+            slot, crew = self.acquire()
+        try:
+            yield crew
+        finally:
+            self.release(slot, crew)
+
+    def prebuild(self):
+        """Build the crews not built yet, so no run pays for it"""
+        while True:
+            with self._condition:
+                if not self._free_slots:
+                    return
+                slot = self._free_slots.pop()
+            entry = self._build(slot)
+            with self._condition:
+                self._idle.append(entry)
+                self._condition.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "size": self.size,
+                "built": self.size - len(self._free_slots),
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+            }
@@ -0,0 +1,35 @@
+import os
+from typing import Optional
+
+from metrics import STAGE_SECONDS
+from rules import recommend
+from tools.report_cache import load_report
+
+
+def run_rules_analysis(query: str, file_path: str = 'data/sample.pdf', age: Optional[int] = None, gender: Optional[str] = None):
+    """
+    Run the nutrition and exercise rules directly on the report, without any LLM call.
+    
+    Args:
+        query (str): User query about their blood test
+        file_path (str): Path to the blood test PDF file
+        age (int): Age of the user, selects the age specific rules
+        gender (str): Gender of the user, selects the gender specific reference ranges
+        
+    Returns:
+        str: Nutrition analysis followed by the exercise plan
+
+    Raises:
+        FileNotFoundError: the report does not exist
+        ValueError: the pdf has no content
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File does not exist at {file_path}")
+    
+    report = load_report(file_path)
+    if not report["pages"]:
+        raise ValueError("No content found in the PDF file")
+    
+    values = report["blood_values"]
+    with STAGE_SECONDS.labels("rules").time():
+        return "\n\n".join([recommend("nutrition", values, age, gender), recommend("exercise", values, age, gender)])
@@ -0,0 +1,67 @@
+"""Read only queries for the async endpoints, same behaviour as the functions of operations.py"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import User, BloodTestReport, AnalysisResult, AnalysisJob, BiomarkerTrend, Biomarker
+from database.search import SEARCH_SQL, SEARCH_LIMIT, match_query, search_results
+from database.pagination import keyset_select, keyset_page
+from extractor import ANALYTES
+from typing import Optional, List, Dict
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
+    """Get user by email"""
+    return (await db.execute(select(User).where(User.email == email).limit(1))).scalars().first()
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[User]:
+    """get user by their id"""
+    return await db.get(User, user_id)
+
+### columns a listing can return with fields=, in the default order
+REPORT_FIELDS = ("id", "user_id", "file_name", "upload_date", "query") + tuple(analyte.name for analyte in ANALYTES)
+ANALYSIS_FIELDS = ("id", "report_id", "analysis_type", "analysis_result", "created_at")
+
+async def get_user_reports_page(db: AsyncSession, user_id: int, limit: int, cursor: Optional[str] = None,
+                                fields: Optional[List[str]] = None) -> Dict:
+    """One page of the reports of a user, newest first, only the asked columns are loaded"""
+    fields = fields or list(REPORT_FIELDS)
+    query = keyset_select(BloodTestReport, BloodTestReport.upload_date, [BloodTestReport.user_id == user_id],
+                          fields, limit, cursor)
+    return keyset_page(await db.execute(query), "upload_date", fields, limit)
+
+async def get_report_analyses_page(db: AsyncSession, report_id: int, limit: int, cursor: Optional[str] = None,
+                                   fields: Optional[List[str]] = None) -> Dict:
+    """One page of the analyses of a report, newest first, only the asked columns are loaded"""
+    fields = fields or list(ANALYSIS_FIELDS)
+    query = keyset_select(AnalysisResult, AnalysisResult.created_at, [AnalysisResult.report_id == report_id],
+                          fields, limit, cursor)
+    return keyset_page(await db.execute(query), "created_at", fields, limit)
+
+async def get_user_trends(db: AsyncSession, user_id: int) -> List[BiomarkerTrend]:
+    """Get the trend of every analyte of a user, one primary key lookup each"""
+    query = select(BiomarkerTrend).where(BiomarkerTrend.user_id == user_id).order_by(BiomarkerTrend.analyte)
+    return list((await db.execute(query)).scalars())
+
+async def find_reports_by_biomarker(db: AsyncSession, analyte: str, min_value: Optional[float] = None,
+                                    max_value: Optional[float] = None, limit: int = 50) -> List[Dict]:
+    """Reports with a value of analyte in [min_value, max_value], lowest value first.
+
+    Only reads the (analyte_code, value) index, the report id is part of it, so no table row is visited.
+    """
+    query = select(Biomarker.report_id, Biomarker.value).where(Biomarker.analyte_code == analyte)
+    if min_value is not None:
+        query = query.where(Biomarker.value >= min_value)
+    if max_value is not None:
+        query = query.where(Biomarker.value <= max_value)
+    query = query.order_by(Biomarker.value, Biomarker.report_id).limit(limit)
+    return [dict(row) for row in (await db.execute(query)).mappings()]
+
+async def search_reports(db: AsyncSession, user_id: int, search_term: str) -> List[Dict]:
+    """Search reports by query, file name or analysis text, best match first with a snippet"""
+    match = match_query(user_id, search_term)
+    if match is None:
+        return []
+    rows = await db.execute(SEARCH_SQL, {"match": match, "limit": SEARCH_LIMIT})
+    return search_results(rows)
+
+async def get_analysis_job(db: AsyncSession, job_id: str) -> Optional[AnalysisJob]:
+    """Get analysis job by id"""
+    return await db.get(AnalysisJob, job_id)
@@ -1,11 +1,22 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, Boolean
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, Text, DateTime, Float, Boolean, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.schema import CreateTable, CreateIndex
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from datetime import datetime, timezone
 import os
+import time
+
+from metrics import DB_COMMIT_SECONDS
 
 Base = declarative_base()
 
+
+def utcnow() -> datetime:
+    """Current UTC time without tzinfo, as the DateTime columns store it (datetime.utcnow is deprecated)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -14,16 +25,16 @@ class User(Base):
     email = Column(String(100), unique=True, index=True)
     age = Column(Integer)
     gender = Column(String(10))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
 
 class BloodTestReport(Base):
     __tablename__ = "blood_test_reports"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     file_name = Column(String(255))
     file_path = Column(String(500))
-    upload_date = Column(DateTime, default=datetime.utcnow)
+    upload_date = Column(DateTime, default=utcnow)
     query = Column(Text)
     
     # Blood test values
@@ -38,24 +49,259 @@ class BloodTestReport(Base):
     vitamin_d = Column(Float, nullable=True)
     tsh = Column(Float, nullable=True)
 
+    ### history of a user newest first, also serves the lookups by user_id alone
+    __table_args__ = (Index("ix_blood_test_reports_user_id_upload_date", "user_id", "upload_date"),)
+
+class Biomarker(Base):
+    """One analyte value of a report, in long format so any analyte of the extractor can be stored"""
+    __tablename__ = "biomarkers"
+
+    report_id = Column(Integer, ForeignKey("blood_test_reports.id", ondelete="CASCADE"), primary_key=True)
+    analyte_code = Column(String(50), primary_key=True)  # analyte name of the extractor table
+    value = Column(Float, nullable=False)
+    unit = Column(String(20), nullable=True)
+
+    ### without rowid the secondary index also holds the primary key, so (analyte_code, value)
+    ### covers the range queries returning the report ids
+    __table_args__ = (
+        Index("ix_biomarkers_analyte_code_value", "analyte_code", "value"),
+        {"sqlite_with_rowid": False},
+    )
+
 class AnalysisResult(Base):
     __tablename__ = "analysis_results"
     
     id = Column(Integer, primary_key=True, index=True)
-    report_id = Column(Integer, index=True)
+    report_id = Column(Integer, ForeignKey("blood_test_reports.id", ondelete="CASCADE"))
     analysis_type = Column(String(50))  # medical, nutrition, exercise
     analysis_result = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow)
+
+    __table_args__ = (Index("ix_analysis_results_report_id_created_at", "report_id", "created_at"),)
+
+class BiomarkerTrend(Base):
+    """Time series summary of one analyte of one user, updated with every new report (see database/trends.py)"""
+    __tablename__ = "biomarker_trends"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    analyte = Column(String(50), primary_key=True)
+    count = Column(Integer, default=0)
+    first_at = Column(DateTime)
+    last_at = Column(DateTime)
+    last_value = Column(Float)
+    previous_value = Column(Float, nullable=True)
+    delta = Column(Float, nullable=True)  # last_value - previous_value
+    rolling_mean = Column(Float)  # mean of recent_values
+    slope_per_day = Column(Float, nullable=True)  # least squares slope over the whole history
+    recent_values = Column(Text)  # json [[days, value], ...] of the last values, oldest first
+    ### running sums of the least squares fit, t is in days since TREND_EPOCH
+    sum_t = Column(Float, default=0.0)
+    sum_v = Column(Float, default=0.0)
+    sum_tt = Column(Float, default=0.0)
+    sum_tv = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=utcnow)
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String(36), primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    file_name = Column(String(255))
+    file_path = Column(String(500))
+    query = Column(Text)
+    status = Column(String(20), default="pending", index=True)  # pending, running, completed, failed
+    owner = Column(String(100), nullable=True)  # worker holding the lease of an unfinished job
+    heartbeat_at = Column(DateTime, nullable=True)  # last lease renewal of the owner
+    report_id = Column(Integer, nullable=True)
+    result = Column(Text, nullable=True)  # json encoded response of the analysis
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=utcnow)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 of model, agent role and normalized prompt
+    model = Column(String(100))
+    agent_role = Column(String(200))
+    response = Column(Text)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=utcnow, index=True)
+    last_used_at = Column(DateTime, default=utcnow, index=True)
+
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./medical_analysis.db")
+### async driver of the same database, used by the read endpoints
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+
+### WAL lets readers run while a writer commits, NORMAL only syncs at checkpoints in WAL mode
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative is KiB, 64 MB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",  # off by default in SQLite, needed for ON DELETE CASCADE
+}
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+### lets the foreign key migration delete the reports, analyses and jobs whose parent is gone
+DB_MIGRATE_DROP_ORPHANS = os.getenv("DB_MIGRATE_DROP_ORPHANS", "false").lower() in ("1", "true", "yes")
+
 
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
 
 
-DATABASE_URL = "sqlite:///./medical_analysis.db"
+def engine_options(url: str) -> dict:
+    """Connection and pool settings for an engine on url"""
+    if not is_sqlite(url):
+        return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW,
+                "pool_timeout": DB_POOL_TIMEOUT, "pool_pre_ping": True}
+    options = {"connect_args": {"check_same_thread": False}}
+    if ":memory:" not in url and url.rstrip("/") not in ("sqlite:", "sqlite+aiosqlite:"):
+        ### file database, keep a pool of open connections so the pragmas and page cache are reused
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS on every new connection"""
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+if is_sqlite(DATABASE_URL):
+    event.listen(engine, "connect", set_sqlite_pragmas)
+if is_sqlite(ASYNC_DATABASE_URL):
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+
+### commit latency of every session, the async ones run their commits on a sync Session too
+def _commit_started(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+def _commit_finished(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+
+event.listen(Session, "before_commit", _commit_started)
+event.listen(Session, "after_commit", _commit_finished)
+event.listen(Session, "after_rollback", lambda session: session.info.pop("commit_started", None))
+
+def _add_sqlite_foreign_keys(bind=None):
+    """Rebuild the tables created before the foreign keys existed, SQLite can not add them with ALTER TABLE.
+
+    Rows pointing to a missing parent are what the cascade would have deleted, but they are only
+    dropped with DB_MIGRATE_DROP_ORPHANS=true. Without it the migration stops and nothing changes.
+    """
+    bind = bind if bind is not None else engine
+    tables = [(BloodTestReport.__table__, "user_id", "users"),
+              (AnalysisResult.__table__, "report_id", "blood_test_reports"),
+              (AnalysisJob.__table__, "user_id", "users")]
+    dropped = {}
+    connection = bind.raw_connection()
+    ### raw connection in autocommit mode, so the pragmas apply and BEGIN/COMMIT are really ours
+    connection.driver_connection.isolation_level = None
+    cursor = connection.cursor()
+    try:
+        cursor.execute("PRAGMA foreign_keys=OFF")
+        cursor.execute("PRAGMA legacy_alter_table=ON")
+        cursor.execute("BEGIN")
+        for table, column, parent in tables:
+            ### a table which does not exist yet is created with its foreign key
+            if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).fetchone():
+                continue
+            if cursor.execute(f"PRAGMA foreign_key_list({table.name})").fetchall():
+                continue
+            ### NULL references are allowed by the foreign key, only missing parents are orphans
+            orphans = cursor.execute(
+                f"SELECT COUNT(*) FROM {table.name} WHERE {column} IS NOT NULL AND {column} NOT IN (SELECT id FROM {parent})"
+            ).fetchone()[0]
+            if orphans and not DB_MIGRATE_DROP_ORPHANS:
+                raise RuntimeError(
+                    f"{orphans} rows of {table.name} point to a missing {parent} row, adding the foreign key "
+                    f"would delete them. Start once with DB_MIGRATE_DROP_ORPHANS=true to migrate anyway."
+                )
+            dropped[table.name] = orphans
+            old_columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table.name})").fetchall()}
+            columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name in old_columns)
+            for row in cursor.execute(f"PRAGMA index_list({table.name})").fetchall():
+                if not row[1].startswith("sqlite_autoindex"):
+                    cursor.execute(f'DROP INDEX "{row[1]}"')
+            cursor.execute(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+            cursor.execute(str(CreateTable(table).compile(bind)))
+            for index in table.indexes:
+                cursor.execute(str(CreateIndex(index).compile(bind)))
+            cursor.execute(
+                f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old "
+                f"WHERE {column} IS NULL OR {column} IN (SELECT id FROM {parent})"
+            )
+            cursor.execute(f"DROP TABLE {table.name}_old")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.execute("PRAGMA legacy_alter_table=OFF")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+        connection.driver_connection.isolation_level = ""
+        connection.close()
+    for name, count in dropped.items():
+        print(f"Added the foreign key of {name}, dropped {count} orphaned rows")
+    return dropped
+
+def _add_missing_columns():
+    """Add the nullable columns added to a model after its table was created"""
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            columns = {column["name"] for column in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns and column.nullable:
+                    column_type = column.type.compile(engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    ### the lease columns of analysis_jobs, see jobs/analysis_jobs.py
+    _add_missing_columns()
+    if is_sqlite(DATABASE_URL):
+        _add_sqlite_foreign_keys()
+        ### full text search of the reports, see database/search.py
+        from database.search import create_search_index
+        from analytics import create_analytics_changes
+        with engine.begin() as conn:
+            create_search_index(conn)
+            ### change log of the in memory analytics matrix, see analytics.py
+            create_analytics_changes(conn)
+
+    ### long format values and trends of the reports stored before these tables existed
+    from database.operations import backfill_biomarkers
+    from database.trends import backfill_trends
+    db = SessionLocal()
+    try:
+        backfill_biomarkers(db)
+        backfill_trends(db)
+    finally:
+        db.close()
 
 def get_db():
     db = SessionLocal()
@@ -63,3 +309,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,9 +1,23 @@
+from sqlalchemy import literal, or_
 from sqlalchemy.orm import Session
-from database.models import User, BloodTestReport, AnalysisResult
+from database.models import User, BloodTestReport, AnalysisResult, AnalysisJob, LLMCacheEntry, Biomarker, utcnow
+from database.trends import update_trends, rebuild_user_trends
+from database.search import SEARCH_SQL, SEARCH_LIMIT, match_query, search_results
 from typing import Optional, List, Dict
+from extractor import ANALYTES, ANALYTE_UNITS
 import json
 from datetime import datetime
 
+BLOOD_VALUE_NAMES = {analyte.name for analyte in ANALYTES}
+
+def biomarker_rows(report_id: int, blood_values: Dict) -> List[Biomarker]:
+    """Long format rows of the blood values of a report, every analyte is kept even without a report column"""
+    return [
+        Biomarker(report_id=report_id, analyte_code=name, value=value, unit=ANALYTE_UNITS.get(name))
+        for name, value in (blood_values or {}).items()
+        if value is not None
+    ]
+
 def create_user(db: Session, name: str, email: str, age: int = None, gender: str = None) -> User:
     """Creating a new user"""
     # Check if user already exists
@@ -41,6 +55,68 @@ def create_blood_test_report(db: Session, user_id: int, file_name: str, file_pat
                 setattr(db_report, key, value)
     
     db.add(db_report)
+    ### flush for the id and upload date, the values and trends are committed with the report
+    db.flush()
+    db.add_all(biomarker_rows(db_report.id, blood_values))
+    update_trends(db, [(user_id, db_report.upload_date, blood_values)])
+    db.commit()
+    db.refresh(db_report)
+    return db_report
+
+def bulk_create_blood_test_reports(db: Session, reports: List[Dict]) -> int:
+    """Insert many reports in one transaction, each dict holds the report columns and its blood values"""
+    rows = []
+    for report in reports:
+        row = {key: value for key, value in report.items() if hasattr(BloodTestReport, key) and value is not None}
+        rows.append(BloodTestReport(**row))
+
+    db.add_all(rows)
+    db.flush()
+    blood_values = [{name: value for name, value in report.items() if name in BLOOD_VALUE_NAMES} for report in reports]
+    db.add_all([biomarker for row, values in zip(rows, blood_values) for biomarker in biomarker_rows(row.id, values)])
+    update_trends(db, [(row.user_id, row.upload_date, values) for row, values in zip(rows, blood_values)])
+    db.commit()
+    return len(rows)
+
+def backfill_biomarkers(db: Session) -> int:
+    """Copy the values of the report columns into the biomarkers table when it is still empty"""
+    if db.query(Biomarker.report_id).first() is not None:
+        return 0
+    copied = 0
+    for name in BLOOD_VALUE_NAMES:
+        column = getattr(BloodTestReport, name, None)
+        if column is None:
+            continue
+        ### one set based insert per analyte column
+        copied += db.execute(
+            Biomarker.__table__.insert().from_select(
+                ["report_id", "analyte_code", "value", "unit"],
+                db.query(BloodTestReport.id, literal(name), column, literal(ANALYTE_UNITS.get(name)))
+                .filter(column.isnot(None)).statement
+            )
+        ).rowcount
+    db.commit()
+    return copied
+
+def get_report_file_paths(db: Session, user_id: int) -> List[str]:
+    """Get the file path of every report of a user"""
+    return [path for (path,) in db.query(BloodTestReport.file_path).filter(BloodTestReport.user_id == user_id)]
+
+def update_blood_values(db: Session, report_id: int, blood_values: Dict) -> Optional[BloodTestReport]:
+    """Update the blood values of an existing report"""
+    db_report = db.query(BloodTestReport).filter(BloodTestReport.id == report_id).first()
+    if not db_report:
+        return None
+
+    for key, value in blood_values.items():
+        if hasattr(db_report, key) and value is not None:
+            setattr(db_report, key, value)
+    for biomarker in biomarker_rows(report_id, blood_values):
+        db.merge(biomarker)
+
+    ### a changed value can not be taken out of the running sums, recompute the user's trends
+    db.flush()
+    rebuild_user_trends(db, db_report.user_id)
     db.commit()
     db.refresh(db_report)
     return db_report
@@ -57,6 +133,42 @@ def save_analysis_result(db: Session, report_id: int, analysis_type: str, result
     db.refresh(db_result)
     return db_result
 
+def bulk_save_analysis_results(db: Session, results: List[Dict]) -> int:
+    """Insert many analysis results in one transaction, each dict holds report_id, analysis_type and analysis_result"""
+    db.add_all([AnalysisResult(**result) for result in results])
+    db.commit()
+    return len(results)
+
+def save_report_with_analyses(db: Session, user_id: int, file_name: str, file_path: str, query: str,
+                              blood_values: Dict = None, analyses: Dict[str, str] = None) -> BloodTestReport:
+    """Create a report and its analyses (analysis type -> text) in a single transaction"""
+    try:
+        db_report = BloodTestReport(
+            user_id=user_id,
+            file_name=file_name,
+            file_path=file_path,
+            query=query
+        )
+        if blood_values:
+            for key, value in blood_values.items():
+                if hasattr(db_report, key) and value is not None:
+                    setattr(db_report, key, value)
+        db.add(db_report)
+        ### flush to get the report id and upload date, nothing is committed yet
+        db.flush()
+        db.add_all(biomarker_rows(db_report.id, blood_values))
+        update_trends(db, [(user_id, db_report.upload_date, blood_values)])
+
+        db.add_all([
+            AnalysisResult(report_id=db_report.id, analysis_type=analysis_type, analysis_result=result)
+            for analysis_type, result in (analyses or {}).items()
+        ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return db_report
+
 def get_user_reports(db: Session, user_id: int) -> List[BloodTestReport]:
     """Get all reports for a user"""
     return db.query(BloodTestReport).filter(BloodTestReport.user_id == user_id).order_by(BloodTestReport.upload_date.desc()).all()
@@ -71,19 +183,9 @@ def get_all_users(db: Session, skip: int = 0, limit: int = 100) -> List[User]:
     return db.query(User).offset(skip).limit(limit).all()
 
 def delete_user(db: Session, user_id: int) -> bool:
-    """Delete a user and all related data"""
+    """Delete a user and all related data, reports, analyses and jobs go with the ON DELETE CASCADE"""
     try:
-        # First delete all analysis results for user's reports
-        user_reports = get_user_reports(db, user_id)
-        for report in user_reports:
-            db.query(AnalysisResult).filter(AnalysisResult.report_id == report.id).delete()
-        
-        # Delete all user's reports
-        db.query(BloodTestReport).filter(BloodTestReport.user_id == user_id).delete()
-        
-        # Delete the user
-        db.query(User).filter(User.id == user_id).delete()
-        
+        db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
         db.commit()
         return True
     except Exception as e:
@@ -91,25 +193,154 @@ def delete_user(db: Session, user_id: int) -> bool:
         return False
 
 def delete_report(db: Session, report_id: int) -> bool:
-    """Delete a report and all its analyses"""
+    """Delete a report and all its analyses, the analyses go with the ON DELETE CASCADE"""
     try:
-        # Delete all analyses for this report
-        db.query(AnalysisResult).filter(AnalysisResult.report_id == report_id).delete()
-        
-        # Delete the report
-        db.query(BloodTestReport).filter(BloodTestReport.id == report_id).delete()
-        
+        user_id = db.query(BloodTestReport.user_id).filter(BloodTestReport.id == report_id).scalar()
+        db.query(BloodTestReport).filter(BloodTestReport.id == report_id).delete(synchronize_session=False)
+        if user_id is not None:
+            rebuild_user_trends(db, user_id)
         db.commit()
         return True
     except Exception as e:
         db.rollback()
         return False
 
-def search_reports(db: Session, user_id: int, search_term: str) -> List[BloodTestReport]:
-    """Search reports by query or file name"""
-    return db.query(BloodTestReport).filter(
-        BloodTestReport.user_id == user_id,
-        (BloodTestReport.query.contains(search_term) | 
-         BloodTestReport.file_name.contains(search_term))
-    ).order_by(BloodTestReport.upload_date.desc()).all()
+def search_reports(db: Session, user_id: int, search_term: str) -> List[Dict]:
+    """Search reports by query, file name or analysis text, best match first with a snippet"""
+    match = match_query(user_id, search_term)
+    if match is None:
+        return []
+    rows = db.execute(SEARCH_SQL, {"match": match, "limit": SEARCH_LIMIT})
+    return search_results(rows)
+
+
+def create_analysis_job(db: Session, job_id: str, user_id: int, file_name: str, file_path: str, query: str, owner: str) -> AnalysisJob:
+    """Create a new pending analysis job, leased to the worker which queues it"""
+    db_job = AnalysisJob(
+        id=job_id,
+        user_id=user_id,
+        file_name=file_name,
+        file_path=file_path,
+        query=query,
+        status="pending",
+        owner=owner,
+        heartbeat_at=utcnow()
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_analysis_job(db: Session, job_id: str) -> Optional[AnalysisJob]:
+    """Get analysis job by id"""
+    return db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+
+def get_unfinished_jobs(db: Session, expired_before: datetime) -> List[AnalysisJob]:
+    """Get the pending and running jobs whose worker stopped renewing their lease before expired_before"""
+    return db.query(AnalysisJob).filter(
+        AnalysisJob.status.in_(["pending", "running"]),
+        or_(AnalysisJob.heartbeat_at.is_(None), AnalysisJob.heartbeat_at < expired_before)
+    ).order_by(AnalysisJob.created_at).all()
+
+def take_over_job(db: Session, job_id: str, owner: str, expired_before: datetime) -> bool:
+    """Lease an unfinished job whose worker is gone to owner, False when another worker got it first"""
+    taken = db.query(AnalysisJob).filter(
+        AnalysisJob.id == job_id,
+        AnalysisJob.status.in_(["pending", "running"]),
+        or_(AnalysisJob.heartbeat_at.is_(None), AnalysisJob.heartbeat_at < expired_before)
+    ).update({"status": "pending", "owner": owner, "heartbeat_at": utcnow()}, synchronize_session=False)
+    db.commit()
+    return taken == 1
+
+def claim_analysis_job(db: Session, job_id: str, owner: str) -> Optional[AnalysisJob]:
+    """Move a pending job leased to owner to running, None when it is not pending or owned by another worker.
+
+    One UPDATE checked by its row count, so a job only ever runs once even with several workers.
+    """
+    now = utcnow()
+    claimed = db.query(AnalysisJob).filter(
+        AnalysisJob.id == job_id,
+        AnalysisJob.status == "pending",
+        AnalysisJob.owner == owner
+    ).update({"status": "running", "started_at": now, "heartbeat_at": now}, synchronize_session=False)
+    db.commit()
+    return get_analysis_job(db, job_id) if claimed == 1 else None
+
+def renew_job_leases(db: Session, owner: str) -> int:
+    """Heartbeat of a worker, keeps the lease of every job it has queued or is running"""
+    renewed = db.query(AnalysisJob).filter(
+        AnalysisJob.owner == owner,
+        AnalysisJob.status.in_(["pending", "running"])
+    ).update({"heartbeat_at": utcnow()}, synchronize_session=False)
+    db.commit()
+    return renewed
+
+def release_job_leases(db: Session, owner: str) -> int:
+    """Give back the pending jobs of a worker which stops, the next worker takes them over without waiting for the lease"""
+    released = db.query(AnalysisJob).filter(
+        AnalysisJob.owner == owner,
+        AnalysisJob.status == "pending"
+    ).update({"owner": None, "heartbeat_at": None}, synchronize_session=False)
+    db.commit()
+    return released
+
+def update_job_status(db: Session, job_id: str, status: str, report_id: int = None, result: Dict = None, error: str = None) -> Optional[AnalysisJob]:
+    """Move a job to a new status and store its result or error"""
+    db_job = get_analysis_job(db, job_id)
+    if not db_job:
+        return None
 
+    db_job.status = status
+    if status == "running":
+        db_job.started_at = utcnow()
+    if status in ("completed", "failed"):
+        db_job.completed_at = utcnow()
+    if report_id is not None:
+        db_job.report_id = report_id
+    if result is not None:
+        db_job.result = json.dumps(result, default=str)
+    if error is not None:
+        db_job.error = error
+
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+
+def get_llm_cache_entry(db: Session, key: str, min_created_at: datetime) -> Optional[LLMCacheEntry]:
+    """Get a cached LLM response which is not older than min_created_at, and mark it as used"""
+    entry = db.query(LLMCacheEntry).filter(
+        LLMCacheEntry.key == key,
+        LLMCacheEntry.created_at >= min_created_at
+    ).first()
+    if entry:
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_used_at = utcnow()
+        db.commit()
+    return entry
+
+def save_llm_cache_entry(db: Session, key: str, model: str, agent_role: str, response: str) -> LLMCacheEntry:
+    """Store a LLM response, replacing an expired entry with the same key"""
+    entry = db.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).first()
+    if not entry:
+        entry = LLMCacheEntry(key=key)
+        db.add(entry)
+    entry.model = model
+    entry.agent_role = agent_role
+    entry.response = response
+    entry.hits = 0
+    entry.created_at = entry.last_used_at = utcnow()
+    db.commit()
+    return entry
+
+def evict_llm_cache_entries(db: Session, min_created_at: datetime, max_entries: int) -> int:
+    """Delete the expired entries, then the least recently used ones above max_entries"""
+    deleted = db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < min_created_at).delete()
+
+    extra = db.query(LLMCacheEntry).count() - max_entries
+    if extra > 0:
+        oldest = db.query(LLMCacheEntry.key).order_by(LLMCacheEntry.last_used_at).limit(extra)
+        deleted += db.query(LLMCacheEntry).filter(LLMCacheEntry.key.in_(oldest.scalar_subquery())).delete(synchronize_session=False)
+
+    db.commit()
+    return deleted
@@ -0,0 +1,67 @@
+"""Keyset (cursor) pagination, newest first on (sort column, id).
+
+A page query seeks in the index to the position after the cursor and reads limit + 1 rows, the extra
+row only tells if there is a next page. No OFFSET and no COUNT, so every page costs the same.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, select, tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Opaque cursor pointing after the row (sort_value, row_id)"""
+    raw = json.dumps([sort_value.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Raises ValueError when the cursor was not made by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """Columns asked with fields=a,b,c, all the allowed ones when empty. Raises ValueError on unknown fields"""
+    if not fields:
+        return list(allowed)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}, use: {', '.join(allowed)}")
+    return names
+
+
+def keyset_select(model, sort_column, where, fields: List[str], limit: int, cursor: Optional[str]) -> Select:
+    """Select only the asked columns (plus the keys) of the page after cursor"""
+    columns = {name: getattr(model, name) for name in fields}
+    columns.setdefault("id", model.id)
+    columns.setdefault(sort_column.key, sort_column)
+
+    query = select(*[column.label(name) for name, column in columns.items()]).where(*where)
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(sort_column, model.id) < tuple_(sort_value, row_id))
+    return query.order_by(sort_column.desc(), model.id.desc()).limit(limit + 1)
+
+
+def keyset_page(rows, sort_key: str, fields: List[str], limit: int) -> Dict:
+    """Page response from the limit + 1 rows of keyset_select"""
+    rows = list(rows.mappings())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][sort_key], rows[-1]["id"]) if has_more else None
+    return {
+        "items": [{name: row[name] for name in fields} for row in rows],
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+    }
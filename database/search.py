@@ -0,0 +1,100 @@
+"""SQLite FTS5 index over the report file names, queries and analysis text.
+
+The `report_search` table has one row per report (rowid = report id) with the owner token `u<user_id>`,
+kept in sync by triggers so every write path (api, jobs, bulk import, cascading deletes) updates it
+without extra code.
+"""
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import text, DateTime, Float, Integer, String, Text
+
+### the analysis text of a report is the distinct analysis results, the crew stores the same text for each type
+_ANALYSIS_TEXT = "(SELECT coalesce(group_concat(DISTINCT analysis_result), '') FROM analysis_results WHERE report_id = {report_id})"
+
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE report_search USING fts5(
+        owner, file_name, query, analysis_text,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    f"""INSERT INTO report_search(rowid, owner, file_name, query, analysis_text)
+        SELECT id, 'u' || user_id, coalesce(file_name, ''), coalesce(query, ''), {_ANALYSIS_TEXT.format(report_id="blood_test_reports.id")}
+        FROM blood_test_reports""",
+    """CREATE TRIGGER report_search_report_insert AFTER INSERT ON blood_test_reports BEGIN
+        INSERT INTO report_search(rowid, owner, file_name, query, analysis_text)
+        VALUES (new.id, 'u' || new.user_id, coalesce(new.file_name, ''), coalesce(new.query, ''), '');
+    END""",
+    """CREATE TRIGGER report_search_report_update AFTER UPDATE OF user_id, file_name, query ON blood_test_reports BEGIN
+        UPDATE report_search SET owner = 'u' || new.user_id, file_name = coalesce(new.file_name, ''), query = coalesce(new.query, '')
+        WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER report_search_report_delete AFTER DELETE ON blood_test_reports BEGIN
+        DELETE FROM report_search WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER report_search_analysis_insert AFTER INSERT ON analysis_results BEGIN
+        UPDATE report_search SET analysis_text = {_ANALYSIS_TEXT.format(report_id="new.report_id")}
+        WHERE rowid = new.report_id;
+    END""",
+    f"""CREATE TRIGGER report_search_analysis_delete AFTER DELETE ON analysis_results BEGIN
+        UPDATE report_search SET analysis_text = {_ANALYSIS_TEXT.format(report_id="old.report_id")}
+        WHERE rowid = old.report_id;
+    END""",
+]
+
+### bm25 weights follow the column order, the owner token does not count.
+### ORDER BY rank is done inside FTS5, so only the returned rows are joined and get snippets
+SEARCH_SQL = text("""
+    SELECT r.id, r.file_name, r.query, r.upload_date, report_search.rank AS rank,
+           snippet(report_search, 1, '<b>', '</b>', '...', 12) AS file_name_snippet,
+           snippet(report_search, 2, '<b>', '</b>', '...', 12) AS query_snippet,
+           snippet(report_search, 3, '<b>', '</b>', '...', 12) AS analysis_snippet
+    FROM report_search JOIN blood_test_reports r ON r.id = report_search.rowid
+    WHERE report_search MATCH :match AND report_search.rank MATCH 'bm25(0.0, 4.0, 2.0, 1.0)'
+    ORDER BY report_search.rank
+    LIMIT :limit
+""").columns(id=Integer, file_name=String, query=Text, upload_date=DateTime, rank=Float,
+             file_name_snippet=Text, query_snippet=Text, analysis_snippet=Text)
+
+SEARCH_LIMIT = 50
+
+
+def create_search_index(connection):
+    """Create the FTS table and its triggers, filled with the existing reports, if it does not exist yet"""
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'report_search'"
+    ).first()
+    if exists:
+        return
+    for statement in SEARCH_INDEX_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def match_query(user_id: int, search_term: str) -> Optional[str]:
+    """Turn free text into a FTS5 query on the reports of a user, every word must appear, as a word prefix.
+
+    The user is matched through the indexed owner token, so only the user's reports are scanned.
+    Words are quoted so user input can not break the FTS5 syntax, returns None when there is no word.
+    """
+    words = re.findall(r"\w+", search_term)
+    if not words:
+        return None
+    return f"owner:u{int(user_id)} AND (" + " ".join(f'"{word}"*' for word in words) + ")"
+
+
+def search_results(rows) -> List[Dict]:
+    """Rows of SEARCH_SQL as dicts, with the snippet of the column with the most highlighted words.
+
+    The snippet of the owner column would only highlight the user token, so it is never used.
+    """
+    results = []
+    for row in rows.mappings():
+        snippets = (row["analysis_snippet"], row["query_snippet"], row["file_name_snippet"])
+        results.append({
+            "id": row["id"],
+            "file_name": row["file_name"],
+            "query": row["query"],
+            "upload_date": row["upload_date"],
+            "rank": row["rank"],
+            "snippet": max(snippets, key=lambda snippet: (snippet or "").count("<b>")),
+        })
+    return results
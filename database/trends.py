@@ -0,0 +1,107 @@
+"""Per user, per analyte trends, maintained incrementally.
+
+Each new report updates the `biomarker_trends` rows of its user in the same transaction: the last
+values window (last, previous, delta, rolling mean) and the running sums of a least squares fit
+(slope), so reading the trends of a user never touches the report history.
+"""
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from database.models import Biomarker, BiomarkerTrend, BloodTestReport, utcnow
+from extractor import ANALYTES
+
+ROLLING_WINDOW = 5
+TREND_EPOCH = datetime(2000, 1, 1)
+### no slope while the dates spread less than this (variance in days²), reports of the same day give noise
+MIN_DATE_VARIANCE = 0.01
+
+ANALYTE_NAMES = [analyte.name for analyte in ANALYTES]
+
+
+def _days(moment: datetime) -> float:
+    return (moment - TREND_EPOCH).total_seconds() / 86400.0
+
+
+def _add_point(trend: BiomarkerTrend, moment: datetime, value: float):
+    """Add one measurement to a trend, in any order of dates"""
+    t = _days(moment)
+    trend.count = (trend.count or 0) + 1
+    trend.sum_t = (trend.sum_t or 0.0) + t
+    trend.sum_v = (trend.sum_v or 0.0) + value
+    trend.sum_tt = (trend.sum_tt or 0.0) + t * t
+    trend.sum_tv = (trend.sum_tv or 0.0) + t * value
+    trend.first_at = moment if trend.first_at is None else min(trend.first_at, moment)
+
+    ### window of the latest values by date, an older report only goes in if it is among them
+    recent: List[List[float]] = json.loads(trend.recent_values or "[]")
+    recent.append([t, value])
+    recent.sort(key=lambda point: point[0])
+    recent = recent[-ROLLING_WINDOW:]
+    trend.recent_values = json.dumps(recent)
+
+    trend.last_value = recent[-1][1]
+    trend.last_at = max(trend.last_at or moment, moment)
+    trend.previous_value = recent[-2][1] if len(recent) > 1 else None
+    trend.delta = trend.last_value - trend.previous_value if trend.previous_value is not None else None
+    trend.rolling_mean = sum(v for _, v in recent) / len(recent)
+
+    n = trend.count
+    denominator = n * trend.sum_tt - trend.sum_t * trend.sum_t
+    if denominator / (n * n) >= MIN_DATE_VARIANCE:
+        trend.slope_per_day = (n * trend.sum_tv - trend.sum_t * trend.sum_v) / denominator
+    else:
+        trend.slope_per_day = None
+    trend.updated_at = utcnow()
+
+
+def update_trends(db: Session, reports: Iterable[Tuple[int, datetime, Dict]]):
+    """Add the blood values of new reports, (user_id, date, values), to the trends of their users.
+
+    Loads the trends of the users in one query and does not commit, the caller commits with the reports.
+    """
+    reports = [(user_id, moment or utcnow(), values) for user_id, moment, values in reports if values]
+    if not reports:
+        return
+    user_ids = {user_id for user_id, _, _ in reports}
+    trends = {
+        (trend.user_id, trend.analyte): trend
+        for trend in db.query(BiomarkerTrend).filter(BiomarkerTrend.user_id.in_(user_ids))
+    }
+    for user_id, moment, values in sorted(reports, key=lambda report: report[1]):
+        for analyte, value in values.items():
+            if analyte not in ANALYTE_NAMES or value is None:
+                continue
+            trend = trends.get((user_id, analyte))
+            if trend is None:
+                trend = BiomarkerTrend(user_id=user_id, analyte=analyte)
+                db.add(trend)
+                trends[(user_id, analyte)] = trend
+            _add_point(trend, moment, float(value))
+
+
+def rebuild_user_trends(db: Session, user_id: int):
+    """Recompute the trends of a user from all their reports, after a report was changed or deleted. Does not commit"""
+    ### default synchronize_session, so the deleted rows also leave the session before being recreated
+    db.query(BiomarkerTrend).filter(BiomarkerTrend.user_id == user_id).delete()
+    rows = db.query(BloodTestReport.id, BloodTestReport.upload_date, Biomarker.analyte_code, Biomarker.value).join(
+        Biomarker, Biomarker.report_id == BloodTestReport.id
+    ).filter(BloodTestReport.user_id == user_id)
+
+    reports: Dict[int, Tuple[int, datetime, Dict]] = {}
+    for report_id, upload_date, analyte, value in rows:
+        reports.setdefault(report_id, (user_id, upload_date, {}))[2][analyte] = value
+    update_trends(db, reports.values())
+
+
+def backfill_trends(db: Session) -> int:
+    """Build the trends of every user from the existing reports when the table is still empty"""
+    if db.query(BiomarkerTrend.user_id).first() is not None:
+        return 0
+    user_ids = [user_id for (user_id,) in db.query(BloodTestReport.user_id).distinct()]
+    for user_id in user_ids:
+        rebuild_user_trends(db, user_id)
+    db.commit()
+    return len(user_ids)
@@ -1,55 +1,88 @@
 import re
+from typing import Dict, List, NamedTuple
+
+
+class Analyte(NamedTuple):
+    """One row of the analyte table"""
+    name: str
+    label: str  # label printed in the report
+    unit: str
+    ignore_case: bool = False
+
+
+### Analytes extracted from the reports. The value is the first number followed
+### by the unit on the same line as the label.
+ANALYTES: List[Analyte] = [
+    Analyte("hemoglobin", "Hemoglobin", "g/dL", ignore_case=True),
+    Analyte("total_cholesterol", "Cholesterol, Total", "mg/dL"),
+    Analyte("hdl_cholesterol", "HDL Cholesterol", "mg/dL"),
+    Analyte("ldl_cholesterol", "LDL Cholesterol", "mg/dL"),
+    Analyte("triglycerides", "Triglycerides", "mg/dL"),
+    Analyte("fasting_glucose", "Glucose Fasting", "mg/dL"),
+    Analyte("hba1c", "HbA1c", "%"),
+    Analyte("vitamin_b12", "VITAMIN B12", "pg/mL"),
+    Analyte("vitamin_d", "VITAMIN D", "nmol/L"),
+    Analyte("tsh", "TSH", "μIU/mL"),
+]
+
+ANALYTE_UNITS: Dict[str, str] = {analyte.name: analyte.unit for analyte in ANALYTES}
+
+
+def _label_alternatives(analyte: Analyte) -> List[str]:
+    if not analyte.ignore_case:
+        return [re.escape(analyte.label)]
+    ### re only prefilters on the first character when every branch starts with a
+    ### plain literal, so the first letter is spelled out in both cases
+    first, rest = analyte.label[0], re.escape(analyte.label[1:])
+    return [f"{letter}(?i:{rest})" for letter in dict.fromkeys([first.upper(), first.lower()])]
+
+
+class AnalyteExtractor:
+    """Extract the analytes of a table from a report in a single pass.
+
+    All the labels are compiled into one alternation of literals which is scanned
+    once over the report. For every label found the value is matched right after it,
+    on the rest of the same line only.
+    """
+
+    def __init__(self, analytes: List[Analyte]):
+        self.analytes = analytes
+        alternatives = [alt for analyte in analytes for alt in _label_alternatives(analyte)]
+        self._labels = re.compile("|".join(alternatives))
+        self._by_label = {a.label: a for a in analytes if not a.ignore_case}
+        self._by_label_ci = {a.label.lower(): a for a in analytes if a.ignore_case}
+        ### ignore_case covers the unit as well, "g/dl" and "G/DL" are hemoglobin values too
+        self._values = {
+            a.name: re.compile(rf"[^\n]*?(\d+\.?\d*)\s*{re.escape(a.unit)}", re.IGNORECASE if a.ignore_case else 0)
+            for a in analytes
+        }
+
+    def _analyte_for(self, label: str) -> Analyte:
+        analyte = self._by_label.get(label)
+        if analyte is None:
+            analyte = self._by_label_ci[label.lower()]
+        return analyte
+
+    def extract(self, content: str) -> Dict[str, float]:
+        found = {}
+        for match in self._labels.finditer(content):
+            analyte = self._analyte_for(match.group())
+            ### keep the first value reported for each analyte
+            if analyte.name in found:
+                continue
+            value = self._values[analyte.name].match(content, match.end())
+            if value:
+                found[analyte.name] = float(value.group(1))
+                if len(found) == len(self.analytes):
+                    break
+
+        # return the values in the order of the analyte table
+        return {a.name: found[a.name] for a in self.analytes if a.name in found}
+
+
+blood_value_extractor = AnalyteExtractor(ANALYTES)
+
 
 def extract_blood_values(report_content: str) -> dict:
     """Extract blood test values from report content"""
-    values = {}
-    
-    # Extract hemoglobin
-    hb_match = re.search(r'Hemoglobin.*?(\d+\.?\d*)\s*g/dL', report_content, re.IGNORECASE)
-    if hb_match:
-        values['hemoglobin'] = float(hb_match.group(1))
-    
-    # Extract cholesterol values
-    total_chol_match = re.search(r'Cholesterol, Total.*?(\d+\.?\d*)\s*mg/dL', report_content)
-    if total_chol_match:
-        values['total_cholesterol'] = float(total_chol_match.group(1))
-        
-    hdl_match = re.search(r'HDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', report_content)
-    if hdl_match:
-        values['hdl_cholesterol'] = float(hdl_match.group(1))
-        
-    ldl_match = re.search(r'LDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', report_content)
-    if ldl_match:
-        values['ldl_cholesterol'] = float(ldl_match.group(1))
-    
-    # Extract triglycerides
-    trig_match = re.search(r'Triglycerides.*?(\d+\.?\d*)\s*mg/dL', report_content)
-    if trig_match:
-        values['triglycerides'] = float(trig_match.group(1))
-    
-    # Extract glucose
-    glucose_match = re.search(r'Glucose Fasting.*?(\d+\.?\d*)\s*mg/dL', report_content)
-    if glucose_match:
-        values['fasting_glucose'] = float(glucose_match.group(1))
-    
-    # Extract HbA1c
-    hba1c_match = re.search(r'HbA1c.*?(\d+\.?\d*)\s*%', report_content)
-    if hba1c_match:
-        values['hba1c'] = float(hba1c_match.group(1))
-    
-    # Extract Vitamin B12
-    b12_match = re.search(r'VITAMIN B12.*?(\d+\.?\d*)\s*pg/mL', report_content)
-    if b12_match:
-        values['vitamin_b12'] = float(b12_match.group(1))
-    
-    # Extract Vitamin D
-    vit_d_match = re.search(r'VITAMIN D.*?(\d+\.?\d*)\s*nmol/L', report_content)
-    if vit_d_match:
-        values['vitamin_d'] = float(vit_d_match.group(1))
-    
-    # Extract thyroid values
-    tsh_match = re.search(r'TSH.*?(\d+\.?\d*)\s*μIU/mL', report_content)
-    if tsh_match:
-        values['tsh'] = float(tsh_match.group(1))
-    
-    return values
\ No newline at end of file
+    return blood_value_extractor.extract(report_content)
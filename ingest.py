@@ -0,0 +1,112 @@
+"""Bulk import of historical blood test pdfs, without running the crew.
+
+Usage:
+    python ingest.py <directory> --user-email <email> [--workers 4] [--batch-size 200]
+
+Pdfs are parsed in a process pool, the blood values are extracted with the same
+extractor as the api and the reports are inserted in batched transactions.
+Files already imported for the user are skipped, so an interrupted run can be
+started again with the same arguments.
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
+
+from database.models import SessionLocal, create_tables
+from database.operations import get_user_by_email, bulk_create_blood_test_reports, get_report_file_paths
+from tools.report_cache import parse_report
+
+
+def find_pdfs(directory: str) -> Iterator[str]:
+    """Walk the directory and yield the absolute path of every pdf, in a stable order"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.abspath(os.path.join(root, name))
+
+
+def parse_pdf(path: str) -> Dict:
+    """Worker function, parse one pdf and extract its blood values"""
+    try:
+        report = parse_report(path)
+        return {"path": path, "pages": report["pages"], "blood_values": report["blood_values"], "error": None}
+    except Exception as e:
+        return {"path": path, "pages": 0, "blood_values": {}, "error": str(e)}
+
+
+def report_row(user_id: int, query: str, parsed: Dict) -> Dict:
+    path = parsed["path"]
+    return {
+        "user_id": user_id,
+        "file_name": os.path.basename(path),
+        "file_path": path,
+        ### the file time is the best guess we have for the date of an old report
+        "upload_date": datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).replace(tzinfo=None),
+        "query": query,
+        **parsed["blood_values"]
+    }
+
+
+def ingest(directory: str, user_email: str, query: str, workers: int, batch_size: int) -> Dict:
+    create_tables()
+    db = SessionLocal()
+    try:
+        user = get_user_by_email(db, user_email)
+        if not user:
+            raise ValueError(f"User not found: {user_email}")
+
+        ### resume, skip the files committed by a previous run
+        done = set(get_report_file_paths(db, user.id))
+        all_paths = list(find_pdfs(directory))
+        paths = [path for path in all_paths if path not in done]
+
+        stats = {"files": 0, "pages": 0, "failed": 0, "skipped": len(all_paths) - len(paths), "seconds": 0.0}
+        start = time.perf_counter()
+        batch: List[Dict] = []
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for parsed in executor.map(parse_pdf, paths, chunksize=8):
+                if parsed["error"]:
+                    stats["failed"] += 1
+                    print(f"Warning: Could not parse {parsed['path']}: {parsed['error']}", file=sys.stderr)
+                    continue
+
+                batch.append(report_row(user.id, query, parsed))
+                stats["pages"] += parsed["pages"]
+                if len(batch) >= batch_size:
+                    stats["files"] += bulk_create_blood_test_reports(db, batch)
+                    batch = []
+
+            if batch:
+                stats["files"] += bulk_create_blood_test_reports(db, batch)
+
+        stats["seconds"] = time.perf_counter() - start
+        return stats
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a directory of blood test pdfs into the database")
+    parser.add_argument("directory", help="directory to scan for pdf files")
+    parser.add_argument("--user-email", required=True, help="email of the user who owns the reports")
+    parser.add_argument("--query", default="Bulk import", help="query stored with every imported report")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of parser processes")
+    parser.add_argument("--batch-size", type=int, default=200, help="reports inserted per transaction")
+    args = parser.parse_args(argv)
+
+    stats = ingest(args.directory, args.user_email, args.query, args.workers, args.batch_size)
+
+    seconds = max(stats["seconds"], 1e-9)
+    print(f"Imported {stats['files']} files ({stats['pages']} pages) in {stats['seconds']:.2f}s")
+    print(f"Skipped {stats['skipped']} already imported, {stats['failed']} failed")
+    print(f"Throughput: {stats['files'] / seconds:.1f} files/s, {stats['pages'] / seconds:.1f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from extractor import extract_blood_values
+from database.models import SessionLocal, AnalysisJob, User, utcnow
+from database.operations import (
+    save_report_with_analyses, create_analysis_job, claim_analysis_job, take_over_job,
+    get_unfinished_jobs, release_job_leases, renew_job_leases, update_job_status)
+from crew.loader import load_crew, warm_up_crew
+from crew.rules_analysis import run_rules_analysis
+from tools.report_cache import load_report
+
+### Worker pool configuration
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_WORKER_TYPE = os.getenv("ANALYSIS_WORKER_TYPE", "thread")  # thread or process
+### a worker renews the lease of its unfinished jobs every JOB_HEARTBEAT_SECONDS, a job whose lease is
+### older than JOB_LEASE_SECONDS belongs to a worker which is gone and is taken over by the next heartbeat
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+### lease owner of the jobs queued by this api process, process pool workers run them on its behalf
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+### crew runs the four agents, rules only runs the nutrition and exercise rules without LLM
+ANALYSIS_MODES = ("crew", "rules")
+
+### analysis type saved when its heading is found in the result
+ANALYSIS_MARKERS = {
+    "medical": "MEDICAL ANALYSIS",
+    "nutrition": "NUTRITIONAL ANALYSIS",
+    "exercise": "EXERCISE PLAN",
+}
+
+_executor = None
+_heartbeat_stop = threading.Event()
+_heartbeat_thread: Optional[threading.Thread] = None
+
+
+def job_heartbeat():
+    """Renew the leases of the jobs of this worker, then take over the jobs of the workers which are gone"""
+    db = SessionLocal()
+    try:
+        renew_job_leases(db, WORKER_ID)
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: Could not renew the analysis job leases: {str(e)}")
+    finally:
+        db.close()
+    try:
+        resume_unfinished_jobs()
+    except Exception as e:
+        print(f"Warning: Could not take over the expired analysis jobs: {str(e)}")
+
+
+def _heartbeat():
+    while not _heartbeat_stop.wait(JOB_HEARTBEAT_SECONDS):
+        job_heartbeat()
+
+
+def start_heartbeat():
+    """Start the lease heartbeat of this worker if it is not running yet"""
+    global _heartbeat_thread
+    if _heartbeat_thread is None:
+        _heartbeat_stop.clear()
+        _heartbeat_thread = threading.Thread(target=_heartbeat, name="job-heartbeat", daemon=True)
+        _heartbeat_thread.start()
+
+
+def get_executor():
+    """Get the worker pool, creating it and the lease heartbeat on first use"""
+    global _executor
+    start_heartbeat()
+    if _executor is None:
+        if ANALYSIS_WORKER_TYPE == "process":
+            _executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+    return _executor
+
+
+def warm_up_workers():
+    """Build the crew in the background before the first job, process workers build their own on their first job"""
+    if ANALYSIS_WORKER_TYPE != "process":
+        warm_up_crew()
+
+
+def shutdown_executor(wait: bool = False):
+    """Stop the worker pool and give back the jobs it had not started, the next worker takes them over at once"""
+    global _executor, _heartbeat_thread
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
+    _heartbeat_stop.set()
+    _heartbeat_thread = None
+    ### the running jobs keep their lease until they finish, or until it expires if this process dies first
+    db = SessionLocal()
+    try:
+        release_job_leases(db, WORKER_ID)
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: Could not release the analysis job leases: {str(e)}")
+    finally:
+        db.close()
+
+
+def analyze_and_store(db: Session, user_id: int, file_name: str, file_path: str, query: str, mode: str = "crew",
+                      task_callback: Optional[Callable] = None) -> Dict:
+    """Run the analysis on a report and save the report with its analyses.
+
+    task_callback is called with the output of each crew task as soon as it finishes.
+    """
+    user = db.get(User, user_id)
+    age, gender = (user.age, user.gender) if user else (None, None)
+    if mode == "rules":
+        analysis_result = run_rules_analysis(query, file_path, age, gender)
+        ### values come straight from the pdf, parsed once and cached by the rules run
+        blood_values = load_report(file_path)["blood_values"] if os.path.exists(file_path) else {}
+    else:
+        ## Extracting data from the crew
+        ### crewai and the crew are only imported here, on the first crew analysis of the process
+        analysis_result = load_crew().run_medical_analysis(query, file_path, task_callback, age, gender)
+        ### Extracting information data from the result of crew
+        blood_values = extract_blood_values(str(analysis_result))
+
+    ## Getting the data of result
+    analysis_text = str(analysis_result)
+    upper_text = analysis_text.upper()
+
+    # Save different types of analyses
+    analyses = {
+        analysis_type: analysis_text
+        for analysis_type, marker in ANALYSIS_MARKERS.items()
+        if marker in upper_text
+    }
+
+    ### SAve the report and its analyses in one transaction
+    db_report = save_report_with_analyses(
+        db, user_id, file_name, file_path, query, blood_values, analyses
+    )
+
+    ### prompt and completion tokens of the crew run, rules runs use none
+    token_usage = getattr(analysis_result, "token_usage", None)
+    return {
+        "report_id": db_report.id,
+        "analysis_result": analysis_text,
+        "blood_values": blood_values,
+        "token_usage": token_usage.model_dump() if token_usage is not None else None
+    }
+
+
+def process_analysis_job(job_id: str, owner: str, task_callback: Optional[Callable] = None) -> Optional[Dict]:
+    """Worker entry point, claims the job in the database and runs it.
+
+    Only the job id and the lease owner are passed so the same function works for thread and process
+    pools, task_callback only with thread pools. Returns None without running anything when the job was
+    claimed by another worker.
+    """
+    db = SessionLocal()
+    try:
+        job = claim_analysis_job(db, job_id, owner)
+        if not job:
+            return None
+        try:
+            result = analyze_and_store(db, job.user_id, job.file_name, job.file_path, job.query,
+                                       task_callback=task_callback)
+        except Exception as e:
+            db.rollback()
+            update_job_status(db, job_id, "failed", error=str(e))
+            raise
+        update_job_status(db, job_id, "completed", report_id=result["report_id"], result=result)
+        return result
+    finally:
+        db.close()
+
+
+def submit_analysis_job(db: Session, user_id: int, file_name: str, file_path: str, query: str,
+                        task_callback: Optional[Callable] = None) -> Tuple[AnalysisJob, Future]:
+    """Store a new job leased to this worker and hand it over to the worker pool.
+
+    task_callback is called with the output of each crew task, with thread workers only: the
+    callback can not be sent to a process worker.
+    """
+    job = create_analysis_job(db, str(uuid.uuid4()), user_id, file_name, file_path, query, WORKER_ID)
+    if ANALYSIS_WORKER_TYPE == "process":
+        task_callback = None
+    future = get_executor().submit(process_analysis_job, job.id, WORKER_ID, task_callback)
+    return job, future
+
+
+def resume_unfinished_jobs() -> List[str]:
+    """Queue again the unfinished jobs whose worker is gone, the ones of live workers are left to them.
+
+    Runs on startup and on every heartbeat, so the jobs of a worker which died are taken over once their lease expires.
+    """
+    expired_before = utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+    db = SessionLocal()
+    try:
+        job_ids = [
+            job.id for job in get_unfinished_jobs(db, expired_before)
+            if take_over_job(db, job.id, WORKER_ID, expired_before)
+        ]
+    finally:
+        db.close()
+
+    for job_id in job_ids:
+        get_executor().submit(process_analysis_job, job_id, WORKER_ID)
+    return job_ids
@@ -1,19 +1,32 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 import os
-import shutil
+import json
+import asyncio
+import hashlib
+import uuid
+import time
 from datetime import datetime
 import re
-from extractor import extract_blood_values
-from schema import UserCreate, UserResponse, ReportResponse, AnalysisResponse
-from database.models import create_tables, get_db
-from database.operations import (
-    create_user, get_user_by_email, get_user_by_id, create_blood_test_report,
-    save_analysis_result, get_user_reports, get_report_analyses, search_reports)
-from crew.medical_crew import run_medical_analysis
+from schema import UserCreate, UserResponse, JobResponse, Page, TrendResponse
+from database.models import create_tables, get_db, get_async_db, engine, async_engine
+from database import async_operations
+from database.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, parse_fields
+from database.operations import create_user, get_user_by_email
+from jobs.analysis_jobs import (
+    ANALYSIS_MODES, analyze_and_store, submit_analysis_job, resume_unfinished_jobs, shutdown_executor, start_heartbeat,
+    warm_up_workers)
+from agents.llm_cache import llm_cache
+from crew.loader import crew_status
+from analytics import population_analytics
+from rules import screen_population
+from metrics import MetricsMiddleware, STAGE_SECONDS, metrics_response
+from extractor import ANALYTE_UNITS
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 
 
@@ -25,15 +38,79 @@ app = FastAPI(title="Medical Blood Test Analysis API",
 
 app.add_middleware(CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,allow_methods=["*"],allow_headers=["*"])
+app.add_middleware(MetricsMiddleware)
 
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+### uploads are read and hashed chunk by chunk, bigger files are rejected before being fully read
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+### room for the multipart headers and the other form fields around the file
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+class UploadLimitMiddleware:
+    """ASGI middleware which rejects a request body over max_bytes with 413 before the form is parsed.
+
+    Starlette spools the whole multipart body to a temporary file before the endpoint runs, so the
+    limit has to be checked on the raw body: on Content-Length when there is one, and on the bytes
+    received so far for chunked requests.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        detail = f"Request body is larger than {self.max_bytes} bytes"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    ### raised inside the form parsing, FastAPI turns it into the 413 response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadLimitMiddleware, max_bytes=UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES)
+
+### read only workers serve the stored data, they never import crewai nor run analyses
+API_READ_ONLY = os.getenv("API_READ_ONLY", "false").lower() in ("1", "true", "yes")
+
+def require_analysis_worker():
+    """Dependency of the endpoints which run analyses"""
+    if API_READ_ONLY:
+        raise HTTPException(status_code=503, detail="This worker is read only, analyses run on the other workers")
+
 ### init database
 @app.on_event("startup")
 async def startup_event():
     create_tables()
+    if API_READ_ONLY:
+        return
+    ### queue again the jobs interrupted by the last shutdown, the heartbeat takes over the ones of workers which die later
+    resume_unfinished_jobs()
+    start_heartbeat()
+    ### build the crew off the request path, the first analysis does it itself with CREW_WARMUP=lazy
+    warm_up_workers()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_executor()
+    await async_engine.dispose()
 
 
 @app.get("/")
@@ -57,9 +134,9 @@ async def create_user_endpoint(user: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-async def get_user_endpoint(user_id: int, db: Session = Depends(get_db)):
+async def get_user_endpoint(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """get user by id"""
-    user = get_user_by_id(db, user_id)
+    user = await async_operations.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -73,9 +150,9 @@ async def get_user_endpoint(user_id: int, db: Session = Depends(get_db)):
     )
 
 @app.get("/users/email/{email}", response_model=UserResponse)
-async def get_user_by_email_endpoint(email: str, db: Session = Depends(get_db)):
+async def get_user_by_email_endpoint(email: str, db: AsyncSession = Depends(get_async_db)):
     """Get user by email"""
-    user = get_user_by_email(db, email)
+    user = await async_operations.get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -88,13 +165,61 @@ async def get_user_by_email_endpoint(email: str, db: Session = Depends(get_db)):
         created_at=user.created_at
     )
 
-@app.post("/analyze-report/")
-async def analyze_report_endpoint(file: UploadFile = File(...),user_email: str = Form(...),query: str = Form(...),db: Session = Depends(get_db)):
-    """Upload and analyze blood test report"""
+def _write_chunk(buffer, chunk: bytes):
+    buffer.write(chunk)
+
+async def save_upload(file: UploadFile) -> str:
+    """Save the uploaded pdf in the upload directory and return its path.
+
+    Files are stored by the SHA-256 of their content, so the same pdf uploaded again
+    reuses the stored file. Raises 413 when the file is over UPLOAD_MAX_BYTES, a request body
+    much bigger than that never gets here (see UploadLimitMiddleware).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    try:
+        with STAGE_SECONDS.labels("upload").time(), open(temp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File is larger than {UPLOAD_MAX_BYTES} bytes")
+                digest.update(chunk)
+                ### disk writes go to the threadpool to keep the event loop free
+                await run_in_threadpool(_write_chunk, buffer, chunk)
+
+        file_path = os.path.join(UPLOAD_DIR, f"{digest.hexdigest()}.pdf")
+        if os.path.exists(file_path):
+            ### duplicate upload, keep the stored file
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, file_path)
+        return file_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def job_response(job) -> JobResponse:
+    return JobResponse(
+        job_id=job.id,
+        status=job.status,
+        report_id=job.report_id,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        completed_at=job.completed_at
+    )
+
+@app.post("/analyze-report/", dependencies=[Depends(require_analysis_worker)])
+async def analyze_report_endpoint(file: UploadFile = File(...),user_email: str = Form(...),query: str = Form(...),mode: str = Form("crew"),db: Session = Depends(get_db)):
+    """Upload and analyze blood test report, mode=rules skips the LLM crew"""
     
     ### check pdf is there or not
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode, use one of: {', '.join(ANALYSIS_MODES)}")
     try:
         ### Extracting user data
         user = get_user_by_email(db, user_email)
@@ -102,94 +227,209 @@ async def analyze_report_endpoint(file: UploadFile = File(...),user_email: str =
             raise HTTPException(status_code=404, detail="User not found. Please create user first.")
         
         ### Save the file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name =  f"{timestamp}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, file_name)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        ## Extracting data from the crew 
-        analysis_result = run_medical_analysis(query, file_path)
-        ### Extracting information data from the result of crew 
-        blood_values = extract_blood_values(str(analysis_result))
-        
-        ### SAve data to database
-        db_report = create_blood_test_report(
-            db, user.id, file.filename, file_path, query, blood_values
-        )
+        file_path = await save_upload(file)
         
-        ## Getting the data of result
-        analysis_text = str(analysis_result)
-        
-        # Save different types of analyses
-        if "MEDICAL ANALYSIS" in analysis_text.upper():
-            save_analysis_result(db, db_report.id, "medical", analysis_text)
-        if "NUTRITIONAL ANALYSIS" in analysis_text.upper():
-            save_analysis_result(db, db_report.id, "nutrition", analysis_text)
-        if "EXERCISE PLAN" in analysis_text.upper():
-            save_analysis_result(db, db_report.id, "exercise", analysis_text)
+        if mode == "rules":
+            ### rules only take milliseconds, no need to queue a job
+            job_id = None
+            result = await run_in_threadpool(analyze_and_store, db, user.id, file.filename, file_path, query, mode)
+        else:
+            ### Run the crew in the worker pool and wait without blocking the event loop
+            job, future = submit_analysis_job(db, user.id, file.filename, file_path, query)
+            job_id = job.id
+            result = await asyncio.wrap_future(future)
+            if result is None:
+                raise HTTPException(status_code=409, detail=f"Analysis job {job_id} was claimed by another worker")
         
         return {
             "message": "Analysis completed successfully",
-            "report_id": db_report.id,
-            "analysis_result": analysis_text,
-            "blood_values": blood_values
+            "job_id": job_id,
+            **result
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
-@app.get("/users/{user_id}/reports", response_model=List[ReportResponse])
-async def get_user_reports_endpoint(user_id: int, db: Session = Depends(get_db)):
-    """get the report of the user"""
-    reports = get_user_reports(db, user_id)
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/analyze-report/stream", dependencies=[Depends(require_analysis_worker)])
+async def analyze_report_stream_endpoint(file: UploadFile = File(...),user_email: str = Form(...),query: str = Form(...),db: Session = Depends(get_db)):
+    """Upload and analyze blood test report, streaming a server-sent event as each crew task finishes.
+
+    The analysis is an analysis job run by the worker pool, like POST /analysis-jobs/. Events: `job`
+    (job_id), one `task` event per task (task, output, elapsed), then `result` (job_id, report_id,
+    blood_values, analysis_result, elapsed) or `error`. Process workers send no `task` events.
+    """
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    user = get_user_by_email(db, user_email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found. Please create user first.")
+
+    file_path = await save_upload(file)
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    def elapsed() -> float:
+        return round(time.perf_counter() - started, 3)
+
+    def publish(event: Optional[str]):
+        ### crew callbacks run in worker threads, hand the event over to the event loop
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def on_task_output(output):
+        publish(sse_event("task", {"task": output.name, "output": output.raw, "elapsed": elapsed()}))
+
+    def on_done(future):
+        try:
+            result = future.result()
+            if result is None:
+                raise RuntimeError(f"Analysis job {job.id} was claimed by another worker")
+            publish(sse_event("result", {"job_id": job.id, **result, "elapsed": elapsed()}))
+        except Exception as e:
+            publish(sse_event("error", {"job_id": job.id, "detail": f"Error processing file: {str(e)}", "elapsed": elapsed()}))
+        finally:
+            publish(None)
+
+    ### same worker pool and job accounting as the other analyses, the job is kept if the client goes away
+    job, future = submit_analysis_job(db, user.id, file.filename, file_path, query, task_callback=on_task_output)
+    publish(sse_event("job", {"job_id": job.id}))
+    future.add_done_callback(on_done)
+
+    async def event_stream():
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/analysis-jobs/", response_model=JobResponse, status_code=202, dependencies=[Depends(require_analysis_worker)])
+async def submit_analysis_job_endpoint(file: UploadFile = File(...),user_email: str = Form(...),query: str = Form(...),db: Session = Depends(get_db)):
+    """Upload a blood test report and queue its analysis, returns the job id immediately"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    user = get_user_by_email(db, user_email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found. Please create user first.")
+
+    file_path = await save_upload(file)
+    job, _ = submit_analysis_job(db, user.id, file.filename, file_path, query)
+    return job_response(job)
+
+@app.get("/analysis-jobs/{job_id}", response_model=JobResponse)
+async def get_analysis_job_endpoint(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get the status of an analysis job"""
+    job = await async_operations.get_analysis_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+@app.get("/analysis-jobs/{job_id}/result")
+async def get_analysis_job_result_endpoint(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get the final result of an analysis job"""
+    job = await async_operations.get_analysis_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Error processing file: {job.error}")
+    if job.status != "completed":
+        ### not finished yet, client should poll again
+        return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+    return {
+        "message": "Analysis completed successfully",
+        "job_id": job.id,
+        **json.loads(job.result)
+    }
+
+@app.get("/users/{user_id}/reports", response_model=Page)
+async def get_user_reports_endpoint(user_id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                    cursor: Optional[str] = None, fields: Optional[str] = None,
+                                    db: AsyncSession = Depends(get_async_db)):
+    """get the reports of the user newest first, one page at a time.
+
+    Pass the `next_cursor` of a page as `cursor` to get the next one, `fields=id,file_name` only loads those columns.
+    """
+    try:
+        columns = parse_fields(fields, async_operations.REPORT_FIELDS)
+        return await async_operations.get_user_reports_page(db, user_id, limit, cursor, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/reports/{report_id}/analyses", response_model=Page)
+async def get_report_analyses_endpoint(report_id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                       cursor: Optional[str] = None, fields: Optional[str] = None,
+                                       db: AsyncSession = Depends(get_async_db)):
+    """Get the analyses of a report newest first, one page at a time.
+
+    `fields=id,analysis_type,created_at` skips loading the analysis text.
+    """
+    try:
+        columns = parse_fields(fields, async_operations.ANALYSIS_FIELDS)
+        return await async_operations.get_report_analyses_page(db, report_id, limit, cursor, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/users/{user_id}/trends", response_model=List[TrendResponse])
+async def get_user_trends_endpoint(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Last value, change, rolling mean and slope of every analyte of the user, kept up to date on each report"""
+    trends = await async_operations.get_user_trends(db, user_id)
     return [
-        ReportResponse(
-            id=report.id,
-            user_id=report.user_id,
-            file_name=report.file_name,
-            upload_date=report.upload_date,
-            query=report.query,
-            hemoglobin=report.hemoglobin,
-            total_cholesterol=report.total_cholesterol,
-            hdl_cholesterol=report.hdl_cholesterol,
-            ldl_cholesterol=report.ldl_cholesterol,
-            triglycerides=report.triglycerides,
-            fasting_glucose=report.fasting_glucose,
-            hba1c=report.hba1c,
-            vitamin_b12=report.vitamin_b12,
-            vitamin_d=report.vitamin_d,
-            tsh=report.tsh
+        TrendResponse(
+            analyte=trend.analyte,
+            unit=ANALYTE_UNITS.get(trend.analyte),
+            count=trend.count,
+            first_at=trend.first_at,
+            last_at=trend.last_at,
+            last_value=trend.last_value,
+            previous_value=trend.previous_value,
+            delta=trend.delta,
+            rolling_mean=trend.rolling_mean,
+            slope_per_day=trend.slope_per_day
         )
-        for report in reports
+        for trend in trends
     ]
 
-@app.get("/reports/{report_id}/analyses", response_model=List[AnalysisResponse])
-async def get_report_analyses_endpoint(report_id: int, db: Session = Depends(get_db)):
-    """Get all analyses for a report"""
-    analyses = get_report_analyses(db, report_id)
+@app.get("/biomarkers/{analyte}/reports")
+async def find_reports_by_biomarker_endpoint(analyte: str, min: Optional[float] = None, max: Optional[float] = None,
+                                             limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                             db: AsyncSession = Depends(get_async_db)):
+    """Reports with a value of the analyte in [min, max], e.g. /biomarkers/ldl_cholesterol/reports?min=160"""
+    if analyte not in ANALYTE_UNITS:
+        raise HTTPException(status_code=404, detail=f"Unknown analyte: {analyte}")
+    reports = await async_operations.find_reports_by_biomarker(db, analyte, min, max, limit)
     return [
-        AnalysisResponse(
-            id=analysis.id,
-            report_id=analysis.report_id,
-            analysis_type=analysis.analysis_type,
-            analysis_result=analysis.analysis_result,
-            created_at=analysis.created_at
-        )
-        for analysis in analyses
+        {
+            "report_id": report["report_id"],
+            "value": report["value"],
+            "unit": ANALYTE_UNITS[analyte]
+        }
+        for report in reports
     ]
 
-
 @app.get("/search/reports/{user_id}")
-async def search_reports_endpoint(user_id: int, q: str, db: Session = Depends(get_db)):
-    """Search reports by query or filename"""
-    reports = search_reports(db, user_id, q)
+async def search_reports_endpoint(user_id: int, q: str, db: AsyncSession = Depends(get_async_db)):
+    """Full text search of the reports by query, filename or analysis text, best match first"""
+    reports = await async_operations.search_reports(db, user_id, q)
     return [
         {
-            "id": report.id,
-            "file_name": report.file_name,
-            "query": report.query,
-            "upload_date": report.upload_date
+            "id": report["id"],
+            "file_name": report["file_name"],
+            "query": report["query"],
+            "upload_date": report["upload_date"],
+            "rank": report["rank"],
+            "snippet": report["snippet"]
         }
         for report in reports
     ]
@@ -206,10 +446,39 @@ async def delete_report_endpoint(report_id: int, db: Session = Depends(get_db)):
     else:
         raise HTTPException(status_code=500, detail="Failed to delete report")
 
+@app.get("/analytics/cohorts")
+async def cohort_analytics_endpoint(analytes: Optional[str] = None, bins: int = Query(20, ge=1, le=200)):
+    """Percentiles, histograms and abnormal rates of the blood values over all reports, per age and gender cohort"""
+    names = [name.strip() for name in analytes.split(",") if name.strip()] if analytes else None
+    try:
+        return await run_in_threadpool(population_analytics, engine, names, bins)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/screening")
+async def rule_screening_endpoint(plans: Optional[str] = None):
+    """Number of stored reports each nutrition and exercise rule fires for, with the age and gender of their user"""
+    names = [name.strip() for name in plans.split(",") if name.strip()] if plans else None
+    try:
+        return await run_in_threadpool(screen_population, engine, names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/llm-cache/stats")
+async def llm_cache_stats_endpoint():
+    """Hit and miss counters of the LLM response cache for this process"""
+    return llm_cache.stats()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: request, stage, agent, LLM, search and commit latencies, LLM calls, tokens and tool runs"""
+    body, content_type = metrics_response()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.now()}
+    """Health check endpoint, with the state of the crew of this process"""
+    return {"status": "healthy", "timestamp": datetime.now(), "read_only": API_READ_ONLY, "crew": crew_status()}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,98 @@
+"""Prometheus metrics of the analysis pipeline, served as text on GET /metrics.
+
+Observing a value only updates a few in memory counters under a lock, the text format is built
+when /metrics is scraped, so nothing else is paid when no one scrapes. With PROMETHEUS_MULTIPROC_DIR
+set (process worker pool or several uvicorn workers) each process writes its values to that
+directory and /metrics collects all of them.
+"""
+import os
+import time
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+### seconds, from a SQLite commit to a whole crew run
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "medical_http_request_seconds", "Time to answer a request, by method, route and status",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+### upload, pdf_parse, extraction, crew, rules
+STAGE_SECONDS = Histogram(
+    "medical_stage_seconds", "Time spent in each stage of a report analysis", ["stage"], buckets=LATENCY_BUCKETS,
+)
+AGENT_TASK_SECONDS = Histogram(
+    "medical_agent_task_seconds", "Duration of a crew task, by agent", ["agent"], buckets=LATENCY_BUCKETS,
+)
+### source is model (a real call), cache (the LLM cache) or replay (replay.py)
+LLM_REQUEST_SECONDS = Histogram(
+    "medical_llm_request_seconds", "Time of a LLM call, by agent and source", ["agent", "source"], buckets=LATENCY_BUCKETS,
+)
+LLM_CALLS = Counter("medical_llm_calls", "LLM calls, by agent and source", ["agent", "source"])
+LLM_TOKENS = Counter("medical_llm_tokens", "Tokens reported by the model, by agent and kind (prompt or completion)",
+                     ["agent", "kind"])
+SEARCH_REQUEST_SECONDS = Histogram(
+    "medical_search_request_seconds", "Time of a web search request", buckets=LATENCY_BUCKETS,
+)
+TOOL_INVOCATIONS = Counter("medical_tool_invocations", "Tool runs, by tool", ["tool"])
+DB_COMMIT_SECONDS = Histogram(
+    "medical_db_commit_seconds", "Time of a database session commit, flush included", buckets=LATENCY_BUCKETS,
+)
+### service is gemini or serper, see ratelimit.py
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "medical_rate_limit_wait_seconds", "Time a call waited for the shared rate limit, by service", ["service"],
+    buckets=LATENCY_BUCKETS,
+)
+RATE_LIMIT_QUEUE_WAIT = Gauge(
+    "medical_rate_limit_queue_wait_seconds", "Wait of the latest call for the shared rate limit, by service", ["service"],
+    multiprocess_mode="max",
+)
+RATE_LIMIT_WAITING = Gauge(
+    "medical_rate_limit_waiting", "Calls waiting for the shared rate limit now, by service", ["service"],
+    multiprocess_mode="livesum",
+)
+SERVICE_RETRIES = Counter("medical_service_retries", "Calls retried after a 429 or 5xx, by service and status",
+                          ["service", "status"])
+
+
+class MetricsMiddleware:
+    """ASGI middleware which times every http request until its last byte, streamed responses included.
+
+    The route label is the path template of the matched route, so ids in the url do not make new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status[0])
+            ).observe(time.perf_counter() - start)
+
+
+def metrics_response() -> Tuple[bytes, str]:
+    """Body and content type of the /metrics response"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,172 @@
+"""Rate limits of the Gemini and Serper calls, shared by every process of the host.
+
+Each service has a token bucket stored in one SQLite file (RATE_LIMIT_DB): RPM tokens per minute, at most
+BURST of them saved up. A call takes a token in an immediate transaction, so uvicorn workers and process
+workers all draw from the same budget instead of one budget per agent and per process. A caller without
+token sleeps until the next one is due.
+
+A call which fails with 429 or a 5xx is retried with jittered exponential backoff, and a 429 also pauses
+the bucket for every process until the backoff (or the Retry-After of the response) is over.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from metrics import RATE_LIMIT_QUEUE_WAIT, RATE_LIMIT_WAIT_SECONDS, RATE_LIMIT_WAITING, SERVICE_RETRIES
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(".cache", "rate_limits.db"))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = float(os.getenv("GEMINI_BURST", "10"))
+SERPER_RPM = float(os.getenv("SERPER_RPM", "100"))
+SERPER_BURST = float(os.getenv("SERPER_BURST", "10"))
+### retries of a call failing with 429 or 5xx, the backoff doubles from BASE up to MAX seconds
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "5"))
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "1.0"))
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "60.0"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    paused_until REAL NOT NULL DEFAULT 0
+)
+"""
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status of a litellm or requests error, None when there is none"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds of the Retry-After header of the error response, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, base: float = RATE_LIMIT_BACKOFF_BASE, cap: float = RATE_LIMIT_BACKOFF_MAX) -> float:
+    """Full jitter: a random delay up to base * 2^attempt, so the retries of the workers do not line up"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+    """Token bucket of one service in the shared SQLite file"""
+
+    def __init__(self, name: str, rpm: float, burst: float, path: str = RATE_LIMIT_DB):
+        self.name = name
+        self.rate = rpm / 60.0
+        self.burst = max(burst, 1.0)
+        self.path = path
+        self._local = threading.local()
+        self._created = False
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            ### autocommit mode, the transactions are the explicit BEGIN IMMEDIATE below
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            with self._lock:
+                if not self._created:
+                    connection.execute(_SCHEMA)
+                    self._created = True
+            self._local.connection = connection
+        return connection
+
+    def _take(self) -> float:
+        """Take a token, or return the seconds until one is due"""
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated_at, paused_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            tokens, updated_at, paused_until = row if row else (self.burst, now, 0.0)
+            tokens = min(self.burst, tokens + max(now - updated_at, 0.0) * self.rate)
+            if paused_until > now:
+                wait = paused_until - now
+            elif tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            connection.execute(
+                "INSERT INTO buckets (name, tokens, updated_at, paused_until) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (self.name, tokens, now, paused_until),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self) -> float:
+        """Wait for a token of the shared bucket, returns the seconds waited"""
+        start = time.perf_counter()
+        waiting = False
+        try:
+            while True:
+                wait = self._take()
+                if wait <= 0:
+                    break
+                if not waiting:
+                    RATE_LIMIT_WAITING.labels(self.name).inc()
+                    waiting = True
+                ### a little jitter so the waiting processes do not all wake up at once
+                time.sleep(wait + random.uniform(0, 0.05))
+        finally:
+            if waiting:
+                RATE_LIMIT_WAITING.labels(self.name).dec()
+        waited = time.perf_counter() - start
+        RATE_LIMIT_WAIT_SECONDS.labels(self.name).observe(waited)
+        RATE_LIMIT_QUEUE_WAIT.labels(self.name).set(waited)
+        return waited
+
+    def pause(self, seconds: float):
+        """Stop every process from calling the service for some seconds, after a 429"""
+        connection = self._connection()
+        until = time.time() + seconds
+        connection.execute(
+            "INSERT INTO buckets (name, tokens, updated_at, paused_until) VALUES (?, 0, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)",
+            (self.name, time.time(), until),
+        )
+
+    def call(self, fn: Callable[[], Any], retries: int = RATE_LIMIT_RETRIES) -> Any:
+        """Run fn within the rate limit, retrying on 429 and 5xx with jittered exponential backoff"""
+        if not RATE_LIMIT_ENABLED:
+            return fn()
+        for attempt in range(retries + 1):
+            self.acquire()
+            try:
+                return fn()
+            except Exception as e:
+                status = error_status(e)
+                if attempt == retries or status is None or not (status == 429 or 500 <= status < 600):
+                    raise
+                SERVICE_RETRIES.labels(self.name, str(status)).inc()
+                delay = max(backoff(attempt), retry_after(e) or 0.0)
+                if status == 429:
+                    ### the quota is shared, so the other processes wait too
+                    self.pause(delay)
+                else:
+                    time.sleep(delay)
+
+
+gemini_limiter = RateLimiter("gemini", GEMINI_RPM, GEMINI_BURST)
+serper_limiter = RateLimiter("serper", SERPER_RPM, SERPER_BURST)
@@ -0,0 +1,112 @@
+"""Record and replay of the LLM and web search calls, for offline and deterministic crew runs.
+
+LLM_BACKEND and SEARCH_BACKEND select the backend of each service:
+- live (default) calls the real service
+- record calls it too and writes every response to RECORDINGS_DIR, keyed by the normalized request
+- replay serves the recorded responses without any network call, after REPLAY_LATENCY_MS
+  (milliseconds, or `recorded` to wait as long as the recorded call took)
+
+A replayed request which was never recorded raises ReplayMissError, with REPLAY_MISSING=stub it
+gets a fixed stub response instead, so the pipeline also runs without any recording.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+BACKENDS = ("live", "record", "replay")
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "live").lower()
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "live").lower()
+RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "recordings")
+REPLAY_LATENCY_MS = os.getenv("REPLAY_LATENCY_MS", "0")
+REPLAY_MISSING = os.getenv("REPLAY_MISSING", "error").lower()  # error or stub
+
+for _name, _backend in (("LLM_BACKEND", LLM_BACKEND), ("SEARCH_BACKEND", SEARCH_BACKEND)):
+    if _backend not in BACKENDS:
+        raise ValueError(f"{_name} must be one of {', '.join(BACKENDS)}, got {_backend}")
+
+
+class ReplayMissError(KeyError):
+    """A request was replayed but never recorded"""
+
+
+def record_key(*parts) -> str:
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Recordings:
+    """Recorded responses of one service, one json file per request in RECORDINGS_DIR/<kind>"""
+
+    def __init__(self, kind: str, backend: str, directory: str = RECORDINGS_DIR, latency_ms: str = REPLAY_LATENCY_MS):
+        self.kind = kind
+        self.backend = backend
+        self.directory = os.path.join(directory, kind)
+        self.latency_ms = latency_ms
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str) -> Optional[Dict]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key: str, entry: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def _wait(self, entry: Optional[Dict]):
+        """Artificial latency of a replayed call"""
+        if self.latency_ms == "recorded":
+            delay = (entry or {}).get("elapsed_ms", 0.0)
+        else:
+            delay = float(self.latency_ms or 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def call(self, key: str, request: Dict, live: Callable[[], Any], stub: Callable[[], Any]) -> Any:
+        """Response of a request with the backend of this service, live is the real call"""
+        if self.backend == "replay":
+            entry = self.load(key)
+            with self._lock:
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if entry is None and REPLAY_MISSING != "stub":
+                raise ReplayMissError(
+                    f"No recorded {self.kind} response {key} in {self.directory}, record it first or set REPLAY_MISSING=stub"
+                )
+            self._wait(entry)
+            return entry["response"] if entry is not None else stub()
+
+        start = time.perf_counter()
+        response = live()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if self.backend == "record":
+            try:
+                self.save(key, {**request, "response": response, "elapsed_ms": round(elapsed_ms, 1)})
+            except (OSError, TypeError) as e:
+                print(f"Warning: Could not record {self.kind} response: {str(e)}")
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.backend, "hits": self.hits, "misses": self.misses}
+
+
+llm_recordings = Recordings("llm", LLM_BACKEND)
+search_recordings = Recordings("search", SEARCH_BACKEND)
@@ -0,0 +1,191 @@
+"""Context of a report given to the agents.
+
+The cleaned pdf text carries headers, footers and lab notes, about 22k characters for the sample report,
+and every task which reads it pays for them in prompt tokens. The compact context prints the page header
+(patient, dates, laboratory) once, then one line per analyte (label, value, unit, reference range of the lab
+and flag) parsed once from the cached report. The lines keep the label and unit printed in the report, so the
+nutrition and exercise tools extract the values from them as well. The lines of the report which were not
+extracted follow the table, only the repeated page headers and footers, page numbers and table rules are dropped.
+
+REPORT_CONTEXT=full gives the agents the pdf text through the blood_test_reader tool, as before.
+"""
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from analytics import GENDERS
+from extractor import ANALYTES
+from rules import COMPARATORS, DEFAULT_AGE, RULES, gender_code
+
+CONTEXT_MODES = ("compact", "full")
+REPORT_CONTEXT = os.getenv("REPORT_CONTEXT", "compact").lower()
+
+if REPORT_CONTEXT not in CONTEXT_MODES:
+    raise ValueError(f"REPORT_CONTEXT must be one of {', '.join(CONTEXT_MODES)}, got {REPORT_CONTEXT}")
+
+### what the tasks get in place of the report in full mode, or when the analyte rows are not the whole report
+FULL_CONTEXT_NOTE = "Read the report with the blood_test_reader tool."
+### rough size of a token for the estimates, the real count depends on the model tokenizer
+CHARS_PER_TOKEN = 4
+
+### lines of table rules only, "|------|------|", and the page numbers
+_RULE_LINE = re.compile(r"[-|+=_\s]*")
+_PAGE_NUMBER = re.compile(r"Page \d+ of \d+", re.IGNORECASE)
+### an analyte printed on one line: label, value, unit, then the reference range if any
+_RESULT_LINES = {
+    analyte.name: re.compile(
+        rf"{re.escape(analyte.label)}:?\s*(\d+\.?\d*)\s*{re.escape(analyte.unit)}\s*(.*)",
+        re.IGNORECASE if analyte.ignore_case else 0,
+    )
+    for analyte in ANALYTES
+}
+
+
+def patient_context(age: Optional[int] = None, gender: Optional[str] = None) -> str:
+    """Patient line of the task descriptions, the reference ranges and flags are the ones of this patient"""
+    gender = GENDERS[gender_code(gender)]
+    return f"{'gender unknown' if gender == 'unknown' else gender}, {'age unknown' if age is None else f'{age} years old'}"
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def reference_rules(age: Optional[int] = None, gender: Optional[str] = None) -> Dict[str, List]:
+    """Bounds of the reference range of each analyte: the nutrition rules of the user which flag a value"""
+    gender = GENDERS[gender_code(gender)]
+    age = DEFAULT_AGE if age is None else age
+    bounds: Dict[str, List] = {}
+    for rule in RULES:
+        if rule.plan != "nutrition" or rule.comparator == "normal":
+            continue
+        if rule.genders and gender not in rule.genders:
+            continue
+        if (rule.min_age is not None and age < rule.min_age) or (rule.max_age is not None and age >= rule.max_age):
+            continue
+        bounds.setdefault(rule.analyte, []).append(rule)
+    return bounds
+
+
+def _flag(value: float, rules: List) -> str:
+    for rule in rules:
+        if COMPARATORS[rule.comparator](value, rule.threshold):
+            return "LOW" if rule.comparator.startswith("<") else "HIGH"
+    return "normal"
+
+
+def report_lines(text: str) -> List[str]:
+    """Lines of the report text with their runs of spaces collapsed, without the blank lines and table rules"""
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return [line for line in lines if not _RULE_LINE.fullmatch(line)]
+
+
+def _shared(lines: List[str], other: List[str]) -> int:
+    """Number of first lines two lists have in common"""
+    size = 0
+    while size < min(len(lines), len(other)) and lines[size] == other[size]:
+        size += 1
+    return size
+
+
+def split_pages(lines: List[str]) -> Tuple[List[str], List[List[str]], List[str]]:
+    """Header printed at the top of the pages, the lines of each page and the footer printed at the end of the pages.
+
+    A page starts at every repetition of the first line. The header is the longest run of first lines another page
+    repeats, each page drops the part of it which it repeats (the footer likewise with the last lines of the first page).
+    The page numbers are dropped, a report without repeated first line is one page.
+    """
+    lines = [line for line in lines if not _PAGE_NUMBER.fullmatch(line)]
+    starts = [i for i, line in enumerate(lines) if line == lines[0]]
+    pages = [lines[start:end] for start, end in zip(starts, starts[1:] + [len(lines)])]
+    if len(pages) < 2:
+        return [], [lines], []
+    heads = [len(pages[0])] + [_shared(page, pages[0]) for page in pages[1:]]
+    header = pages[0][:max(heads[1:])]
+    pages = [page[min(head, len(header)):] for page, head in zip(pages, heads)]
+    tails = [len(pages[0])] + [_shared(page[::-1], pages[0][::-1]) for page in pages[1:]]
+    footer = pages[0][len(pages[0]) - max(tails[1:]):] if max(tails[1:]) else []
+    pages = [page[:len(page) - min(tail, len(footer))] for page, tail in zip(pages, tails)]
+    return header, pages, footer
+
+
+def summary_rows(lines: List[str], age: Optional[int] = None, gender: Optional[str] = None) -> Tuple[List[Dict], Set[int]]:
+    """analyte, label, value, unit, reference range and flag of each analyte printed as "label value unit range", in table order.
+
+    The reference range is the one printed by the lab, the flag the one of the nutrition rules for the user.
+    Also returns the indexes of the lines the rows were read from. Only the first line of an analyte is read,
+    the lines of other layouts (value before the label, value on another line) are left to the agents.
+    """
+    bounds = reference_rules(age, gender)
+    found: Dict[str, Tuple[int, re.Match]] = {}
+    for i, line in enumerate(lines):
+        for analyte in ANALYTES:
+            if analyte.name in found:
+                continue
+            match = _RESULT_LINES[analyte.name].fullmatch(line)
+            if match:
+                found[analyte.name] = (i, match)
+                break
+    rows = []
+    for analyte in ANALYTES:
+        if analyte.name not in found:
+            continue
+        match = found[analyte.name][1]
+        value = float(match.group(1))
+        rows.append({
+            "analyte": analyte.name,
+            "label": analyte.label,
+            "value": value,
+            "unit": analyte.unit,
+            "reference": match.group(2) or "not printed",
+            "flag": _flag(value, bounds.get(analyte.name, [])),
+        })
+    return rows, {i for i, _ in found.values()}
+
+
+def _compact(report: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> Tuple[str, bool]:
+    """Compact text of a parsed report, and whether every line of the report is one of its analyte rows"""
+    header, pages, footer = split_pages(report_lines(report["text"]))
+    body = [line for page in pages for line in page]
+    rows, used = summary_rows(body, age, gender)
+    other = [line for i, line in enumerate(body) if i not in used]
+    extracted = {row["analyte"] for row in rows}
+    missing = [analyte.label for analyte in ANALYTES if analyte.name not in extracted]
+    lines = [f"Blood test report, {report['pages']} pages, {len(rows)} of {len(ANALYTES)} analytes extracted", *header,
+             "test | value unit | reference range | flag"]
+    lines += [f"{row['label']} | {row['value']:g} {row['unit']} | {row['reference']} | {row['flag']}" for row in rows]
+    if missing:
+        lines.append(f"Not extracted: {'; '.join(missing)}" + (", read them in the report lines below" if other else ""))
+    if other:
+        lines.append("Report lines not extracted:")
+        lines += other
+    lines += footer
+    return "\n".join(lines), not other
+
+
+def format_summary(report: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> str:
+    """Compact text of a parsed report (see tools/report_cache.py).
+
+    The header of the pages once, then one row per extracted analyte. When extraction does not cover the
+    whole report the lines which were not extracted follow, so the agents still see every result of the lab.
+    """
+    return _compact(report, age, gender)[0]
+
+
+def report_context(report: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> str:
+    """What the agents read for a report with REPORT_CONTEXT"""
+    if REPORT_CONTEXT == "full":
+        return report["text"]
+    return format_summary(report, age, gender)
+
+
+def task_context(report: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> str:
+    """Report given to the tasks in their description, the compact summary or a note to use the tool.
+
+    The summary is only part of every description when it is the whole report (each analyte row and nothing
+    else), otherwise the tasks read the report once with the tool like in full mode.
+    """
+    if REPORT_CONTEXT == "full":
+        return FULL_CONTEXT_NOTE
+    summary, covered = _compact(report, age, gender)
+    return summary if covered else FULL_CONTEXT_NOTE
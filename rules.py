@@ -0,0 +1,305 @@
+"""Nutrition and exercise recommendations from a table of rules.
+
+Each rule is one row (plan, group, analyte, comparator, threshold, demographic filter, message). The
+table is compiled once per plan into arrays, then a batch of reports is evaluated with NumPy on whole
+columns: one boolean matrix of reports x rules. A group gives its `normal` message to the reports
+where one of its analytes is measured and none of its other rules fired.
+"""
+import operator
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analytics import ANALYTE_NAMES, GENDERS, cohort_matrix
+
+### age used for the age filters when the user has no age
+DEFAULT_AGE = 30
+
+
+class Rule(NamedTuple):
+    """One row of the rule table"""
+    plan: str  # nutrition or exercise
+    group: str  # rules of a group share their normal message
+    analyte: str
+    comparator: str  # <, <=, >, >= or normal
+    threshold: Optional[float]
+    message: str
+    genders: Tuple[str, ...] = ()  # names of GENDERS, empty for everyone
+    min_age: Optional[float] = None  # min_age <= age < max_age
+    max_age: Optional[float] = None
+
+
+class Plan(NamedTuple):
+    """Text around the messages of a plan"""
+    prefix: str
+    separator: str
+    lead: List[str]
+    footer: List[str]
+    empty: Optional[str] = None  # used when no rule fired
+
+
+MALE = ("male", "unknown")
+FEMALE = ("female",)
+
+_CARDIO_FOCUS = (
+    "\n• CARDIOVASCULAR FOCUS (Elevated Cholesterol/Triglycerides):\n"
+    "  - Moderate-intensity cardio: 150 minutes/week (brisk walking, cycling)\n"
+    "  - High-intensity interval training (HIIT): 2-3 sessions/week, 20-30 minutes\n"
+    "  - Swimming or elliptical: 3-4 times/week, 30-45 minutes"
+)
+_CARDIO_FOCUS_SENIOR = (
+    "\n• CARDIOVASCULAR FOCUS (Elevated Cholesterol/Triglycerides):\n"
+    "  - Moderate-intensity, low-impact cardio: 150 minutes/week (brisk walking, stationary cycling)\n"
+    "  - Swimming or water aerobics: 2-3 times/week, 30 minutes\n"
+    "  - Balance exercises: 2 times/week to prevent falls"
+)
+_CARDIO_MAINTENANCE = (
+    "\n• CARDIOVASCULAR MAINTENANCE:\n"
+    "  - Regular cardio: 120-150 minutes/week (running, cycling, swimming)\n"
+    "  - Mix of moderate and vigorous intensity exercises"
+)
+_GLUCOSE_FOCUS = (
+    "\n• GLUCOSE MANAGEMENT (Elevated Blood Sugar):\n"
+    "  - Post-meal walks: 10-15 minutes after each meal\n"
+    "  - Resistance training: 3 times/week, focusing on major muscle groups\n"
+    "  - Avoid prolonged sitting; take movement breaks every hour\n"
+    "  - Monitor blood sugar before and after exercise initially"
+)
+_METABOLIC_MAINTENANCE = (
+    "\n• METABOLIC HEALTH MAINTENANCE:\n"
+    "  - Regular strength training: 2-3 times/week\n"
+    "  - Compound exercises: squats, deadlifts, push-ups"
+)
+_LOW_HEMOGLOBIN = (
+    "\n• ENERGY MANAGEMENT (Lower Hemoglobin):\n"
+    "  - Start with low-intensity exercises\n"
+    "  - Gradually increase intensity as iron levels improve\n"
+    "  - Focus on breathing exercises and yoga\n"
+    "  - Avoid overexertion; listen to your body"
+)
+_NORMAL_HEMOGLOBIN = (
+    "\n• PERFORMANCE OPTIMIZATION:\n"
+    "  - High-intensity workouts are well-tolerated\n"
+    "  - Include both aerobic and anaerobic training"
+)
+
+### thresholds of the reference ranges, hemoglobin has its own range for women
+RULES: List[Rule] = [
+    Rule("nutrition", "hemoglobin", "hemoglobin", "<", 13.0, "Low hemoglobin detected. Include iron-rich foods: lean red meat, spinach, lentils, and vitamin C-rich foods to enhance iron absorption.", MALE),
+    Rule("nutrition", "hemoglobin", "hemoglobin", "<", 12.0, "Low hemoglobin detected. Include iron-rich foods: lean red meat, spinach, lentils, and vitamin C-rich foods to enhance iron absorption.", FEMALE),
+    Rule("nutrition", "hemoglobin", "hemoglobin", ">", 17.0, "Elevated hemoglobin. Ensure adequate hydration and consider consulting healthcare provider.", MALE),
+    Rule("nutrition", "hemoglobin", "hemoglobin", ">", 15.5, "Elevated hemoglobin. Ensure adequate hydration and consider consulting healthcare provider.", FEMALE),
+    Rule("nutrition", "hemoglobin", "hemoglobin", "normal", None, "Hemoglobin levels are normal. Maintain balanced iron intake through lean meats, legumes, and leafy greens."),
+    Rule("nutrition", "total_cholesterol", "total_cholesterol", ">=", 200.0, "Elevated total cholesterol. Increase soluble fiber intake (oats, beans, apples), omega-3 fatty acids (fatty fish, walnuts), and limit saturated fats."),
+    Rule("nutrition", "total_cholesterol", "total_cholesterol", "normal", None, "Total cholesterol is within healthy range. Continue heart-healthy diet with fruits, vegetables, and whole grains."),
+    Rule("nutrition", "hdl_cholesterol", "hdl_cholesterol", "<", 40.0, "Low HDL cholesterol. Increase physical activity, include healthy fats (olive oil, avocados), and omega-3 rich foods."),
+    Rule("nutrition", "hdl_cholesterol", "hdl_cholesterol", "normal", None, "HDL cholesterol is adequate. Maintain current healthy fat intake and regular exercise."),
+    Rule("nutrition", "ldl_cholesterol", "ldl_cholesterol", ">=", 100.0, "LDL cholesterol is elevated. Focus on plant-based foods, reduce saturated fat, and increase soluble fiber."),
+    Rule("nutrition", "ldl_cholesterol", "ldl_cholesterol", "normal", None, "LDL cholesterol is optimal. Continue current dietary patterns."),
+    Rule("nutrition", "triglycerides", "triglycerides", ">=", 150.0, "Elevated triglycerides. Reduce refined carbohydrates, limit alcohol, increase omega-3 intake, and maintain healthy weight."),
+    Rule("nutrition", "triglycerides", "triglycerides", "normal", None, "Triglyceride levels are normal. Continue balanced carbohydrate intake and healthy fats."),
+    Rule("nutrition", "fasting_glucose", "fasting_glucose", ">=", 100.0, "Elevated fasting glucose. Focus on complex carbohydrates, increase fiber intake, limit simple sugars, and maintain portion control."),
+    Rule("nutrition", "fasting_glucose", "fasting_glucose", "normal", None, "Fasting glucose is normal. Continue balanced carbohydrate intake with whole grains and vegetables."),
+    Rule("nutrition", "hba1c", "hba1c", ">=", 5.7, "HbA1c indicates prediabetes risk. Focus on low glycemic index foods, regular meal timing, and weight management."),
+    Rule("nutrition", "hba1c", "hba1c", "normal", None, "HbA1c is normal, indicating good glucose control over past 2-3 months."),
+    Rule("nutrition", "vitamin_b12", "vitamin_b12", "<", 300.0, "Vitamin B12 is on the lower side. Include B12-rich foods: fish, meat, dairy, or consider supplementation if vegetarian."),
+    Rule("nutrition", "vitamin_b12", "vitamin_b12", "normal", None, "Vitamin B12 levels are adequate. Continue current intake of animal products or fortified foods."),
+    Rule("nutrition", "vitamin_d", "vitamin_d", "<", 75.0, "Vitamin D deficiency detected. Increase sun exposure, include fatty fish, fortified dairy, and consider supplementation."),
+    Rule("nutrition", "vitamin_d", "vitamin_d", "normal", None, "Vitamin D levels are sufficient. Continue current sun exposure and dietary sources."),
+    Rule("nutrition", "tsh", "tsh", ">", 4.78, "Elevated TSH may indicate thyroid dysfunction. Ensure adequate iodine intake through iodized salt and seafood."),
+    Rule("nutrition", "tsh", "tsh", "<", 0.55, "Low TSH detected. Monitor thyroid function and avoid excessive iodine intake."),
+    Rule("nutrition", "tsh", "tsh", "normal", None, "TSH levels are normal, indicating healthy thyroid function."),
+
+    Rule("exercise", "cardio", "total_cholesterol", ">=", 200.0, _CARDIO_FOCUS, max_age=65),
+    Rule("exercise", "cardio", "triglycerides", ">=", 150.0, _CARDIO_FOCUS, max_age=65),
+    Rule("exercise", "cardio", "total_cholesterol", ">=", 200.0, _CARDIO_FOCUS_SENIOR, min_age=65),
+    Rule("exercise", "cardio", "triglycerides", ">=", 150.0, _CARDIO_FOCUS_SENIOR, min_age=65),
+    Rule("exercise", "cardio", "total_cholesterol", "normal", None, _CARDIO_MAINTENANCE),
+    Rule("exercise", "cardio", "triglycerides", "normal", None, _CARDIO_MAINTENANCE),
+    Rule("exercise", "glucose", "fasting_glucose", ">=", 100.0, _GLUCOSE_FOCUS),
+    Rule("exercise", "glucose", "hba1c", ">=", 5.7, _GLUCOSE_FOCUS),
+    Rule("exercise", "glucose", "fasting_glucose", "normal", None, _METABOLIC_MAINTENANCE),
+    Rule("exercise", "glucose", "hba1c", "normal", None, _METABOLIC_MAINTENANCE),
+    Rule("exercise", "hemoglobin", "hemoglobin", "<", 13.0, _LOW_HEMOGLOBIN, MALE),
+    Rule("exercise", "hemoglobin", "hemoglobin", "<", 12.0, _LOW_HEMOGLOBIN, FEMALE),
+    Rule("exercise", "hemoglobin", "hemoglobin", "normal", None, _NORMAL_HEMOGLOBIN),
+    Rule("exercise", "thyroid", "tsh", ">", 4.78,
+         "\n• THYROID CONSIDERATIONS (Elevated TSH):\n"
+         "  - Start slowly and build exercise tolerance gradually\n"
+         "  - Focus on consistent, moderate-intensity exercise\n"
+         "  - Include stress-reducing activities like yoga or tai chi"),
+    Rule("exercise", "thyroid", "tsh", "<", 0.55,
+         "\n• THYROID CONSIDERATIONS (Low TSH):\n"
+         "  - Monitor heart rate during exercise\n"
+         "  - Avoid excessive high-intensity training\n"
+         "  - Include calming exercises like stretching or meditation"),
+]
+
+PLANS: Dict[str, Plan] = {
+    "nutrition": Plan(
+        prefix="NUTRITIONAL ANALYSIS BASED ON BLOOD REPORT:\n\n",
+        separator="\n\n",
+        lead=[],
+        footer=[
+            "\nGeneral Recommendations:",
+            "• Stay hydrated with 8-10 glasses of water daily",
+            "• Include 5 servings of fruits and vegetables daily",
+            "• Choose whole grains over refined grains",
+            "• Limit processed foods and added sugars",
+            "• Include lean proteins in each meal",
+        ],
+        empty="All measured parameters appear normal. Maintain a balanced diet with variety of nutrients.",
+    ),
+    "exercise": Plan(
+        prefix="",
+        separator="\n",
+        lead=[
+            "PERSONALIZED EXERCISE PLAN BASED ON BLOOD REPORT:",
+            "\nBased on your blood test results, here are tailored exercise recommendations:",
+        ],
+        footer=[
+            "\n• SUGGESTED WEEKLY SCHEDULE:",
+            "  Monday: Full-body strength training (45-60 minutes)",
+            "  Tuesday: Cardio workout (30-45 minutes)",
+            "  Wednesday: Yoga or flexibility training (30-45 minutes)",
+            "  Thursday: Upper body strength + core (45-60 minutes)",
+            "  Friday: HIIT or circuit training (30-40 minutes)",
+            "  Saturday: Outdoor activity (hiking, sports, cycling)",
+            "  Sunday: Active recovery (light walk, stretching)",
+            "\n• IMPORTANT SAFETY NOTES:",
+            "  - Warm up for 5-10 minutes before exercising",
+            "  - Cool down and stretch after workouts",
+            "  - Stay hydrated throughout exercise",
+            "  - Progress gradually; avoid sudden intensity increases",
+            "  - Consult healthcare provider before starting intense exercise program",
+            "\n• MONITORING & FOLLOW-UP:",
+            "  - Track energy levels and exercise tolerance",
+            "  - Retest blood parameters in 3-6 months",
+            "  - Adjust exercise intensity based on how you feel",
+            "  - Keep a workout log to track progress",
+        ],
+    ),
+}
+
+COMPARATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+def gender_code(gender: Optional[str]) -> int:
+    """Index in GENDERS of a user gender, same mapping as the cohort query"""
+    gender = (gender or "").strip().lower()
+    if gender in ("male", "m"):
+        return GENDERS.index("male")
+    if gender in ("female", "f"):
+        return GENDERS.index("female")
+    return GENDERS.index("unknown")
+
+
+class RuleEngine:
+    """Rules of one plan compiled into arrays, evaluated on a batch of reports at once"""
+
+    def __init__(self, rules: Sequence[Rule]):
+        self.rules = list(rules)
+        unknown = sorted({rule.analyte for rule in self.rules} - set(ANALYTE_NAMES))
+        if unknown:
+            raise ValueError(f"Unknown analytes in rules: {', '.join(unknown)}")
+        self.columns = np.array([ANALYTE_NAMES.index(rule.analyte) for rule in self.rules], dtype=np.int64)
+        self.thresholds = np.array([np.nan if rule.threshold is None else rule.threshold for rule in self.rules])
+        self.normal = np.array([rule.comparator == "normal" for rule in self.rules])
+        self.min_age = np.array([-np.inf if rule.min_age is None else rule.min_age for rule in self.rules])
+        self.max_age = np.array([np.inf if rule.max_age is None else rule.max_age for rule in self.rules])
+        ### rows: gender codes, columns: rules
+        self.gender_allowed = np.array(
+            [[not rule.genders or gender in rule.genders for rule in self.rules] for gender in GENDERS]
+        )
+        groups = list(dict.fromkeys(rule.group for rule in self.rules))
+        self.group_of_rule = np.array([groups.index(rule.group) for rule in self.rules], dtype=np.int64)
+        self.group_matrix = np.zeros((len(self.rules), len(groups)))
+        self.group_matrix[np.arange(len(self.rules)), self.group_of_rule] = 1.0
+        self.comparisons = [
+            (COMPARATORS[comparator], np.array([rule.comparator == comparator for rule in self.rules]))
+            for comparator in COMPARATORS
+        ]
+
+    def evaluate(self, values: np.ndarray, age: np.ndarray, gender: np.ndarray) -> np.ndarray:
+        """Boolean matrix reports x rules of the rules that fired.
+
+        values has one column per ANALYTE_NAMES (NaN when missing), age is NaN when unknown and gender
+        holds the GENDERS codes.
+        """
+        measured = values[:, self.columns]
+        present = ~np.isnan(measured)
+        age = np.where(np.isnan(age), DEFAULT_AGE, age)[:, None]
+        applies = (age >= self.min_age) & (age < self.max_age) & self.gender_allowed[gender.astype(np.int64)]
+
+        matched = np.zeros(measured.shape, dtype=bool)
+        with np.errstate(invalid="ignore"):
+            for compare, selected in self.comparisons:
+                matched[:, selected] = compare(measured[:, selected], self.thresholds[selected])
+        findings = present & matched & applies & ~self.normal
+
+        ### a normal message only goes to the reports where no other rule of its group fired
+        group_fired = (findings @ self.group_matrix) > 0
+        normals = present & applies & self.normal & ~group_fired[:, self.group_of_rule]
+        return findings | normals
+
+    def messages(self, fired: np.ndarray) -> List[str]:
+        """Messages of the rules fired for one report, in table order without repeats"""
+        return list(dict.fromkeys(self.rules[i].message for i in np.flatnonzero(fired)))
+
+
+ENGINES: Dict[str, RuleEngine] = {
+    plan: RuleEngine([rule for rule in RULES if rule.plan == plan]) for plan in PLANS
+}
+
+
+def values_row(values: Dict) -> np.ndarray:
+    """One row matrix of blood values in ANALYTE_NAMES order, NaN when missing"""
+    return np.array([[np.nan if values.get(name) is None else float(values[name]) for name in ANALYTE_NAMES]])
+
+
+def render(plan: str, messages: List[str]) -> str:
+    text = PLANS[plan]
+    body = messages or ([text.empty] if text.empty else [])
+    return text.prefix + text.separator.join(text.lead + body + text.footer)
+
+
+def recommend(plan: str, values: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> str:
+    """Recommendations of a plan for the blood values of one report"""
+    engine = ENGINES[plan]
+    fired = engine.evaluate(
+        values_row(values),
+        np.array([np.nan if age is None else float(age)]),
+        np.array([gender_code(gender)]),
+    )
+    return render(plan, engine.messages(fired[0]))
+
+
+def screen_matrix(matrix: np.ndarray, plans: Sequence[str] = tuple(PLANS)) -> Dict:
+    """Number of reports each rule fires for, matrix has the columns of analytics.load_cohort_matrix"""
+    age, gender, values = matrix[:, 1], matrix[:, 2], matrix[:, 3:]
+    rules = []
+    for plan in plans:
+        engine = ENGINES[plan]
+        counts = engine.evaluate(values, age, gender).sum(axis=0)
+        for rule, count in zip(engine.rules, counts):
+            rules.append({
+                "plan": plan,
+                "group": rule.group,
+                "analyte": rule.analyte,
+                "comparator": rule.comparator,
+                "threshold": rule.threshold,
+                "genders": list(rule.genders),
+                "min_age": rule.min_age,
+                "max_age": rule.max_age,
+                "reports": int(count),
+            })
+    return {"reports": int(matrix.shape[0]), "rules": rules}
+
+
+def screen_population(engine, plans: Optional[Sequence[str]] = None) -> Dict:
+    """Run the rules on every stored report, with the cohort matrix of the analytics"""
+    plans = list(plans or PLANS)
+    unknown = [plan for plan in plans if plan not in PLANS]
+    if unknown:
+        raise ValueError(f"Unknown plans: {', '.join(unknown)}")
+    return screen_matrix(cohort_matrix(engine), plans)
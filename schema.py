@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 from pydantic import BaseModel, EmailStr
 
@@ -43,3 +43,29 @@ class AnalysisResponse(BaseModel):
 class AnalysisRequest(BaseModel):
     user_email: EmailStr
     query: str
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    report_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+class TrendResponse(BaseModel):
+    analyte: str
+    unit: Optional[str] = None
+    count: int
+    first_at: datetime
+    last_at: datetime
+    last_value: float
+    previous_value: Optional[float] = None
+    delta: Optional[float] = None
+    rolling_mean: float
+    slope_per_day: Optional[float] = None
+
+class Page(BaseModel):
+    items: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
+    has_more: bool
@@ -0,0 +1,41 @@
+"""Every test session gets its own database and cache directories, set before the modules read them."""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="medical-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["REPORT_CACHE_DIR"] = os.path.join(_tmp, "reports")
+os.environ["RATE_LIMIT_DB"] = os.path.join(_tmp, "rate_limits.db")
+os.environ["CREW_MEMORY_DIR"] = os.path.join(_tmp, "crew_memory")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+
+
+@pytest.fixture(scope="session")
+def tables():
+    from database.models import create_tables
+    create_tables()
+
+
+@pytest.fixture
+def db(tables):
+    from database.models import SessionLocal
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def user(db):
+    """A new user for each test, so the tests do not see each other's rows"""
+    from database.operations import create_user
+    return create_user(db, "Test User", f"{uuid.uuid4().hex}@example.com", 45, "female")
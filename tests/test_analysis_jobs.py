@@ -0,0 +1,104 @@
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from database.models import AnalysisJob, BloodTestReport, utcnow
+from database.operations import claim_analysis_job, create_analysis_job, delete_user, get_analysis_job
+from jobs import analysis_jobs
+
+
+def _job(db, user, owner):
+    return create_analysis_job(db, str(uuid.uuid4()), user.id, "report.pdf", "missing.pdf", "query", owner)
+
+
+def test_job_is_claimed_once(db, user):
+    job = _job(db, user, "worker-a")
+    assert claim_analysis_job(db, job.id, "worker-b") is None
+    assert claim_analysis_job(db, job.id, "worker-a").status == "running"
+    assert claim_analysis_job(db, job.id, "worker-a") is None
+
+
+def test_failed_crew_run_marks_job_failed_without_report(db, user, monkeypatch):
+    def run_medical_analysis(*args):
+        raise TimeoutError("No crew free")
+
+    monkeypatch.setattr(analysis_jobs, "load_crew", lambda: SimpleNamespace(run_medical_analysis=run_medical_analysis))
+    job = _job(db, user, "worker-a")
+    with pytest.raises(TimeoutError):
+        analysis_jobs.process_analysis_job(job.id, "worker-a")
+
+    db.expire_all()
+    job = get_analysis_job(db, job.id)
+    assert job.status == "failed"
+    assert job.error == "No crew free"
+    assert db.query(BloodTestReport).filter(BloodTestReport.user_id == user.id).count() == 0
+
+
+def _record_submissions(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(analysis_jobs, "get_executor", lambda: type("Executor", (), {
+        "submit": staticmethod(lambda fn, job_id, owner: submitted.append((job_id, owner)))})())
+    return submitted
+
+
+def test_restart_within_the_lease_resumes_the_released_jobs(db, user, monkeypatch):
+    monkeypatch.setattr(analysis_jobs, "WORKER_ID", "old-worker")
+    queued = _job(db, user, "old-worker")
+    running = _job(db, user, "old-worker")
+    claim_analysis_job(db, running.id, "old-worker")
+    analysis_jobs.shutdown_executor()
+
+    ### the new process starts a few seconds later, well within JOB_LEASE_SECONDS
+    monkeypatch.setattr(analysis_jobs, "WORKER_ID", "new-worker")
+    submitted = _record_submissions(monkeypatch)
+    resumed = analysis_jobs.resume_unfinished_jobs()
+
+    assert queued.id in resumed and (queued.id, "new-worker") in submitted
+    ### the running job may still finish in the old process, it waits for the lease to expire
+    assert running.id not in resumed
+    db.expire_all()
+    assert get_analysis_job(db, queued.id).owner == "new-worker"
+
+
+def test_heartbeat_takes_over_the_jobs_of_a_worker_which_died(db, user, monkeypatch):
+    crashed = _job(db, user, "crashed-worker")
+    submitted = _record_submissions(monkeypatch)
+    ### the worker died right after queueing the job, its lease is still live at startup
+    assert crashed.id not in analysis_jobs.resume_unfinished_jobs()
+
+    db.query(AnalysisJob).filter(AnalysisJob.id == crashed.id).update(
+        {"heartbeat_at": utcnow() - timedelta(seconds=analysis_jobs.JOB_LEASE_SECONDS + 1)})
+    db.commit()
+    analysis_jobs.job_heartbeat()
+
+    assert (crashed.id, analysis_jobs.WORKER_ID) in submitted
+    db.expire_all()
+    assert get_analysis_job(db, crashed.id).owner == analysis_jobs.WORKER_ID
+
+
+def test_resume_skips_jobs_with_a_live_lease(db, user, monkeypatch):
+    live = _job(db, user, "live-worker")
+    stale = _job(db, user, "dead-worker")
+    db.query(AnalysisJob).filter(AnalysisJob.id == stale.id).update(
+        {"status": "running", "heartbeat_at": utcnow() - timedelta(hours=1)})
+    db.commit()
+
+    submitted = _record_submissions(monkeypatch)
+    resumed = analysis_jobs.resume_unfinished_jobs()
+
+    assert stale.id in resumed and live.id not in resumed
+    assert (stale.id, analysis_jobs.WORKER_ID) in submitted
+    db.expire_all()
+    assert get_analysis_job(db, stale.id).owner == analysis_jobs.WORKER_ID
+    assert get_analysis_job(db, live.id).owner == "live-worker"
+    ### a second worker starting now finds the lease renewed and leaves the job alone
+    assert stale.id not in analysis_jobs.resume_unfinished_jobs()
+
+
+def test_deleting_the_user_deletes_their_jobs(db, user):
+    job_id = _job(db, user, "worker-a").id
+    assert delete_user(db, user.id)
+    db.expire_all()
+    assert get_analysis_job(db, job_id) is None
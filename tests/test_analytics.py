@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+
+from analytics import (ANALYTE_NAMES, GENDERS, CohortMatrixCache, abnormal_mask, cohort_statistics,
+                       create_analytics_changes, load_cohort_matrix)
+from database.models import Base
+from rules import recommend
+
+MALE, FEMALE = GENDERS.index("male"), GENDERS.index("female")
+
+
+def test_upper_bounds_match_the_rules():
+    analytes = ["hemoglobin", "tsh", "total_cholesterol"]
+    values = np.array([
+        [17.0, 4.78, 199.9],  # on the strict upper bounds: normal, the rules use >
+        [17.1, 4.79, 200.0],  # above them, and cholesterol from 200 on (>= in the rules)
+        [12.9, 0.54, np.nan],  # below the lower bounds, missing is never abnormal
+    ])
+    age, gender = np.full(3, 40.0), np.full(3, MALE)
+    assert abnormal_mask(values, analytes, age, gender).tolist() == [
+        [False, False, False],
+        [True, True, True],
+        [True, True, False],
+    ]
+
+
+def test_hemoglobin_ranges_follow_the_gender():
+    values = np.array([[12.5], [12.5], [16.0], [16.0], [12.5]])
+    age = np.array([40.0, 40.0, 40.0, 40.0, np.nan])
+    gender = np.array([FEMALE, MALE, FEMALE, MALE, GENDERS.index("unknown")])
+    assert abnormal_mask(values, ["hemoglobin"], age, gender)[:, 0].tolist() == [False, True, True, False, True]
+
+
+def test_cohort_rates_agree_with_the_recommendations():
+    rng = np.random.default_rng(3)
+    rows = 200
+    age = rng.choice([np.nan, 25.0, 45.0, 70.0], rows)
+    gender = rng.choice([0, MALE, FEMALE], rows).astype(np.float64)
+    values = rng.normal(14.0, 2.0, (rows, len(ANALYTE_NAMES)))
+    matrix = np.column_stack([np.arange(1, rows + 1), age, gender, values])
+
+    stats = cohort_statistics(matrix, ["hemoglobin"])
+    normal = "Hemoglobin levels are normal"
+    flagged = sum(
+        normal not in recommend("nutrition", {"hemoglobin": value}, None if np.isnan(a) else int(a), GENDERS[int(g)])
+        for value, a, g in zip(values[:, 0], age, gender)
+    )
+    assert stats["analytes"]["hemoglobin"]["abnormal_rate"] == round(flagged / rows, 4)
+
+
+@pytest.fixture
+def cohort_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cohorts.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        create_analytics_changes(conn)
+        conn.exec_driver_sql("INSERT INTO users (id, name, age, gender) VALUES (1, 'a', 30, 'male'), (2, 'b', 50, 'female')")
+        conn.exec_driver_sql(
+            "INSERT INTO blood_test_reports (id, user_id, hemoglobin) VALUES (?, ?, ?)",
+            [(i, 1 + i % 2, 12.0 + i / 10) for i in range(1, 21)])
+    yield engine
+    engine.dispose()
+
+
+def _cached_matches_a_reload(engine, cache):
+    with engine.connect() as conn:
+        cached, fresh = cache.get(conn), load_cohort_matrix(conn)
+    return np.array_equal(cached, fresh, equal_nan=True)
+
+
+def test_cache_applies_updates_and_deletes_without_a_reload(cohort_engine, monkeypatch):
+    cache = CohortMatrixCache()
+    assert _cached_matches_a_reload(cohort_engine, cache)
+    with cohort_engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE blood_test_reports SET hemoglobin = 9.5 WHERE id = 4")
+        conn.exec_driver_sql("DELETE FROM blood_test_reports WHERE id IN (7, 20)")
+        conn.exec_driver_sql("UPDATE users SET age = 70 WHERE id = 2")
+        conn.exec_driver_sql("INSERT INTO blood_test_reports (id, user_id, hemoglobin) VALUES (21, 2, 15.0)")
+
+    loads = []
+    monkeypatch.setattr("analytics.load_cohort_matrix",
+                        lambda conn, after_id=0: loads.append(after_id) or load_cohort_matrix(conn, after_id))
+    with cohort_engine.connect() as conn:
+        matrix = cache.get(conn)
+    ### only the reports after the last one were read in full
+    assert loads == [20]
+    assert _cached_matches_a_reload(cohort_engine, cache)
+    assert matrix[:, 0].tolist() == [i for i in range(1, 22) if i not in (7, 20)]
+    assert matrix[matrix[:, 0] == 4, 3].tolist() == [9.5]
+    assert set(matrix[matrix[:, 2] == GENDERS.index("female"), 1]) == {70.0}
+
+
+def test_cache_older_than_the_change_log_reloads(cohort_engine):
+    cache = CohortMatrixCache()
+    assert _cached_matches_a_reload(cohort_engine, cache)
+    with cohort_engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE blood_test_reports SET hemoglobin = 9.5 WHERE id = 4")
+        conn.exec_driver_sql("UPDATE blood_test_reports SET hemoglobin = 9.6 WHERE id = 5")
+        ### the change of report 4 was pruned
+        conn.exec_driver_sql("DELETE FROM analytics_changes WHERE seq < (SELECT MAX(seq) FROM analytics_changes)")
+    assert _cached_matches_a_reload(cohort_engine, cache)
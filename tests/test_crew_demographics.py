@@ -0,0 +1,54 @@
+"""The crew path with a female patient: task descriptions and tool results use her reference ranges.
+
+The model is replaced by a scripted one: the nutritionist calls nutrition_analyzer without a user id and
+answers with the tool result, every other agent answers at once.
+"""
+import json
+
+import pytest
+
+pytest.importorskip("crewai_tools", reason="the crew stack can not be imported", exc_type=ImportError)
+
+from agents.cached_llm import CachedLLM  # noqa: E402
+from crew import medical_crew  # noqa: E402
+
+NUTRITIONIST = "Licensed Clinical Nutritionist"
+
+
+def scripted_call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+    ### the tool result comes back as the last message, the prompt itself only explains the format
+    text = messages if isinstance(messages, str) else str(messages[-1].get("content", ""))
+    if self.agent_role != NUTRITIONIST:
+        return f"Thought: I know the answer\nFinal Answer: answer of the {self.agent_role}"
+    if "Observation:" not in text:
+        return ("Thought: I should check the nutrition rules\nAction: nutrition_analyzer\n"
+                f"Action Input: {json.dumps({'blood_report_data': 'Hemoglobin 12.5 g/dL'})}")
+    return f"Thought: I know the answer\nFinal Answer: {text.rsplit('Observation:', 1)[1].strip()}"
+
+
+@pytest.fixture
+def scripted_crew(monkeypatch):
+    ### no memory, so no embedding calls
+    monkeypatch.setattr(medical_crew, "LLM_BACKEND", "replay")
+    monkeypatch.setattr(CachedLLM, "call", scripted_call)
+    monkeypatch.setattr(medical_crew, "crew_pool", medical_crew.CrewPool(medical_crew.create_crew, 1, 5))
+
+
+def test_female_patient_gets_female_ranges(scripted_crew):
+    outputs = {}
+    result = medical_crew.run_medical_analysis(
+        "Is my hemoglobin fine?", "data/sample.pdf", lambda output: outputs.setdefault(output.name, output), 45, "female")
+
+    assert all("Patient: female, 45 years old." in output.description for output in outputs.values())
+    nutrition = outputs["nutrition"].raw
+    ### 12.5 g/dL is low for a man (< 13) but normal for a woman (>= 12)
+    assert "Hemoglobin levels are normal" in nutrition
+    assert "Low hemoglobin" not in nutrition
+    assert result.tasks_output[2].raw == nutrition
+
+
+def test_male_patient_gets_male_ranges(scripted_crew):
+    outputs = {}
+    medical_crew.run_medical_analysis(
+        "Is my hemoglobin fine?", "data/sample.pdf", lambda output: outputs.setdefault(output.name, output), 45, "male")
+    assert "Low hemoglobin" in outputs["nutrition"].raw
@@ -0,0 +1,26 @@
+import re
+
+import pytest
+
+from extractor import extract_blood_values
+
+
+def _baseline_hemoglobin(content):
+    """The hemoglobin regex the extractor replaced, case insensitive over the label and the unit"""
+    match = re.search(r'Hemoglobin.*?(\d+\.?\d*)\s*g/dL', content, re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+@pytest.mark.parametrize("line", [
+    "Hemoglobin 13.5 g/dL",
+    "Hemoglobin 13.5 g/dl",
+    "HEMOGLOBIN 13.5 G/DL",
+    "hemoglobin (Hb) 13.5 G/dL 13.0 - 17.0",
+])
+def test_hemoglobin_unit_case_matches_baseline(line):
+    assert extract_blood_values(line).get("hemoglobin") == _baseline_hemoglobin(line) == 13.5
+
+
+def test_case_sensitive_analytes_keep_their_case():
+    values = extract_blood_values("HDL Cholesterol 45 mg/dL\nLDL Cholesterol 120 MG/DL\nTSH 2.1 μIU/mL")
+    assert values == {"hdl_cholesterol": 45.0, "tsh": 2.1}
@@ -0,0 +1,125 @@
+import pytest
+from sqlalchemy import Column, DateTime, Float, Integer, String, Text, create_engine, text
+from sqlalchemy.orm import declarative_base
+
+from database import models
+
+### the tables as the first version of the app created them, without foreign keys
+BaselineBase = declarative_base()
+
+
+class BaselineUser(BaselineBase):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    email = Column(String(100), unique=True, index=True)
+    age = Column(Integer)
+    gender = Column(String(10))
+    created_at = Column(DateTime)
+
+
+class BaselineReport(BaselineBase):
+    __tablename__ = "blood_test_reports"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    file_name = Column(String(255))
+    file_path = Column(String(500))
+    upload_date = Column(DateTime)
+    query = Column(Text)
+    hemoglobin = Column(Float, nullable=True)
+
+
+class BaselineAnalysis(BaselineBase):
+    __tablename__ = "analysis_results"
+    id = Column(Integer, primary_key=True, index=True)
+    report_id = Column(Integer, index=True)
+    analysis_type = Column(String(50))
+    analysis_result = Column(Text)
+    created_at = Column(DateTime)
+
+
+class BaselineJob(BaselineBase):
+    __tablename__ = "analysis_jobs"
+    id = Column(String(36), primary_key=True, index=True)
+    user_id = Column(Integer, index=True)
+    status = Column(String(20), index=True)
+    result = Column(Text, nullable=True)
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    BaselineBase.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, name, email) VALUES (1, 'a', 'a@example.com')"))
+        conn.execute(text(
+            "INSERT INTO blood_test_reports (id, user_id, file_name, hemoglobin) VALUES "
+            "(1, 1, 'kept.pdf', 13.5), (2, 99, 'orphan.pdf', 12.0), (3, NULL, 'no_user.pdf', 14.0)"))
+        conn.execute(text(
+            "INSERT INTO analysis_results (id, report_id, analysis_type) VALUES "
+            "(1, 1, 'medical'), (2, 2, 'medical'), (3, 42, 'nutrition')"))
+        conn.execute(text(
+            "INSERT INTO analysis_jobs (id, user_id, status, result) VALUES "
+            "('1', 1, 'completed', '{}'), ('2', 99, 'completed', '{}')"))
+    yield engine
+    engine.dispose()
+
+
+def _foreign_keys(engine, table):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(f"PRAGMA foreign_key_list({table})").fetchall()
+
+
+def _ids(engine, table):
+    with engine.connect() as conn:
+        return [row[0] for row in conn.exec_driver_sql(f"SELECT id FROM {table} ORDER BY id")]
+
+
+def test_orphans_stop_the_migration(baseline, monkeypatch):
+    monkeypatch.setattr(models, "DB_MIGRATE_DROP_ORPHANS", False)
+    with pytest.raises(RuntimeError, match="DB_MIGRATE_DROP_ORPHANS"):
+        models._add_sqlite_foreign_keys(baseline)
+    ### rolled back, nothing changed
+    assert _foreign_keys(baseline, "blood_test_reports") == []
+    assert _ids(baseline, "blood_test_reports") == [1, 2, 3]
+    assert _ids(baseline, "analysis_results") == [1, 2, 3]
+    assert _ids(baseline, "analysis_jobs") == ["1", "2"]
+
+
+def test_migration_adds_the_foreign_keys_and_is_idempotent(baseline, monkeypatch):
+    monkeypatch.setattr(models, "DB_MIGRATE_DROP_ORPHANS", True)
+    dropped = models._add_sqlite_foreign_keys(baseline)
+    assert dropped == {"blood_test_reports": 1, "analysis_results": 2, "analysis_jobs": 1}
+
+    assert _foreign_keys(baseline, "blood_test_reports")[0][2:5] == ("users", "user_id", "id")
+    assert _foreign_keys(baseline, "analysis_results")[0][2:5] == ("blood_test_reports", "report_id", "id")
+    assert _foreign_keys(baseline, "analysis_jobs")[0][2:5] == ("users", "user_id", "id")
+    ### the report without a user is not an orphan, the analysis of the dropped report is
+    assert _ids(baseline, "blood_test_reports") == [1, 3]
+    assert _ids(baseline, "analysis_results") == [1]
+    assert _ids(baseline, "analysis_jobs") == ["1"]
+    with baseline.connect() as conn:
+        indexes = {row[1] for row in conn.exec_driver_sql("PRAGMA index_list(blood_test_reports)")}
+    assert "ix_blood_test_reports_user_id_upload_date" in indexes
+
+    assert models._add_sqlite_foreign_keys(baseline) == {}
+    assert _ids(baseline, "blood_test_reports") == [1, 3]
+    assert _ids(baseline, "analysis_results") == [1]
+
+
+def test_cascade_after_migration(baseline, monkeypatch):
+    monkeypatch.setattr(models, "DB_MIGRATE_DROP_ORPHANS", True)
+    models._add_sqlite_foreign_keys(baseline)
+    with baseline.begin() as conn:
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+        conn.exec_driver_sql("DELETE FROM users WHERE id = 1")
+    assert _ids(baseline, "blood_test_reports") == [3]
+    assert _ids(baseline, "analysis_results") == []
+    assert _ids(baseline, "analysis_jobs") == []
+
+
+def test_migration_skips_the_tables_which_do_not_exist_yet(baseline, monkeypatch):
+    monkeypatch.setattr(models, "DB_MIGRATE_DROP_ORPHANS", True)
+    with baseline.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE analysis_jobs")
+    assert "analysis_jobs" not in models._add_sqlite_foreign_keys(baseline)
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.models import BloodTestReport
+from database.pagination import decode_cursor, encode_cursor, keyset_page, keyset_select
+
+
+@pytest.mark.parametrize("moment", [
+    datetime(2024, 1, 1),
+    datetime(2024, 1, 1, 12, 30, 5, 123456),
+    datetime(2024, 12, 31, 23, 59, 59, 1),
+])
+def test_cursor_round_trip(moment):
+    assert decode_cursor(encode_cursor(moment, 42)) == (moment, 42)
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", encode_cursor(datetime(2024, 1, 1), 1)[:-3], "W10"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def _pages(db, user_id, fields, limit):
+    cursor, pages = None, []
+    while True:
+        query = keyset_select(BloodTestReport, BloodTestReport.upload_date, [BloodTestReport.user_id == user_id],
+                              fields, limit, cursor)
+        page = keyset_page(db.execute(query), "upload_date", fields, limit)
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if not page["has_more"]:
+            return pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 50])
+def test_pages_with_tied_timestamps(db, user, limit):
+    ### groups of reports uploaded at the same instant, with and without microseconds
+    moments = [datetime(2024, 1, 1), datetime(2024, 1, 1, 0, 0, 0, 500), datetime(2024, 2, 1, 8)]
+    reports = [
+        BloodTestReport(user_id=user.id, file_name=f"{i}.pdf", upload_date=moments[i % 3])
+        for i in range(12)
+    ]
+    db.add_all(reports)
+    db.commit()
+    expected = [r.id for r in sorted(reports, key=lambda r: (r.upload_date, r.id), reverse=True)]
+
+    pages = _pages(db, user.id, ["id", "file_name"], limit)
+    ids = [item["id"] for page in pages for item in page["items"]]
+    assert ids == expected
+    assert all(len(page["items"]) <= limit for page in pages)
+    assert pages[-1]["next_cursor"] is None
+    ### only the asked fields come back
+    assert set(pages[0]["items"][0]) == {"id", "file_name"}
+
+
+def test_cursor_is_exclusive(db, user):
+    moment = datetime(2023, 5, 5, 5, 5, 5)
+    reports = [BloodTestReport(user_id=user.id, file_name="x.pdf", upload_date=moment) for _ in range(3)]
+    db.add_all(reports)
+    db.commit()
+    newest = max(r.id for r in reports)
+    query = keyset_select(BloodTestReport, BloodTestReport.upload_date, [BloodTestReport.user_id == user.id],
+                          ["id"], 10, encode_cursor(moment, newest))
+    assert [item["id"] for item in keyset_page(db.execute(query), "upload_date", ["id"], 10)["items"]] == \
+        sorted((r.id for r in reports if r.id != newest), reverse=True)
+    ### a cursor before every row gives an empty last page
+    query = keyset_select(BloodTestReport, BloodTestReport.upload_date, [BloodTestReport.user_id == user.id],
+                          ["id"], 10, encode_cursor(moment - timedelta(days=1), 0))
+    assert keyset_page(db.execute(query), "upload_date", ["id"], 10) == {"items": [], "next_cursor": None, "has_more": False}
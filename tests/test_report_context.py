@@ -0,0 +1,56 @@
+from benchmarks.synthetic import PAGE_FOOTER, PAGE_HEADER
+from report_context import FULL_CONTEXT_NOTE, format_summary, task_context
+
+
+def _report(pages):
+    text = "\n\n".join(PAGE_HEADER + body + PAGE_FOOTER.format(page=page, pages=len(pages))
+                       for page, body in enumerate(pages, 1))
+    return {"pages": len(pages), "text": text, "blood_values": {}}
+
+
+def test_rows_carry_the_lab_reference_range():
+    report = _report(["Hemoglobin 12.50 g/dL 12.00 - 15.50\n", "TSH 2.10 μIU/mL 0.55 - 4.78\n"])
+    summary = format_summary(report, 45, "female")
+    assert "Hemoglobin | 12.5 g/dL | 12.00 - 15.50 | normal" in summary
+    assert "TSH | 2.1 μIU/mL | 0.55 - 4.78 | normal" in summary
+    ### 12.5 g/dL is low for a man, the flag follows the rules of the patient
+    assert "Hemoglobin | 12.5 g/dL | 12.00 - 15.50 | LOW" in format_summary(report, 45, "male")
+
+
+def test_header_and_footer_are_printed_once():
+    summary = format_summary(_report(["Hemoglobin 13.50 g/dL 13.00 - 17.00\n"] * 3))
+    assert summary.count("LPL-NATIONAL REFERENCE LAB") == 1
+    assert summary.count("for possible remedial action.") == 1
+    assert "Page 2 of 3" not in summary
+
+
+def test_table_covering_the_report_goes_in_the_task_descriptions():
+    report = _report(["Hemoglobin 13.50 g/dL 13.00 - 17.00\n", "HbA1c 5.30 % 4.00 - 5.60\n"])
+    assert "Report lines not extracted" not in format_summary(report)
+    assert task_context(report) == format_summary(report)
+
+
+def test_lines_which_are_not_rows_are_kept():
+    report = _report([
+        "Hemoglobin\n(Photometry)\n 13.00 - 17.00 g/dL15.00\n",
+        "90.00Glucose Fasting  70 - 100 mg/dL\nCreatinine 0.90 mg/dL 0.70 - 1.30\n",
+    ])
+    summary = format_summary(report)
+    for line in ["13.00 - 17.00 g/dL15.00", "90.00Glucose Fasting 70 - 100 mg/dL", "Creatinine 0.90 mg/dL 0.70 - 1.30"]:
+        assert line in summary
+    ### a value printed before its label is not read as the upper bound of the range
+    assert "Glucose Fasting |" not in summary
+    assert "Not extracted: Hemoglobin;" in summary
+    assert "Not found" not in summary
+    assert task_context(report) == FULL_CONTEXT_NOTE
+
+
+def test_sample_report_keeps_every_result():
+    from tools.report_cache import load_report
+
+    summary = format_summary(load_report("data/sample.pdf"))
+    for line in ["13.00 - 17.00 g/dL15.00", "280.00 pg/mL 211.00 - 911.00", "4.00TSH 0.550 - 4.780 µIU/mL",
+                 "105.00Cholesterol, Total", "46.00HDL Cholesterol"]:
+        assert line in summary
+    assert summary.count("14/5/2023 11:03:00AM") == 1
+    assert "HbA1c | 5.3 % | 4.00 - 5.60 | normal" in summary
@@ -0,0 +1,82 @@
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from database.models import BiomarkerTrend, BloodTestReport
+from database.operations import bulk_create_blood_test_reports, delete_report, update_blood_values
+from database.trends import ROLLING_WINDOW, _days
+
+
+def _trend(db, user_id, analyte):
+    db.expire_all()
+    return db.query(BiomarkerTrend).filter(
+        BiomarkerTrend.user_id == user_id, BiomarkerTrend.analyte == analyte).one_or_none()
+
+
+def _history(db, user_id, analyte):
+    """(date, value) of every stored report of the user, oldest first"""
+    rows = db.query(BloodTestReport.upload_date, getattr(BloodTestReport, analyte)).filter(
+        BloodTestReport.user_id == user_id).all()
+    return sorted((moment, value) for moment, value in rows if value is not None)
+
+
+def _assert_matches_history(db, user_id, analyte):
+    history = _history(db, user_id, analyte)
+    trend = _trend(db, user_id, analyte)
+    days = np.array([_days(moment) for moment, _ in history])
+    values = np.array([value for _, value in history])
+
+    assert trend.count == len(history)
+    assert trend.first_at == history[0][0] and trend.last_at == history[-1][0]
+    assert trend.last_value == pytest.approx(values[-1])
+    assert trend.previous_value == pytest.approx(values[-2])
+    assert trend.delta == pytest.approx(values[-1] - values[-2])
+    assert trend.rolling_mean == pytest.approx(values[-ROLLING_WINDOW:].mean())
+    ### the running sums give the slope of the least squares line through the whole history
+    assert trend.slope_per_day == pytest.approx(np.polyfit(days, values, 1)[0], rel=1e-6, abs=1e-9)
+
+
+@pytest.fixture
+def reports(db, user):
+    rng = random.Random(7)
+    start = datetime(2022, 1, 1)
+    dates = [start + timedelta(days=rng.randint(0, 900), hours=rng.randint(0, 23)) for _ in range(12)]
+    rows = [{"user_id": user.id, "file_name": f"{i}.pdf", "upload_date": moment,
+             "hemoglobin": round(rng.uniform(11, 17), 1), "tsh": round(rng.uniform(0.5, 5), 2)}
+            for i, moment in enumerate(dates)]
+    ### two batches, the second one with reports older than the first: trends accept any date order
+    bulk_create_blood_test_reports(db, rows[6:])
+    bulk_create_blood_test_reports(db, rows[:6])
+    return db.query(BloodTestReport).filter(BloodTestReport.user_id == user.id).order_by(BloodTestReport.id).all()
+
+
+@pytest.mark.parametrize("analyte", ["hemoglobin", "tsh"])
+def test_trend_after_inserts(db, user, reports, analyte):
+    _assert_matches_history(db, user.id, analyte)
+
+
+def test_trend_after_update(db, user, reports):
+    latest = max(reports, key=lambda report: report.upload_date)
+    update_blood_values(db, latest.id, {"hemoglobin": 9.5})
+    _assert_matches_history(db, user.id, "hemoglobin")
+    assert _trend(db, user.id, "hemoglobin").last_value == 9.5
+
+
+def test_trend_after_delete(db, user, reports):
+    latest = max(reports, key=lambda report: report.upload_date)
+    assert delete_report(db, latest.id)
+    _assert_matches_history(db, user.id, "hemoglobin")
+    _assert_matches_history(db, user.id, "tsh")
+
+
+def test_no_slope_for_reports_of_the_same_day(db, user):
+    moment = datetime(2024, 3, 3, 9)
+    bulk_create_blood_test_reports(db, [
+        {"user_id": user.id, "file_name": f"{i}.pdf", "upload_date": moment + timedelta(minutes=i), "hemoglobin": 12.0 + i}
+        for i in range(3)
+    ])
+    trend = _trend(db, user.id, "hemoglobin")
+    assert trend.count == 3 and trend.delta == pytest.approx(1.0)
+    assert trend.slope_per_day is None
@@ -0,0 +1,46 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from main import UploadLimitMiddleware
+
+LIMIT = 1024
+
+
+def _client():
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, max_bytes=LIMIT)
+    parsed = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        parsed.append(file.filename)
+        return {"size": len(await file.read())}
+
+    return TestClient(app), parsed
+
+
+def test_small_upload_is_parsed():
+    client, parsed = _client()
+    response = client.post("/upload", files={"file": ("a.pdf", b"x" * 100, "application/pdf")})
+    assert response.status_code == 200 and response.json() == {"size": 100}
+    assert parsed == ["a.pdf"]
+
+
+def test_content_length_over_limit_is_rejected_before_parsing():
+    client, parsed = _client()
+    response = client.post("/upload", files={"file": ("a.pdf", b"x" * (LIMIT * 4), "application/pdf")})
+    assert response.status_code == 413
+    assert parsed == []
+
+
+def test_chunked_body_over_limit_is_rejected_while_streaming():
+    client, parsed = _client()
+
+    def body():
+        for _ in range(100):
+            yield b"x" * 256
+
+    response = client.post("/upload", content=body(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+    assert response.json()["detail"] == f"Request body is larger than {LIMIT} bytes"
+    assert parsed == []
@@ -1,124 +1,98 @@
 import os
 import asyncio
+from contextvars import ContextVar
 from dotenv import load_dotenv
 load_dotenv()
 
 from crewai_tools import SerperDevTool
 from crewai.tools import BaseTool
-from langchain_community.document_loaders import PyPDFLoader
-from typing import Type, Dict, Optional
+from typing import Type, Dict, Optional, Tuple
 from pydantic import BaseModel, Field
-import re
 
 # Database imports
 from sqlalchemy.orm import Session
-from database.models import SessionLocal, BloodTestReport
+from database.models import SessionLocal, BloodTestReport, User
 from database.operations import update_blood_values
+from tools.report_cache import load_report
+from report_context import report_context
+from extractor import extract_blood_values
+from rules import recommend
+from replay import record_key, search_recordings
+from ratelimit import serper_limiter
+from metrics import SEARCH_REQUEST_SECONDS, TOOL_INVOCATIONS
+
+### age and gender of the patient of the running analysis, set by run_medical_analysis for the whole crew
+### run (a context variable, so concurrent runs each see their own patient)
+run_demographics: ContextVar[Tuple[Optional[int], Optional[str]]] = ContextVar("run_demographics", default=(None, None))
+
+def user_demographics(user_id: Optional[int]) -> Tuple[Optional[int], Optional[str]]:
+    """Age and gender of a user, those of the patient of the running analysis without user_id"""
+    if not user_id:
+        return run_demographics.get()
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        return (user.age, user.gender) if user else (None, None)
+    finally:
+        db.close()
 
 ## Serper tool for internet search
-search_tool = SerperDevTool(n=3)
+class RecordedSerperDevTool(SerperDevTool):
+    """Serper search which is recorded or replayed with SEARCH_BACKEND (see replay.py), live searches draw from the shared rate limit"""
+
+    def _make_api_request(self, search_query: str, search_type: str) -> dict:
+        with SEARCH_REQUEST_SECONDS.time():
+            return search_recordings.call(
+                record_key(search_query, search_type, self.n_results, self.country, self.location, self.locale),
+                {"search_query": search_query, "search_type": search_type},
+                lambda: serper_limiter.call(lambda: SerperDevTool._make_api_request(self, search_query, search_type)),
+                lambda: {"organic": []},
+            )
+
+    def _run(self, **kwargs):
+        TOOL_INVOCATIONS.labels(self.name).inc()
+        return super()._run(**kwargs)
+
+search_tool = RecordedSerperDevTool(n=3)
 
 ## PDF reader tool to read the pdf data
 class PDFReaderInput(BaseModel):
     """Input schema for PDF Reader tool."""
     path: str = Field(..., description="Path of the pdf file")
     report_id: Optional[int] = Field(None, description="Database report ID for storing extracted values")
+    user_id: Optional[int] = Field(None, description="Database user ID, their age and gender select the reference ranges, defaults to the patient of the analysis")
 
 class BloodTestReportTool(BaseTool):
     name: str = "blood_test_reader"
     description: str = "Tool to read and extract the data from the blood test PDF report"
     args_schema: Type[BaseModel] = PDFReaderInput
 
-    def _extract_blood_values(self, content: str) -> Dict:
-        """Extract blood test values from the content"""
-        values = {}
-        
-        # Extract hemoglobin
-        hb_match = re.search(r'Hemoglobin.*?(\d+\.?\d*)\s*g/dL', content, re.IGNORECASE)
-        if hb_match:
-            values['hemoglobin'] = float(hb_match.group(1))
-        
-        # Extract cholesterol values
-        total_chol_match = re.search(r'Cholesterol, Total.*?(\d+\.?\d*)\s*mg/dL', content)
-        if total_chol_match:
-            values['total_cholesterol'] = float(total_chol_match.group(1))
-            
-        hdl_match = re.search(r'HDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', content)
-        if hdl_match:
-            values['hdl_cholesterol'] = float(hdl_match.group(1))
-            
-        ldl_match = re.search(r'LDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', content)
-        if ldl_match:
-            values['ldl_cholesterol'] = float(ldl_match.group(1))
-        
-        # Extract triglycerides
-        trig_match = re.search(r'Triglycerides.*?(\d+\.?\d*)\s*mg/dL', content)
-        if trig_match:
-            values['triglycerides'] = float(trig_match.group(1))
-        
-        # Extract glucose
-        glucose_match = re.search(r'Glucose Fasting.*?(\d+\.?\d*)\s*mg/dL', content)
-        if glucose_match:
-            values['fasting_glucose'] = float(glucose_match.group(1))
-        
-        # Extract HbA1c
-        hba1c_match = re.search(r'HbA1c.*?(\d+\.?\d*)\s*%', content)
-        if hba1c_match:
-            values['hba1c'] = float(hba1c_match.group(1))
-        
-        # Extract Vitamin B12
-        b12_match = re.search(r'VITAMIN B12.*?(\d+\.?\d*)\s*pg/mL', content)
-        if b12_match:
-            values['vitamin_b12'] = float(b12_match.group(1))
-        
-        # Extract Vitamin D
-        vit_d_match = re.search(r'VITAMIN D.*?(\d+\.?\d*)\s*nmol/L', content)
-        if vit_d_match:
-            values['vitamin_d'] = float(vit_d_match.group(1))
-        
-        # Extract thyroid values
-        tsh_match = re.search(r'TSH.*?(\d+\.?\d*)\s*μIU/mL', content)
-        if tsh_match:
-            values['tsh'] = float(tsh_match.group(1))
-        
-        return values
-
-    def _run(self, path: str = 'data/sample.pdf', report_id: Optional[int] = None) -> str:
+    def _run(self, path: str = 'data/sample.pdf', report_id: Optional[int] = None, user_id: Optional[int] = None) -> str:
         """ Tool to read the data from the blood test PDF
         Args:
             path (str): path of the pdf file to read
             report_id (int): Database report ID for storing extracted values
+            user_id (int): Database user ID for the age and gender
         Returns:
-            str: return the blood report content
+            str: return the blood report content, its compact summary with REPORT_CONTEXT=compact
         """
+        TOOL_INVOCATIONS.labels(self.name).inc()
         try:
             # check if file exist or not
             if not os.path.exists(path):
                 return f"Error: File does not exist at {path}"
             
-            # load the pdf using pypdf loader using langchain
-            loader = PyPDFLoader(file_path=path)
-            docs = loader.load()
+            # parse the pdf, or reuse the cached result if this content was seen before
+            report = load_report(path)
             
             ## checking for docs in pdf
-            if not docs:
+            if not report["pages"]:
                 return "Error: No content found in the PDF file"
             
-            full_report = ""
-            for page in docs:
-                content = page.page_content
-                
-                # Clean and format the content
-                content = content.strip()
-                while "\n\n\n" in content:
-                    content = content.replace("\n\n\n", "\n\n")
-                    
-                full_report += content + "\n\n"
-            
             # Extract blood values and save to database if report_id provided
             if report_id:
                 try:
-                    blood_values = self._extract_blood_values(full_report)
+                    blood_values = report["blood_values"]
                     if blood_values:
                         db = SessionLocal()
                         update_blood_values(db, report_id, blood_values)
@@ -126,7 +100,7 @@ class BloodTestReportTool(BaseTool):
                 except Exception as e:
                     print(f"Warning: Could not save blood values to database: {str(e)}")
             
-            return full_report.strip()
+            return report_context(report, *user_demographics(user_id))
             
         except Exception as e:
             return f"Error reading PDF file: {str(e)}"
@@ -135,174 +109,32 @@ class BloodTestReportTool(BaseTool):
 class NutritionAnalysisInput(BaseModel):
     """input schema for Nutrition analyst tool"""
     blood_report_data: str = Field(..., description="Blood report data to analyze for nutritional insights")
+    user_id: Optional[int] = Field(None, description="Database user ID, their age and gender select the reference ranges, defaults to the patient of the analysis")
 
 class NutritionAnalysisTool(BaseTool):
     name: str = "nutrition_analyzer"
     description: str = "Tool to analyze blood report data and provide evidence-based nutritional recommendations"
     args_schema: Type[BaseModel] = NutritionAnalysisInput
 
-    def _extract_test_values(self, blood_report_data: str) -> dict:
-        """Extract specific test values from blood report"""
-        values = {}
-        
-        # Extract hemoglobin
-        hb_match = re.search(r'Hemoglobin.*?(\d+\.?\d*)\s*g/dL', blood_report_data, re.IGNORECASE)
-        if hb_match:
-            values['hemoglobin'] = float(hb_match.group(1))
-        
-        # Extract cholesterol values
-        total_chol_match = re.search(r'Cholesterol, Total.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if total_chol_match:
-            values['total_cholesterol'] = float(total_chol_match.group(1))
-            
-        hdl_match = re.search(r'HDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if hdl_match:
-            values['hdl_cholesterol'] = float(hdl_match.group(1))
-            
-        ldl_match = re.search(r'LDL Cholesterol.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if ldl_match:
-            values['ldl_cholesterol'] = float(ldl_match.group(1))
-        
-        # Extract triglycerides
-        trig_match = re.search(r'Triglycerides.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if trig_match:
-            values['triglycerides'] = float(trig_match.group(1))
-        
-        # Extract glucose
-        glucose_match = re.search(r'Glucose Fasting.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if glucose_match:
-            values['fasting_glucose'] = float(glucose_match.group(1))
-        
-        # Extract HbA1c
-        hba1c_match = re.search(r'HbA1c.*?(\d+\.?\d*)\s*%', blood_report_data)
-        if hba1c_match:
-            values['hba1c'] = float(hba1c_match.group(1))
-        
-        # Extract Vitamin B12
-        b12_match = re.search(r'VITAMIN B12.*?(\d+\.?\d*)\s*pg/mL', blood_report_data)
-        if b12_match:
-            values['vitamin_b12'] = float(b12_match.group(1))
-        
-        # Extract Vitamin D
-        vit_d_match = re.search(r'VITAMIN D.*?(\d+\.?\d*)\s*nmol/L', blood_report_data)
-        if vit_d_match:
-            values['vitamin_d'] = float(vit_d_match.group(1))
-        
-        # Extract thyroid values
-        tsh_match = re.search(r'TSH.*?(\d+\.?\d*)\s*μIU/mL', blood_report_data)
-        if tsh_match:
-            values['tsh'] = float(tsh_match.group(1))
-        
-        return values
+    def recommend(self, values: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> str:
+        """Create the nutrition recommendations from the extracted blood values, see rules.py"""
+        return recommend("nutrition", values, age, gender)
 
-    def _run(self, blood_report_data: str) -> str:
+    def _run(self, blood_report_data: str, user_id: Optional[int] = None) -> str:
         """analyze blood report for nutritional insights
         Args:
             blood_report_data (str): Blood report content
+            user_id (int): Database user ID for the age and gender
         Returns:
             str: Nutrition analysis and recommendations
         """
+        TOOL_INVOCATIONS.labels(self.name).inc()
         try:
             if not blood_report_data:
                 return "Error: No blood report data provided for analysis"
             
-            values = self._extract_test_values(blood_report_data)
-            recommendations = []
-            
-            # Hemoglobin analysis (Normal: 13.0-17.0 g/dL for males)
-            if 'hemoglobin' in values:
-                hb = values['hemoglobin']
-                if hb < 13.0:
-                    recommendations.append("Low hemoglobin detected. Include iron-rich foods: lean red meat, spinach, lentils, and vitamin C-rich foods to enhance iron absorption.")
-                elif hb > 17.0:
-                    recommendations.append("Elevated hemoglobin. Ensure adequate hydration and consider consulting healthcare provider.")
-                else:
-                    recommendations.append("Hemoglobin levels are normal. Maintain balanced iron intake through lean meats, legumes, and leafy greens.")
-            
-            # Cholesterol analysis
-            if 'total_cholesterol' in values:
-                total_chol = values['total_cholesterol']
-                if total_chol >= 200:
-                    recommendations.append("Elevated total cholesterol. Increase soluble fiber intake (oats, beans, apples), omega-3 fatty acids (fatty fish, walnuts), and limit saturated fats.")
-                else:
-                    recommendations.append("Total cholesterol is within healthy range. Continue heart-healthy diet with fruits, vegetables, and whole grains.")
-            
-            if 'hdl_cholesterol' in values:
-                hdl = values['hdl_cholesterol']
-                if hdl < 40:
-                    recommendations.append("Low HDL cholesterol. Increase physical activity, include healthy fats (olive oil, avocados), and omega-3 rich foods.")
-                else:
-                    recommendations.append("HDL cholesterol is adequate. Maintain current healthy fat intake and regular exercise.")
-            
-            if 'ldl_cholesterol' in values:
-                ldl = values['ldl_cholesterol']
-                if ldl >= 100:
-                    recommendations.append("LDL cholesterol is elevated. Focus on plant-based foods, reduce saturated fat, and increase soluble fiber.")
-                else:
-                    recommendations.append("LDL cholesterol is optimal. Continue current dietary patterns.")
-            
-            # Triglycerides analysis
-            if 'triglycerides' in values:
-                trig = values['triglycerides']
-                if trig >= 150:
-                    recommendations.append("Elevated triglycerides. Reduce refined carbohydrates, limit alcohol, increase omega-3 intake, and maintain healthy weight.")
-                else:
-                    recommendations.append("Triglyceride levels are normal. Continue balanced carbohydrate intake and healthy fats.")
-            
-            # Glucose analysis
-            if 'fasting_glucose' in values:
-                glucose = values['fasting_glucose']
-                if glucose >= 100:
-                    recommendations.append("Elevated fasting glucose. Focus on complex carbohydrates, increase fiber intake, limit simple sugars, and maintain portion control.")
-                else:
-                    recommendations.append("Fasting glucose is normal. Continue balanced carbohydrate intake with whole grains and vegetables.")
-            
-            # HbA1c analysis
-            if 'hba1c' in values:
-                hba1c = values['hba1c']
-                if hba1c >= 5.7:
-                    recommendations.append("HbA1c indicates prediabetes risk. Focus on low glycemic index foods, regular meal timing, and weight management.")
-                else:
-                    recommendations.append("HbA1c is normal, indicating good glucose control over past 2-3 months.")
-            
-            # Vitamin B12 analysis
-            if 'vitamin_b12' in values:
-                b12 = values['vitamin_b12']
-                if b12 < 300:
-                    recommendations.append("Vitamin B12 is on the lower side. Include B12-rich foods: fish, meat, dairy, or consider supplementation if vegetarian.")
-                else:
-                    recommendations.append("Vitamin B12 levels are adequate. Continue current intake of animal products or fortified foods.")
-            
-            # Vitamin D analysis
-            if 'vitamin_d' in values:
-                vit_d = values['vitamin_d']
-                if vit_d < 75:
-                    recommendations.append("Vitamin D deficiency detected. Increase sun exposure, include fatty fish, fortified dairy, and consider supplementation.")
-                else:
-                    recommendations.append("Vitamin D levels are sufficient. Continue current sun exposure and dietary sources.")
-            
-            # Thyroid analysis
-            if 'tsh' in values:
-                tsh = values['tsh']
-                if tsh > 4.78:
-                    recommendations.append("Elevated TSH may indicate thyroid dysfunction. Ensure adequate iodine intake through iodized salt and seafood.")
-                elif tsh < 0.55:
-                    recommendations.append("Low TSH detected. Monitor thyroid function and avoid excessive iodine intake.")
-                else:
-                    recommendations.append("TSH levels are normal, indicating healthy thyroid function.")
-            
-            if not recommendations:
-                recommendations.append("All measured parameters appear normal. Maintain a balanced diet with variety of nutrients.")
-            
-            # Add general recommendations
-            recommendations.append("\nGeneral Recommendations:")
-            recommendations.append("• Stay hydrated with 8-10 glasses of water daily")
-            recommendations.append("• Include 5 servings of fruits and vegetables daily")
-            recommendations.append("• Choose whole grains over refined grains")
-            recommendations.append("• Limit processed foods and added sugars")
-            recommendations.append("• Include lean proteins in each meal")
-            
-            return "NUTRITIONAL ANALYSIS BASED ON BLOOD REPORT:\n\n" + "\n\n".join(recommendations)
+            values = extract_blood_values(blood_report_data)
+            return self.recommend(values, *user_demographics(user_id))
             
         except Exception as e:
             return f"Error in nutrition analysis: {str(e)}"
@@ -311,148 +143,34 @@ class NutritionAnalysisTool(BaseTool):
 class ExercisePlanningInput(BaseModel):
     """inout schema for exercise plainning tool."""
     blood_report_data: str = Field(..., description="blood report data to analyze and recomment exercise")
+    user_id: Optional[int] = Field(None, description="Database user ID, their age and gender select the reference ranges, defaults to the patient of the analysis")
 
 class ExercisePlanningTool(BaseTool):
     name: str = "exercise_planner"
     description: str = "tool to create the exercise planning on the basis of the report data"
     args_schema: Type[BaseModel] = ExercisePlanningInput
 
-    def _extract_test_values(self, blood_report_data: str) -> dict:
-        """Extract test values from the report to recommend exercise"""
-        values = {}
-        
-        # Extract key values for exercise planning
-        hb_match = re.search(r'Hemoglobin.*?(\d+\.?\d*)\s*g/dL', blood_report_data, re.IGNORECASE)
-        if hb_match:
-            values['hemoglobin'] = float(hb_match.group(1))
-        
-        glucose_match = re.search(r'Glucose Fasting.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if glucose_match:
-            values['fasting_glucose'] = float(glucose_match.group(1))
-        
-        hba1c_match = re.search(r'HbA1c.*?(\d+\.?\d*)\s*%', blood_report_data)
-        if hba1c_match:
-            values['hba1c'] = float(hba1c_match.group(1))
-        
-        total_chol_match = re.search(r'Cholesterol, Total.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if total_chol_match:
-            values['total_cholesterol'] = float(total_chol_match.group(1))
-        
-        trig_match = re.search(r'Triglycerides.*?(\d+\.?\d*)\s*mg/dL', blood_report_data)
-        if trig_match:
-            values['triglycerides'] = float(trig_match.group(1))
-        
-        tsh_match = re.search(r'TSH.*?(\d+\.?\d*)\s*μIU/mL', blood_report_data)
-        if tsh_match:
-            values['tsh'] = float(tsh_match.group(1))
-        
-        return values
+    def recommend(self, values: Dict, age: Optional[int] = None, gender: Optional[str] = None) -> str:
+        """Create the exercise plan from the extracted blood values, see rules.py"""
+        return recommend("exercise", values, age, gender)
 
-    def _run(self, blood_report_data: str) -> str:
+    def _run(self, blood_report_data: str, user_id: Optional[int] = None) -> str:
         """Create exercise plan based on blood report
         
         Args:
             blood_report_data (str): Blood report content
+            user_id (int): Database user ID for the age and gender
             
         Returns:
             str: Exercise recommendations
         """
+        TOOL_INVOCATIONS.labels(self.name).inc()
         try:
             if not blood_report_data:
                 return "Error: No blood report data provided for exercise planning"
             
-            values = self._extract_test_values(blood_report_data)
-            recommendations = []
-            
-            # Base exercise recommendations for 30-year-old male
-            recommendations.append("PERSONALIZED EXERCISE PLAN BASED ON BLOOD REPORT:")
-            recommendations.append("\nBased on your blood test results, here are tailored exercise recommendations:")
-            
-            # Cardiovascular health recommendations
-            if 'total_cholesterol' in values or 'triglycerides' in values:
-                total_chol = values.get('total_cholesterol', 0)
-                triglycerides = values.get('triglycerides', 0)
-                
-                if total_chol >= 200 or triglycerides >= 150:
-                    recommendations.append("\n• CARDIOVASCULAR FOCUS (Elevated Cholesterol/Triglycerides):")
-                    recommendations.append("  - Moderate-intensity cardio: 150 minutes/week (brisk walking, cycling)")
-                    recommendations.append("  - High-intensity interval training (HIIT): 2-3 sessions/week, 20-30 minutes")
-                    recommendations.append("  - Swimming or elliptical: 3-4 times/week, 30-45 minutes")
-                else:
-                    recommendations.append("\n• CARDIOVASCULAR MAINTENANCE:")
-                    recommendations.append("  - Regular cardio: 120-150 minutes/week (running, cycling, swimming)")
-                    recommendations.append("  - Mix of moderate and vigorous intensity exercises")
-            
-            # Glucose management recommendations
-            if 'fasting_glucose' in values or 'hba1c' in values:
-                glucose = values.get('fasting_glucose', 0)
-                hba1c = values.get('hba1c', 0)
-                
-                if glucose >= 100 or hba1c >= 5.7:
-                    recommendations.append("\n• GLUCOSE MANAGEMENT (Elevated Blood Sugar):")
-                    recommendations.append("  - Post-meal walks: 10-15 minutes after each meal")
-                    recommendations.append("  - Resistance training: 3 times/week, focusing on major muscle groups")
-                    recommendations.append("  - Avoid prolonged sitting; take movement breaks every hour")
-                    recommendations.append("  - Monitor blood sugar before and after exercise initially")
-                else:
-                    recommendations.append("\n• METABOLIC HEALTH MAINTENANCE:")
-                    recommendations.append("  - Regular strength training: 2-3 times/week")
-                    recommendations.append("  - Compound exercises: squats, deadlifts, push-ups")
-            
-            # Energy and endurance recommendations based on hemoglobin
-            if 'hemoglobin' in values:
-                hb = values['hemoglobin']
-                if hb < 13.0:
-                    recommendations.append("\n• ENERGY MANAGEMENT (Lower Hemoglobin):")
-                    recommendations.append("  - Start with low-intensity exercises")
-                    recommendations.append("  - Gradually increase intensity as iron levels improve")
-                    recommendations.append("  - Focus on breathing exercises and yoga")
-                    recommendations.append("  - Avoid overexertion; listen to your body")
-                else:
-                    recommendations.append("\n• PERFORMANCE OPTIMIZATION:")
-                    recommendations.append("  - High-intensity workouts are well-tolerated")
-                    recommendations.append("  - Include both aerobic and anaerobic training")
-            
-            # Thyroid-related exercise modifications
-            if 'tsh' in values:
-                tsh = values['tsh']
-                if tsh > 4.78:
-                    recommendations.append("\n• THYROID CONSIDERATIONS (Elevated TSH):")
-                    recommendations.append("  - Start slowly and build exercise tolerance gradually")
-                    recommendations.append("  - Focus on consistent, moderate-intensity exercise")
-                    recommendations.append("  - Include stress-reducing activities like yoga or tai chi")
-                elif tsh < 0.55:
-                    recommendations.append("\n• THYROID CONSIDERATIONS (Low TSH):")
-                    recommendations.append("  - Monitor heart rate during exercise")
-                    recommendations.append("  - Avoid excessive high-intensity training")
-                    recommendations.append("  - Include calming exercises like stretching or meditation")
-            
-            # Weekly exercise schedule
-            recommendations.append("\n• SUGGESTED WEEKLY SCHEDULE:")
-            recommendations.append("  Monday: Full-body strength training (45-60 minutes)")
-            recommendations.append("  Tuesday: Cardio workout (30-45 minutes)")
-            recommendations.append("  Wednesday: Yoga or flexibility training (30-45 minutes)")
-            recommendations.append("  Thursday: Upper body strength + core (45-60 minutes)")
-            recommendations.append("  Friday: HIIT or circuit training (30-40 minutes)")
-            recommendations.append("  Saturday: Outdoor activity (hiking, sports, cycling)")
-            recommendations.append("  Sunday: Active recovery (light walk, stretching)")
-            
-            # Important safety notes
-            recommendations.append("\n• IMPORTANT SAFETY NOTES:")
-            recommendations.append("  - Warm up for 5-10 minutes before exercising")
-            recommendations.append("  - Cool down and stretch after workouts")
-            recommendations.append("  - Stay hydrated throughout exercise")
-            recommendations.append("  - Progress gradually; avoid sudden intensity increases")
-            recommendations.append("  - Consult healthcare provider before starting intense exercise program")
-            
-            # Monitoring recommendations
-            recommendations.append("\n• MONITORING & FOLLOW-UP:")
-            recommendations.append("  - Track energy levels and exercise tolerance")
-            recommendations.append("  - Retest blood parameters in 3-6 months")
-            recommendations.append("  - Adjust exercise intensity based on how you feel")
-            recommendations.append("  - Keep a workout log to track progress")
-            
-            return "\n".join(recommendations)
+            values = extract_blood_values(blood_report_data)
+            return self.recommend(values, *user_demographics(user_id))
             
         except Exception as e:
             return f"Error in exercise planning: {str(e)}"
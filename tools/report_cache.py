@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from extractor import extract_blood_values
+from metrics import STAGE_SECONDS
+
+### Cache configuration
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", os.path.join(".cache", "reports"))
+REPORT_CACHE_MEMORY_BYTES = int(os.getenv("REPORT_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+REPORT_CACHE_DISK_BYTES = int(os.getenv("REPORT_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Get the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_pages(pages) -> str:
+    """Join the page texts and clean extra blank lines"""
+    full_report = ""
+    for content in pages:
+        # Clean and format the content
+        content = content.strip()
+        while "\n\n\n" in content:
+            content = content.replace("\n\n\n", "\n\n")
+
+        full_report += content + "\n\n"
+    return full_report.strip()
+
+
+class ReportCache:
+    """Content addressed LRU cache of parsed reports, kept in memory and on disk.
+
+    Entries are keyed by the SHA-256 of the pdf bytes and hold the normalized
+    text, the number of pages and the extracted blood values.
+    """
+
+    def __init__(self, cache_dir: str = REPORT_CACHE_DIR, memory_bytes: int = REPORT_CACHE_MEMORY_BYTES,
+                 disk_bytes: int = REPORT_CACHE_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    @staticmethod
+    def _entry_size(entry: Dict) -> int:
+        return len(entry["text"]) + 256
+
+    def _remember(self, digest: str, entry: Dict):
+        """Put an entry in memory and evict the least recently used ones"""
+        if digest in self._memory:
+            self._memory.move_to_end(digest)
+            return
+        self._memory[digest] = entry
+        self._memory_size += self._entry_size(entry)
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= self._entry_size(evicted)
+
+    def get(self, digest: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None:
+                self._memory.move_to_end(digest)
+                self.hits += 1
+                return entry
+
+        path = self._entry_path(digest)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            ### mark as recently used for the disk eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self._remember(digest, entry)
+            self.hits += 1
+        return entry
+
+    def put(self, digest: str, entry: Dict):
+        with self._lock:
+            self._remember(digest, entry)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._entry_path(digest)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            print(f"Warning: Could not write report cache entry: {str(e)}")
+
+    def _evict_disk(self):
+        """Remove the least recently used files until the disk budget is met"""
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+
+report_cache = ReportCache()
+
+
+def parse_report(path: str, digest: str = None) -> Dict:
+    """Parse a pdf into a cache entry without looking at the cache"""
+    ### langchain is only imported by the processes which parse reports
+    from langchain_community.document_loaders import PyPDFLoader
+
+    # load the pdf using pypdf loader using langchain
+    with STAGE_SECONDS.labels("pdf_parse").time():
+        docs = PyPDFLoader(file_path=path).load()
+        text = normalize_pages(page.page_content for page in docs)
+    with STAGE_SECONDS.labels("extraction").time():
+        blood_values = extract_blood_values(text) if docs else {}
+    return {
+        "sha256": digest or file_sha256(path),
+        "pages": len(docs),
+        "text": text,
+        "blood_values": blood_values
+    }
+
+
+def load_report(path: str) -> Dict:
+    """Get the parsed report for a pdf, parsing it only if its content was never seen"""
+    digest = file_sha256(path)
+    entry = report_cache.get(digest)
+    if entry is not None:
+        return entry
+
+    entry = parse_report(path, digest)
+    report_cache.put(digest, entry)
+    return entry